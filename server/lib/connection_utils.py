@@ -13,13 +13,21 @@ DESCRIPTION:  utilities used to connect with remote systems
 """
 
 import glob
+import json
 import os
 import sys
+import time
 import uuid
+import atexit
+import hashlib
+import hmac
 import logging
 import tempfile
+import threading
 import subprocess
 import configparser
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from os.path import dirname, realpath
 
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
@@ -35,6 +43,41 @@ _TRANSFER_INT_FIELDS = frozenset([
     'collectionSystem', 'extraDirectory',
 ])
 
+# Seconds an unused pooled SMB mount is kept before it is unmounted
+SMB_MOUNT_IDLE_TIMEOUT = 300
+
+# Seconds a pooled SMB mount may take to answer a health check
+SMB_MOUNT_HEALTH_TIMEOUT = 5
+
+# Seconds an idle shared SSH master connection is kept open (ControlPersist)
+SSH_CONTROL_PERSIST = 300
+
+# Directory holding the shared SSH master connection sockets
+SSH_CONTROL_DIR = os.path.join(tempfile.gettempdir(), 'openvdm_ssh')
+
+# Per-file record written by rsync (see run_rsync): itemize string, file
+# length, mtime, bytes transferred and name.  The name is last so it may
+# contain the delimiter.
+RSYNC_RECORD_MARKER = b'::OVDM::'
+RSYNC_OUT_FORMAT = f"--out-format={RSYNC_RECORD_MARKER.decode()}%i|%l|%M|%b|%n"
+
+# Bytes read from rsync's stdout at a time
+RSYNC_READ_SIZE = 64 * 1024
+
+# Directory holding cached collection system transfer source test results
+CST_TEST_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'openvdm_cst_tests')
+
+# Default number of seconds a passing source test result is reused
+CST_TEST_CACHE_TTL = 300
+
+# Collection system transfer fields that affect the outcome of test_cst_source
+_CST_TEST_FIELDS = (
+    'transferType', 'localDirIsMountPoint', 'removeSourceFiles',
+    'smbServer', 'smbDomain', 'smbUser', 'smbPass',
+    'rsyncServer', 'rsyncUser', 'rsyncPass',
+    'sshServer', 'sshUser', 'sshPass', 'sshUseKey',
+)
+
 
 def has_wildcard(s):
     """Return True if string contains glob special characters (* ? [)."""
@@ -95,13 +138,38 @@ def get_rclone_remote_type(remote_name, config_path=None):
         return remote_section.get('type', 'local')
 
 
+def ssh_control_options():
+    """
+    Return the ssh options that route every ssh session to the same user and
+    host through one shared OpenSSH master connection (ControlMaster), kept
+    open for SSH_CONTROL_PERSIST seconds after its last use
+    """
+
+    os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+
+    return [
+        '-o', 'ControlMaster=auto',
+        '-o', f'ControlPath={os.path.join(SSH_CONTROL_DIR, "%C")}',
+        '-o', f'ControlPersist={SSH_CONTROL_PERSIST}'
+    ]
+
+
+def build_rsync_ssh_args():
+    """
+    Return the rsync arguments for rsync-over-ssh using the shared ssh master
+    connection
+    """
+
+    return ['-e', ' '.join(['ssh'] + ssh_control_options())]
+
+
 def check_darwin(cfg):
     """
     Return true if server is MacOS (Darwin)
     """
 
     cfg = normalize_transfer_config(cfg)
-    cmd = ['ssh', f"{cfg['sshUser']}@{cfg['sshServer']}", "uname -s"]
+    cmd = ['ssh'] + ssh_control_options() + [f"{cfg['sshUser']}@{cfg['sshServer']}", "uname -s"]
     if cfg['sshUseKey'] == 0:
         cmd = ['sshpass', '-p', cfg.get('sshPass', '')] + cmd
 
@@ -183,6 +251,399 @@ def mount_smb_share(cfg, mntpoint, smb_version):
         return False, detail
 
 
+class SMBMountPool:
+    """
+    Reference-counted pool of SMB mounts shared by the jobs of a worker
+    process.
+
+    Mounts are keyed on server/share, domain, credentials and read/write
+    mode.  A mount is health-checked before it is handed out again and
+    unmounted once it has been unused for idle_timeout seconds.  An
+    unhealthy mount is replaced, and unmounted once the jobs still using it
+    release it.  The SMB
+    version negotiated with each server is cached so the server is only
+    probed again when a mount fails.
+    """
+
+    def __init__(self, idle_timeout=SMB_MOUNT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.lock = threading.RLock()
+        self.mounts = {}        # key -> {'mntpoint', 'smb_version', 'refs', 'last_used'}
+        self.retired = []       # unhealthy mounts still in use, unmounted on their last release
+        self.versions = {}      # (server, domain, user) -> smb version
+        self.timer = None
+
+
+    @staticmethod
+    def _mount_key(cfg):
+        cfg = normalize_transfer_config(cfg)
+        secret = hashlib.sha256(str(cfg.get('smbPass', '')).encode()).hexdigest()
+        read_write = 'rw' if cfg.get('removeSourceFiles', 1) == 1 else 'ro'
+        return (cfg['smbServer'], cfg['smbDomain'], cfg['smbUser'], secret, read_write)
+
+
+    def smb_version(self, cfg, refresh=False):
+        """
+        Return (smb_version, detail) for the server in cfg, probing the server
+        only when the version is not cached or refresh is True
+        """
+
+        version_key = (cfg['smbServer'], cfg['smbDomain'], cfg['smbUser'])
+
+        with self.lock:
+            if not refresh and version_key in self.versions:
+                return self.versions[version_key], ""
+
+        smb_version, detail = detect_smb_version(cfg)
+
+        with self.lock:
+            if smb_version:
+                self.versions[version_key] = smb_version
+            else:
+                self.versions.pop(version_key, None)
+
+        return smb_version, detail
+
+
+    @staticmethod
+    def _is_healthy(mntpoint):
+        """
+        Return True if mntpoint is still mounted and responsive
+        """
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(lambda: os.path.ismount(mntpoint) and os.listdir(mntpoint) is not None)
+            return future.result(timeout=SMB_MOUNT_HEALTH_TIMEOUT)
+        except (OSError, FutureTimeoutError):
+            return False
+        finally:
+            executor.shutdown(wait=False)
+
+
+    @staticmethod
+    def _unmount(mntpoint):
+        if os.path.ismount(mntpoint):
+            # lazy unmount so a hung server can't block the worker
+            proc = subprocess.run(['umount', '-l', mntpoint], capture_output=True, text=True, check=False)
+            if proc.returncode != 0:
+                logging.warning("Failed to unmount %s: %s", mntpoint, proc.stderr.strip())
+                return
+            logging.info("Unmounted %s", mntpoint)
+
+        try:
+            os.rmdir(mntpoint)
+        except OSError:
+            pass
+
+
+    def acquire(self, cfg):
+        """
+        Return (mntpoint, smb_version, detail) for the share in cfg, mounting
+        it if needed.  mntpoint is None on failure; smb_version is None if the
+        server could not be reached.  Every successful acquire must be
+        matched by a release(mntpoint).
+
+        The health check and the mount run without holding the pool lock, so
+        a hung server only blocks the jobs using it.
+        """
+
+        key = self._mount_key(cfg)
+
+        with self.lock:
+            entry = self.mounts.get(key)
+            if entry is not None:
+                # hold a reference so the mount is not reaped while it is checked
+                entry['refs'] += 1
+
+        if entry is not None:
+            if self._is_healthy(entry['mntpoint']):
+                logging.debug("Reusing SMB mount %s", entry['mntpoint'])
+                return entry['mntpoint'], entry['smb_version'], ""
+
+            logging.warning("SMB mount %s is unhealthy, remounting", entry['mntpoint'])
+            with self.lock:
+                if self.mounts.get(key) is entry:
+                    # jobs still using it unmount it on release
+                    del self.mounts[key]
+                    self.retired.append(entry)
+                unused = self._drop_ref(entry)
+
+            if unused:
+                self._unmount(entry['mntpoint'])
+
+        mntpoint = tempfile.mkdtemp(prefix='openvdm_smb_')
+
+        smb_version, detail = self.smb_version(cfg)
+        if not smb_version:
+            os.rmdir(mntpoint)
+            return None, None, detail
+
+        success, detail = mount_smb_share(cfg, mntpoint, smb_version)
+        if not success:
+            # the cached version may be stale, probe the server again
+            smb_version, detail = self.smb_version(cfg, refresh=True)
+            if smb_version:
+                success, detail = mount_smb_share(cfg, mntpoint, smb_version)
+
+        if not success:
+            os.rmdir(mntpoint)
+            return None, smb_version, detail
+
+        with self.lock:
+            entry = self.mounts.get(key)
+            if entry is None:
+                self.mounts[key] = {'mntpoint': mntpoint, 'smb_version': smb_version, 'refs': 1, 'last_used': time.time()}
+                return mntpoint, smb_version, ""
+
+            # another job mounted the share meanwhile, share its mount
+            entry['refs'] += 1
+
+        self._unmount(mntpoint)
+        return entry['mntpoint'], entry['smb_version'], ""
+
+
+    def _drop_ref(self, entry):
+        """
+        Release a reference to entry, with the lock held.  Returns True when
+        entry is a retired mount no longer in use, removed from the pool and
+        to be unmounted by the caller.
+        """
+
+        entry['refs'] = max(entry['refs'] - 1, 0)
+        entry['last_used'] = time.time()
+
+        if entry['refs'] == 0 and entry in self.retired:
+            self.retired.remove(entry)
+            return True
+
+        return False
+
+
+    def release(self, mntpoint):
+        """
+        Release a mount returned by acquire
+        """
+
+        unused = False
+
+        with self.lock:
+            for entry in list(self.mounts.values()) + self.retired:
+                if entry['mntpoint'] == mntpoint:
+                    unused = self._drop_ref(entry)
+                    break
+
+            self._schedule_reap()
+
+        if unused:
+            self._unmount(mntpoint)
+
+
+    def invalidate(self, cfg):
+        """
+        Forget the cached SMB version for cfg and unmount its unused mounts
+        """
+
+        with self.lock:
+            self.versions.pop((cfg['smbServer'], cfg['smbDomain'], cfg['smbUser']), None)
+            key = self._mount_key(cfg)
+            entry = self.mounts.get(key)
+            if entry is not None and entry['refs'] == 0:
+                self._unmount(entry['mntpoint'])
+                del self.mounts[key]
+
+
+    def _schedule_reap(self):
+        if self.timer is None and self.mounts:
+            self.timer = threading.Timer(self.idle_timeout, self.reap)
+            self.timer.daemon = True
+            self.timer.start()
+
+
+    def reap(self, force=False):
+        """
+        Unmount unused mounts that have been idle longer than idle_timeout
+        (all unused mounts if force is True)
+        """
+
+        with self.lock:
+            self.timer = None
+            now = time.time()
+            for key, entry in list(self.mounts.items()):
+                if entry['refs'] == 0 and (force or now - entry['last_used'] >= self.idle_timeout):
+                    self._unmount(entry['mntpoint'])
+                    del self.mounts[key]
+
+            self._schedule_reap()
+
+
+    def close(self):
+        """
+        Unmount all unused mounts
+        """
+
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.reap(force=True)
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+
+SMB_MOUNT_POOL = SMBMountPool()
+atexit.register(SMB_MOUNT_POOL.close)
+
+
+def _parse_rsync_record(record):
+    """
+    Parse the fields of an RSYNC_OUT_FORMAT record (without the marker)
+    """
+
+    fields = record.split(b'|', 4)
+    if len(fields) != 5:
+        return None
+
+    itemize, size, mtime, transferred, name = fields
+
+    try:
+        size = int(size)
+    except ValueError:
+        size = 0
+
+    try:
+        transferred = int(transferred)
+    except ValueError:
+        transferred = 0
+
+    return {
+        'itemize': itemize.decode('ascii', 'replace').strip(),
+        'size': size,
+        'mtime': mtime.decode('ascii', 'replace'),
+        'bytes': transferred,
+        'path': os.fsdecode(name).rstrip('/'),
+    }
+
+
+def _classify_rsync_record(record):
+    """
+    Return 'new', 'updated', 'deleted' or None for a parsed rsync record
+    """
+
+    itemize = record['itemize']
+
+    if itemize.startswith('*deleting'):
+        return 'deleted'
+
+    if len(itemize) < 3 or itemize[0] not in '<>' or itemize[1] != 'f':
+        return None
+
+    return 'new' if itemize[2] == '+' else 'updated'
+
+
+def run_rsync(cmd, progress_callback=None, should_stop=None):
+    """
+    Run an rsync command and return its per-file results.
+
+    RSYNC_OUT_FORMAT is added to the command so every transferred or
+    deleted file is reported as a delimited record.  stdout is read as bytes
+    in RSYNC_READ_SIZE chunks; only record lines and ``to-chk=`` progress
+    lines (from --progress) are parsed.  cmd may be prefixed with sshpass.
+
+    progress_callback(done, total) is called when the ``to-chk`` counters
+    change.  should_stop() is polled between reads; when it returns True the
+    rsync process is terminated.
+
+    Returns a dict with:
+      'returncode': rsync exit status
+      'stopped': True if should_stop ended the transfer
+      'files': {'new': [...], 'updated': [...], 'deleted': [...]} paths
+      'records': list of {'itemize', 'size', 'mtime', 'bytes', 'path'}
+      'bytes': total bytes transferred
+      'elapsed': wall-clock seconds
+    """
+
+    cmd = list(cmd)
+    rsync_idx = cmd.index('rsync') if 'rsync' in cmd else 0
+    cmd.insert(rsync_idx + 1, RSYNC_OUT_FORMAT)
+
+    result = {
+        'returncode': None,
+        'stopped': False,
+        'files': {'new': [], 'updated': [], 'deleted': []},
+        'records': [],
+        'bytes': 0,
+        'elapsed': 0.0,
+    }
+
+    def _process_line(line):
+        marker = line.find(RSYNC_RECORD_MARKER)
+        if marker != -1:
+            record = _parse_rsync_record(line[marker + len(RSYNC_RECORD_MARKER):])
+            if record is None:
+                return
+
+            result['records'].append(record)
+            result['bytes'] += record['bytes']
+
+            change = _classify_rsync_record(record)
+            if change:
+                result['files'][change].append(record['path'])
+            return
+
+        if progress_callback is None:
+            return
+
+        chk = line.find(b'to-chk=')
+        if chk != -1:
+            remaining, _, total = line[chk + 7:].partition(b'/')
+            total = total.split(b')', 1)[0]
+            try:
+                remaining, total = int(remaining), int(total)
+            except ValueError:
+                return
+            progress_callback(total - remaining, total)
+
+    start = time.time()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    buffer = b''
+
+    try:
+        while True:
+            if should_stop is not None and should_stop():
+                logging.info("Stopping")
+                proc.terminate()
+                result['stopped'] = True
+                break
+
+            chunk = proc.stdout.read1(RSYNC_READ_SIZE)
+            if not chunk:
+                break
+
+            # --progress rewrites its line with carriage returns
+            lines = (buffer + chunk).replace(b'\r', b'\n').split(b'\n')
+            buffer = lines.pop()
+            for line in lines:
+                if line:
+                    _process_line(line)
+
+        if buffer:
+            _process_line(buffer)
+
+    finally:
+        proc.stdout.close()
+        result['returncode'] = proc.wait()
+        result['elapsed'] = time.time() - start
+
+    if result['bytes']:
+        logging.info("Transferred %d byte(s) in %d file(s) in %.1fs (%.2f MB/s)",
+                     result['bytes'], len(result['files']['new']) + len(result['files']['updated']),
+                     result['elapsed'], result['bytes'] / 1e6 / max(result['elapsed'], 1e-3))
+
+    return result
+
+
 def build_rsync_command(flags, extra_args, source_dir, dest_dir, include_filepath):
     """
     Build the cmd array for a rsync command.  The cmd array will be passed to
@@ -268,7 +729,9 @@ def test_rsync_write_access(server, user, tmpdir, password_file=None):
 def build_ssh_command(flags, user, server, post_cmd, passwd, use_pubkey):
     """
     Build the cmd array for a ssh command.  The cmd array will be passed to
-    subprocess
+    subprocess.  These commands test the connection, so they authenticate
+    on their own instead of reusing a shared master connection, which would
+    hide a changed password or key until the master expired.
     """
 
     passwd = passwd or ''
@@ -276,6 +739,7 @@ def build_ssh_command(flags, user, server, post_cmd, passwd, use_pubkey):
         raise ValueError("Must specify either a passwd or use_pubkey")
 
     cmd = ['ssh', '-o', 'StrictHostKeyChecking=no', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=5'] if use_pubkey else ['sshpass', '-p', f'{passwd}', 'ssh', '-o', 'PubkeyAuthentication=no','-o', 'StrictHostKeyChecking=no', '-o', 'ConnectTimeout=5']
+    cmd += ['-o', 'ControlMaster=no', '-o', 'ControlPath=none']
     cmd += flags or []
     cmd += [f'{user}@{server}', post_cmd]
     return cmd
@@ -590,9 +1054,120 @@ def test_smb_destination(cdt_cfg, mntpoint, smb_version, smb_detail=""):
     return results
 
 
-def test_cst_source(cst_cfg, source_dir):
+def _cst_test_cache_key():
+    """
+    Create the source test cache directory, private to the worker user, and
+    return the secret the configuration hashes are keyed with, generating
+    it on first use.  The configuration includes passwords, so a plain
+    hash of it must not be stored.
+    """
+
+    os.makedirs(CST_TEST_CACHE_DIR, mode=0o700, exist_ok=True)
+    os.chmod(CST_TEST_CACHE_DIR, 0o700)
+
+    key_file = os.path.join(CST_TEST_CACHE_DIR, '.key')
+    try:
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(key_file, 'rb') as f:
+            return f.read()
+
+    key = os.urandom(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def _cst_test_cache_entry(cst_cfg, source_dir):
+    """
+    Return (cache file path, config hash) for the source test of cst_cfg.
+    The path is None for transfers without an ID (e.g. unsaved
+    configurations), which are never cached.  The hash is None if the
+    cache key is unavailable.
+    """
+
+    cst_cfg = normalize_transfer_config(cst_cfg)
+    if cst_cfg.get('collectionSystemTransferID') is None:
+        return None, None
+
+    cache_file = os.path.join(CST_TEST_CACHE_DIR, f"{cst_cfg['collectionSystemTransferID']}.json")
+
+    try:
+        key = _cst_test_cache_key()
+    except OSError as exc:
+        logging.warning("Unable to use the source test cache: %s", str(exc))
+        return cache_file, None
+
+    fields = {field: cst_cfg.get(field) for field in _CST_TEST_FIELDS}
+    fields['sourceDir'] = source_dir
+    config_hash = hmac.new(key, json.dumps(fields, sort_keys=True, default=str).encode(), hashlib.sha256).hexdigest()
+
+    return cache_file, config_hash
+
+
+def invalidate_cst_source_test(cst_cfg):
+    """
+    Discard any cached source test result for the collection system transfer
+    """
+
+    cache_file, _ = _cst_test_cache_entry(cst_cfg, None)
+    if cache_file is None:
+        return
+
+    try:
+        os.remove(cache_file)
+    except FileNotFoundError:
+        pass
+    except OSError as exc:
+        logging.warning("Unable to remove cached source test %s: %s", cache_file, str(exc))
+
+
+def test_cst_source(cst_cfg, source_dir, cache_ttl=0):
+    """
+    Test the connection to the collection system transfer.
+
+    With a cache_ttl (seconds), a passing result for the same transfer
+    configuration and source directory that is younger than cache_ttl is
+    returned without repeating the probes.  A cache_ttl of 0 always runs the
+    tests.  Passing results are cached (shared by all worker processes);
+    failures and configuration changes discard the cached result.
+    """
+
+    cache_file, config_hash = _cst_test_cache_entry(cst_cfg, source_dir)
+
+    if cache_ttl and config_hash is not None:
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('hash') == config_hash and time.time() - cached.get('time', 0) < cache_ttl:
+                logging.debug("Using cached source test results from %s", time.ctime(cached['time']))
+                return cached['results']
+        except (OSError, ValueError):
+            pass
+
+    results = _test_cst_source(cst_cfg, source_dir)
+
+    if not results or results[-1]['result'] == 'Fail':
+        invalidate_cst_source_test(cst_cfg)
+        return results
+
+    if config_hash is None:
+        return results
+
+    try:
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'hash': config_hash, 'time': time.time(), 'results': results}, f)
+        os.replace(tmp_file, cache_file)
+    except OSError as exc:
+        logging.warning("Unable to cache source test results: %s", str(exc))
+
+    return results
+
+
+def _test_cst_source(cst_cfg, source_dir):
     """
-    Test the connection to the collection system transfer
+    Run the collection system transfer source tests
     """
 
     cst_cfg = normalize_transfer_config(cst_cfg)
@@ -611,7 +1186,7 @@ def test_cst_source(cst_cfg, source_dir):
     wildcard_parent = os.path.dirname(source_dir) if source_has_wildcard else None
     wildcard_pattern = os.path.basename(source_dir) if source_has_wildcard else None
 
-    with temporary_directory() as tmpdir:
+    with temporary_directory() as tmpdir, ExitStack() as cleanup:
         password_file = os.path.join(tmpdir, 'passwordFile')
 
         # Tests for local
@@ -698,14 +1273,12 @@ def test_cst_source(cst_cfg, source_dir):
                 ])
                 return results
 
-            mntpoint = os.path.join(tmpdir, 'mntpoint')
-            os.mkdir(mntpoint, 0o755)
-            smb_version, smb_detail = detect_smb_version(cst_cfg)
+            mntpoint, smb_version, mnt_detail = SMB_MOUNT_POOL.acquire(cst_cfg)
 
             if not smb_version:
                 reason = f"Could not connect to SMB server: {cst_cfg['smbServer']} as {cst_cfg['smbUser']}"
-                if smb_detail:
-                    reason += f" — {smb_detail}"
+                if mnt_detail:
+                    reason += f" — {mnt_detail}"
                 results.extend([
                     {"partName": "SMB server", "result": "Fail", "reason": reason},
                     {"partName": "SMB share", "result": "Fail", "reason": reason},
@@ -719,8 +1292,7 @@ def test_cst_source(cst_cfg, source_dir):
 
             results.extend([{"partName": "SMB server", "result": "Pass"}])
 
-            mnt_success, mnt_detail = mount_smb_share(cst_cfg, mntpoint, smb_version)
-            if not mnt_success:
+            if not mntpoint:
                 reason = f"Could not connect to SMB server: {cst_cfg['smbServer']} as {cst_cfg['smbUser']}"
                 if mnt_detail:
                     reason += f" — {mnt_detail}"
@@ -734,6 +1306,7 @@ def test_cst_source(cst_cfg, source_dir):
 
                 return results
 
+            cleanup.callback(SMB_MOUNT_POOL.release, mntpoint)
             results.extend([{"partName": "SMB share", "result": "Pass"}])
 
             if source_has_wildcard:
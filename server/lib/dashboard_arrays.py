@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Columnar sidecar files for data-dashboard JSON output.
+
+The data-dashboard worker can optionally write a NumPy ``.npz`` archive next
+to each dashboard JSON file containing the bulky parts of the
+``visualizerData`` (time-series values and GeoJSON LineString coordinates /
+``coordTimes``) as typed arrays.  The archive is written uncompressed so
+:func:`load_dashboard_arrays` can memory-map each array directly from disk,
+letting consumers such as
+:func:`~server.lib.geojson_utils.combine_geojson_files` read track data
+without decoding multi-megabyte JSON documents.
+
+Array names mirror the location of the data in the JSON document:
+
+* ``{data_type}/visualizerData/{i}/data`` — ``(N, 2)`` time-series values.
+* ``{data_type}/visualizerData/{i}/features/{j}/coordinates`` — ``(N, 2|3)``
+  LineString vertices.
+* ``{data_type}/visualizerData/{i}/features/{j}/coordTimes`` — ``(N,)``
+  vertex timestamps.
+"""
+
+import logging
+import os
+import struct
+import zipfile
+from typing import Optional
+import numpy as np
+
+SIDECAR_SUFFIX = '.npz'
+
+# Size of the fixed part of a zip local file header
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+def sidecar_path(json_path: str) -> str:
+    """Return the sidecar archive path for the dashboard JSON file *json_path*.
+
+    Args:
+        json_path: Path to a data-dashboard JSON file.
+
+    Returns:
+        The same path with the ``.json`` extension replaced by ``.npz``.
+    """
+
+    return f'{os.path.splitext(json_path)[0]}{SIDECAR_SUFFIX}'
+
+
+def extract_dashboard_arrays(contents: dict, strict: bool = False) -> Optional[dict]:
+    """Collect the visualizer arrays from dashboard *contents*.
+
+    Only the multi-datatype dashboard format (``{data_type: plugin_data}``)
+    produced by the data-dashboard worker is supported.  Entries that cannot
+    be represented as a regular numeric (or, for ``coordTimes``, string)
+    array are skipped.
+
+    Args:
+        contents: Dashboard data as returned by a plugin's ``process_file``.
+        strict: Return ``None`` instead if any entry had to be skipped.
+
+    Returns:
+        An ordered dict mapping array name to :class:`numpy.ndarray`, or
+        ``None`` (when *strict*) if the arrays would be incomplete.
+    """
+
+    arrays = {}
+    skipped = False
+
+    def _add(name, values, dtype=None):
+        nonlocal skipped
+
+        try:
+            array = np.asarray(values, dtype=dtype)
+        except (TypeError, ValueError):
+            array = None
+
+        if array is None or array.dtype == object:
+            logging.debug("Skipping irregular array: %s", name)
+            skipped = True
+            return False
+
+        arrays[name] = array
+        return True
+
+    for data_type, plugin_data in contents.items():
+        if not isinstance(plugin_data, dict) or not isinstance(plugin_data.get('visualizerData'), list):
+            continue
+
+        for idx, entry in enumerate(plugin_data['visualizerData']):
+            if not isinstance(entry, dict):
+                continue
+
+            prefix = f'{data_type}/visualizerData/{idx}'
+
+            # Time-series: {'data': [[epoch_ms, value], ...], 'unit': ..., 'label': ...}
+            if isinstance(entry.get('data'), list):
+                _add(f'{prefix}/data', entry['data'], dtype=np.float64)
+                continue
+
+            # GeoJSON tracks
+            if entry.get('type') != 'FeatureCollection' or not isinstance(entry.get('features'), list):
+                continue
+
+            for jdx, feature in enumerate(entry['features']):
+                geom = feature.get('geometry') or {}
+                if geom.get('type') != 'LineString':
+                    continue
+
+                coords = geom.get('coordinates', [])
+                times = (feature.get('properties') or {}).get('coordTimes', [])
+
+                if not isinstance(coords, list) or not isinstance(times, list):
+                    skipped = True
+                    continue
+
+                feature_prefix = f'{prefix}/features/{jdx}'
+                if _add(f'{feature_prefix}/coordinates', coords, dtype=np.float64):
+                    if not _add(f'{feature_prefix}/coordTimes', times):
+                        del arrays[f'{feature_prefix}/coordinates']
+
+    if strict and skipped:
+        return None
+
+    return arrays
+
+
+def write_dashboard_arrays(file_path: str, contents: dict) -> dict:
+    """Write the visualizer arrays of dashboard *contents* to *file_path*.
+
+    The archive is written uncompressed (``numpy.savez``) so it can be
+    memory-mapped.  If *contents* holds no visualizer arrays, or some of
+    them cannot be stored as regular arrays (readers trust an up-to-date
+    archive to hold all of the data), any existing archive at *file_path*
+    is removed instead.
+
+    Args:
+        file_path: Destination ``.npz`` path (see :func:`sidecar_path`).
+        contents: Dashboard data as returned by a plugin's ``process_file``.
+
+    Returns:
+        A dict with key ``'verdict'`` (``bool``) and, on failure, a ``'reason'``
+        string.
+    """
+
+    arrays = extract_dashboard_arrays(contents, strict=True)
+
+    try:
+        if not arrays:
+            if arrays is None:
+                logging.debug("Irregular visualizer data, not writing %s", file_path)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+            return {'verdict': True}
+
+        # write to a temp file so readers never map a partially written archive
+        tmp_path = f'{file_path}.tmp'
+        with open(tmp_path, 'wb') as npz_file:
+            np.savez(npz_file, **arrays)
+        os.replace(tmp_path, file_path)
+
+    except OSError as exc:
+        reason = f'Unable to write dashboard array file: {file_path}'
+        logging.error(reason)
+        logging.debug(str(exc))
+        return {'verdict': False, 'reason': reason}
+
+    return {'verdict': True}
+
+
+def load_dashboard_arrays(file_path: str, mmap: bool = True) -> dict:
+    """Load the arrays stored in a dashboard sidecar archive.
+
+    Uncompressed members are memory-mapped read-only straight from the
+    archive so no data is copied until it is accessed.  Compressed members
+    (or all members when *mmap* is ``False``) are read into memory.
+
+    Args:
+        file_path: Path to a ``.npz`` sidecar archive.
+        mmap: Memory-map uncompressed arrays when ``True``.
+
+    Returns:
+        An ordered dict mapping array name (see module docstring) to
+        :class:`numpy.ndarray` (or :class:`numpy.memmap`).
+
+    Raises:
+        OSError: If the archive cannot be read.
+        ValueError: If the archive is not a valid ``.npz`` file.
+    """
+
+    arrays = {}
+
+    with zipfile.ZipFile(file_path) as archive, open(file_path, 'rb') as raw_file:
+        for info in archive.infolist():
+            if not info.filename.endswith('.npy'):
+                continue
+
+            name = info.filename[:-len('.npy')]
+
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            # locate the member data: local header + filename + extra field
+            raw_file.seek(info.header_offset)
+            header = raw_file.read(_ZIP_LOCAL_HEADER_SIZE)
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            raw_file.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_len + extra_len)
+
+            version = np.lib.format.read_magic(raw_file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(raw_file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(raw_file)
+
+            if dtype.hasobject:
+                raise ValueError(f'Object arrays are not supported: {info.filename}')
+
+            if 0 in shape:
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+
+            arrays[name] = np.memmap(
+                file_path,
+                dtype=dtype,
+                mode='r',
+                offset=raw_file.tell(),
+                shape=shape,
+                order='F' if fortran_order else 'C'
+            )
+
+    return arrays
+
+
+def iter_linestring_arrays(arrays: dict):
+    """Yield ``(coordinates, coordTimes)`` pairs for every LineString in *arrays*.
+
+    Pairs are yielded in the order the features appear in the dashboard
+    JSON file.
+
+    Args:
+        arrays: Dict as returned by :func:`load_dashboard_arrays` or
+            :func:`extract_dashboard_arrays`.
+    """
+
+    for name, coords in arrays.items():
+        if not name.endswith('/coordinates'):
+            continue
+
+        times = arrays.get(f'{name[:-len("/coordinates")]}/coordTimes')
+        if times is None:
+            continue
+
+        yield coords, times
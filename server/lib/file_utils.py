@@ -8,6 +8,7 @@ data files, and managing temporary directories.
 
 import os
 import json
+import stat
 import time
 import fnmatch
 import tempfile
@@ -16,11 +17,17 @@ import logging
 import errno
 import subprocess
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from pwd import getpwnam
 from datetime import datetime, timedelta
 from typing import List, Optional
 
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
 default_ignore_patterns = [
     "**/@eaDir*",
     "**/.DS_Store",
@@ -30,6 +37,17 @@ default_ignore_patterns = [
     "**/.*.??????"
 ]
 
+# Modes set by set_owner_group_permissions
+FILE_MODE = 0o644
+DIR_MODE = 0o755
+
+# Threads used by set_owner_group_permissions on whole cruise/lowering trees
+PERMISSION_WORKERS = 8
+
+# Lists longer than this are encoded and written in slices of this many
+# elements so large visualizerData arrays never exist as a single string.
+JSON_STREAM_CHUNK_SIZE = 5000
+
 def is_ascii(s: str) -> bool:
     """Check whether all characters in *s* are within the ASCII range (U+0–U+7F).
 
@@ -126,6 +144,65 @@ def build_filelist(source_dir: str) -> dict:
     return return_files
 
 
+def build_file_index(source_dir: str) -> dict:
+    """Record the size and mtime of every regular file below *source_dir*.
+
+    Uses ``os.scandir`` so each file costs a single ``lstat``.  Symlinks are
+    skipped.
+
+    Args:
+        source_dir: Absolute path to the directory to scan.
+
+    Returns:
+        A dict mapping each path relative to *source_dir* to a
+        ``[size, mtime_ns]`` list (lists so the index round-trips through
+        JSON unchanged).
+    """
+
+    index = {}
+    pending = ['']
+
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            with os.scandir(os.path.join(source_dir, rel_dir) if rel_dir else source_dir) as entries:
+                for entry in entries:
+                    rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(rel_path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            index[rel_path] = [st.st_size, st.st_mtime_ns]
+                    except FileNotFoundError:
+                        continue
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        except PermissionError as err:
+            logging.warning("Unable to scan directory: %s", err)
+
+    return index
+
+
+def diff_file_index(old_index: dict, new_index: dict) -> tuple:
+    """Compare two indexes built by :func:`build_file_index`.
+
+    Args:
+        old_index: The earlier index.
+        new_index: The later index.
+
+    Returns:
+        A two-tuple ``(changed, removed)`` of relative paths: files that are
+        new or whose size/mtime differ in *new_index*, and files that are
+        no longer present.
+    """
+
+    changed = [rel_path for rel_path, sig in new_index.items() if old_index.get(rel_path) != sig]
+    removed = [rel_path for rel_path in old_index if rel_path not in new_index]
+
+    return changed, removed
+
+
 def build_include_file(include_list: List[str], filepath: str) -> bool:
     """Write *include_list* to *filepath* for use as an rsync ``--files-from`` argument.
 
@@ -364,8 +441,10 @@ def purge_old_files(directory_path: str, excludes: Optional[str] = None,
 def output_json_data_to_file(file_path: str, contents) -> dict:
     """Serialise *contents* as JSON and write it to *file_path*.
 
-    Parent directories are created automatically.  Uses :class:`NpEncoder` to
-    handle NumPy types and :class:`~datetime.datetime` objects.
+    Parent directories are created automatically.  The document is encoded
+    with :func:`json_encode` (``orjson`` when available) and streamed to disk
+    via :func:`write_json_stream`.  NumPy types and
+    :class:`~datetime.datetime` objects are handled by the encoder.
 
     Args:
         file_path: Destination file path.
@@ -387,10 +466,10 @@ def output_json_data_to_file(file_path: str, contents) -> dict:
     except Exception as exc:
         raise exc
 
-    with open(file_path, mode='w', encoding="utf-8") as json_file:
+    with open(file_path, mode='wb') as json_file:
         logging.debug("Saving JSON file: %s", file_path)
         try:
-            json.dump(contents, json_file, cls=NpEncoder)
+            write_json_stream(json_file, contents)
 
         except IOError:
             reason = f'Unable to create data file: {file_path}'
@@ -400,68 +479,306 @@ def output_json_data_to_file(file_path: str, contents) -> dict:
     return {'verdict': True}
 
 
-def set_owner_group_permissions(user: str, path: str) -> dict:
+def json_default(o):
+    """Fallback serialiser for objects the JSON encoders do not handle natively.
+
+    NumPy scalars and arrays are converted to native types and
+    :class:`~datetime.datetime` objects are formatted as
+    ``%Y-%m-%dT%H:%M:%S.%fZ``.
+
+    Args:
+        o: Object to serialise.
+
+    Returns:
+        A JSON-native type (``int``, ``float``, ``bool``, ``list``, or ``str``).
+
+    Raises:
+        TypeError: If *o* is not a supported type.
+    """
+
+    if isinstance(o, np.integer):
+        return int(o)
+
+    if isinstance(o, np.floating):
+        return float(o)
+
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+
+    if isinstance(o, np.generic):
+        return o.item()
+
+    if isinstance(o, datetime):
+        return o.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    raise TypeError(f'Object of type {o.__class__.__name__} is not JSON serializable')
+
+
+def json_encode(contents) -> bytes:
+    """Serialise *contents* to UTF-8 encoded JSON.
+
+    Uses ``orjson`` when it is installed, otherwise the C-accelerated stdlib
+    encoder with :class:`NpEncoder`.  The stdlib output is byte-identical to
+    ``json.dumps(contents, cls=NpEncoder)``.  The ``orjson`` output decodes to
+    the same values but is written without whitespace between separators,
+    leaves non-ASCII characters unescaped and writes NaN/Infinity as ``null``.
+
+    Args:
+        contents: Any JSON-serialisable object (including NumPy types and
+            ``datetime`` instances).
+
+    Returns:
+        The encoded JSON document as ``bytes``.
+    """
+
+    if orjson is not None:
+        return orjson.dumps(
+            contents,
+            default=json_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        )
+
+    return json.dumps(contents, cls=NpEncoder).encode('utf-8')
+
+
+def json_separators() -> tuple:
+    """Return the ``(item, key)`` separators used by :func:`json_encode`.
+
+    Needed by code that assembles a JSON document from separately encoded
+    pieces and must match the output of :func:`json_encode`.
+
+    Returns:
+        Tuple of ``bytes`` — ``(b',', b':')`` with ``orjson``, otherwise
+        ``(b', ', b': ')``.
+    """
+
+    return (b',', b':') if orjson is not None else (b', ', b': ')
+
+
+def write_json_stream(json_file, contents, chunk_size: int = JSON_STREAM_CHUNK_SIZE) -> None:
+    """Encode *contents* as JSON and write it incrementally to *json_file*.
+
+    Dicts are written key by key and long lists in slices of *chunk_size*
+    elements, so peak memory is bounded by the largest slice rather than
+    the whole document.  The bytes written are identical to
+    :func:`json_encode` (*contents*).
+
+    Args:
+        json_file: File object opened in binary write mode.
+        contents: Any JSON-serialisable object.
+        chunk_size: Maximum number of list elements encoded at once.
+    """
+
+    item_sep, key_sep = json_separators()
+
+    def _write(obj):
+        if isinstance(obj, dict) and obj and all(isinstance(key, str) for key in obj):
+            json_file.write(b'{')
+            for idx, (key, value) in enumerate(obj.items()):
+                if idx:
+                    json_file.write(item_sep)
+                json_file.write(json_encode(key))
+                json_file.write(key_sep)
+                _write(value)
+            json_file.write(b'}')
+
+        elif isinstance(obj, list) and len(obj) > chunk_size:
+            json_file.write(b'[')
+            for idx in range(0, len(obj), chunk_size):
+                if idx:
+                    json_file.write(item_sep)
+                json_file.write(json_encode(obj[idx:idx + chunk_size])[1:-1])
+            json_file.write(b']')
+
+        elif isinstance(obj, list) and any(isinstance(value, dict) for value in obj):
+            json_file.write(b'[')
+            for idx, value in enumerate(obj):
+                if idx:
+                    json_file.write(item_sep)
+                _write(value)
+            json_file.write(b']')
+
+        else:
+            json_file.write(json_encode(obj))
+
+    _write(contents)
+
+
+def _fix_owner_group_permissions(path: str, st: os.stat_result, uid: int, gid: int, mode: int) -> Optional[str]:
+    """Set the ownership and mode of *path* where *st* shows they differ.
+
+    Returns:
+        ``None`` on success, otherwise the failure reason.
+    """
+
+    try:
+        if st.st_uid != uid or st.st_gid != gid:
+            os.chown(path, uid, gid)
+        if stat.S_IMODE(st.st_mode) != mode:
+            os.chmod(path, mode)
+    except OSError:
+        reason = f"Unable to set ownership/permissions for {path}"
+        logging.debug(reason)
+        return reason
+
+    return None
+
+
+def _fix_owner_group_permissions_tree(root: str, uid: int, gid: int) -> List[str]:
+    """Fix the ownership and permissions of everything below *root*.
+
+    Like ``os.walk``, symlinked directories are fixed but not descended into.
+
+    Returns:
+        The failure reasons.
+    """
+
+    reasons = []
+    stack = [root]
+
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                        st = entry.stat()
+                    except OSError:
+                        reasons.append(f"Unable to set ownership/permissions for {entry.path}")
+                        continue
+
+                    reason = _fix_owner_group_permissions(entry.path, st, uid, gid, DIR_MODE if is_dir else FILE_MODE)
+                    if reason:
+                        reasons.append(reason)
+
+                    if is_dir and not entry.is_symlink():
+                        stack.append(entry.path)
+        except OSError:
+            reasons.append(f"Unable to set ownership/permissions for {current}")
+
+    return reasons
+
+
+def with_parent_dirs(paths: List[str], base_dir: str, include_base: bool = False) -> List[str]:
+    """Return *paths* together with their parent directories below *base_dir*.
+
+    Use it to pass just the files a job wrote, and the directories that may
+    have been created for them, to :func:`set_owner_group_permissions`.
+
+    Args:
+        paths: File paths, relative to *base_dir* or absolute.
+        base_dir: Directory the paths are below.
+        include_base: Also include *base_dir* itself (as ``'.'``) when any
+            path is below it, e.g. when the job may have created it.
+
+    Returns:
+        Sorted list of paths relative to *base_dir*, without duplicates.
+        Paths outside *base_dir* are dropped.
+    """
+
+    result = set()
+
+    for path in paths:
+        path = os.path.normpath(os.path.relpath(path, base_dir) if os.path.isabs(path) else path)
+        if path == '..' or path.startswith('..' + os.sep):
+            continue
+
+        while path and path != '.' and path not in result:
+            result.add(path)
+            path = os.path.dirname(path)
+
+    if include_base and result:
+        result.add('.')
+
+    return sorted(result)
+
+
+def set_owner_group_permissions(user: str, path: str, files: Optional[List[str]] = None, max_workers: int = 1) -> dict:
     """Recursively set ownership and permissions on *path* for *user*.
 
     Files are set to ``0o644``; directories to ``0o755``.  Ownership (uid/gid)
-    is looked up from the system password database.
+    is looked up from the system password database.  Entries that already
+    have the right owner, group and mode are left untouched.
 
     Args:
         user: System username whose uid/gid will own the files.
         path: File or directory path to update.
+        files: Optional list of paths (absolute, or relative to *path*) to
+            update instead of the whole of *path*.  Listed directories are
+            updated themselves, not recursively.
+        max_workers: Number of threads updating the subdirectories of
+            *path* in parallel.
 
     Returns:
         A dict with key ``'verdict'`` (``bool``) and, on failure, a ``'reason'``
         string describing the first set of errors encountered.
     """
 
+    pw = getpwnam(user)
+    uid, gid = pw.pw_uid, pw.pw_gid
+
     reasons = []
 
-    uid = getpwnam(user).pw_uid
-    gid = getpwnam(user).pw_gid
-    # Set the file permission and ownership for the current directory
+    if files is not None:
+        logging.debug("Setting ownership/permissions for %d path(s) in %s", len(files), path)
+        for filepath in files:
+            filepath = os.path.join(path, filepath)
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                reasons.append(f"Unable to set ownership/permissions for {filepath}")
+                continue
 
-    logging.debug("Setting ownership/permissions for %s", path)
-    if os.path.isfile(path):
-        try:
-            os.chown(path, uid, gid)
-            os.chmod(path, 0o644)
-        except OSError:
-            reason = f"Unable to set ownership/permissions for /{path}"
-            logging.debug(reason)
-            reasons.append(reason)
+            reason = _fix_owner_group_permissions(filepath, st, uid, gid, DIR_MODE if stat.S_ISDIR(st.st_mode) else FILE_MODE)
+            if reason:
+                reasons.append(reason)
 
-    else: #directory
+    else:
+        logging.debug("Setting ownership/permissions for %s", path)
         try:
-            os.chown(path, uid, gid)
-            os.chmod(path, 0o755)
+            st = os.stat(path)
         except OSError:
-            reason = "Unable to set ownership/permissions for /%s", path
-            logging.debug(reason)
-            reasons.append(reason)
+            st = None
+            reasons.append(f"Unable to set ownership/permissions for {path}")
 
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                fname = os.path.join(root, file)
-                logging.debug("Setting ownership/permissions for %s", fname)
-                try:
-                    os.chown(fname, uid, gid)
-                    os.chmod(fname, 0o644)
-                except OSError:
-                    reason = f"Unable to set ownership/permissions for {fname}"
-                    logging.debug(reason)
-                    reasons.append(reason)
+        if st is not None and not stat.S_ISDIR(st.st_mode):
+            reason = _fix_owner_group_permissions(path, st, uid, gid, FILE_MODE)
+            if reason:
+                reasons.append(reason)
+
+        elif st is not None:
+            reason = _fix_owner_group_permissions(path, st, uid, gid, DIR_MODE)
+            if reason:
+                reasons.append(reason)
 
-            for directory in dirs:
-                dname = os.path.join(root, directory)
-                logging.debug("Setting ownership/permissions for %s", dname)
+            if max_workers > 1:
+                # fix the top level here, each subdirectory tree in a thread
+                subdirs = []
                 try:
-                    os.chown(dname, uid, gid)
-                    os.chmod(dname, 0o755)
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            try:
+                                is_dir = entry.is_dir()
+                                entry_st = entry.stat()
+                            except OSError:
+                                reasons.append(f"Unable to set ownership/permissions for {entry.path}")
+                                continue
+
+                            reason = _fix_owner_group_permissions(entry.path, entry_st, uid, gid, DIR_MODE if is_dir else FILE_MODE)
+                            if reason:
+                                reasons.append(reason)
+
+                            if is_dir and not entry.is_symlink():
+                                subdirs.append(entry.path)
                 except OSError:
-                    reason = f"Unable to set ownership/permissions for {dname}"
-                    logging.debug(reason)
-                    reasons.append(reason)
+                    reasons.append(f"Unable to set ownership/permissions for {path}")
+
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for subdir_reasons in executor.map(lambda subdir: _fix_owner_group_permissions_tree(subdir, uid, gid), subdirs):
+                        reasons.extend(subdir_reasons)
+            else:
+                reasons.extend(_fix_owner_group_permissions_tree(path, uid, gid))
 
     if len(reasons) > 0:
         reason = f"Unable to set ownership/permissions for {len(reasons)} file(s)"
@@ -653,16 +970,7 @@ class NpEncoder(json.JSONEncoder):
             A JSON-native type (``int``, ``float``, ``list``, or ``str``).
         """
 
-        if isinstance(o, np.integer):
-            return int(o)
-
-        if isinstance(o, np.floating):
-            return float(o)
-
-        if isinstance(o, np.ndarray):
-            return o.tolist()
-
-        if isinstance(o, datetime):
-            return o.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-
-        return super().default(o)
+        try:
+            return json_default(o)
+        except TypeError:
+            return super().default(o)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""Recursive change watchers for local and network-mounted directories.
+
+Two watchers share the same interface:
+
+* :class:`InotifyWatcher` — uses the Linux inotify API (via ``ctypes``, no
+  third-party dependency) to receive change events for a directory tree.
+* :class:`PollingWatcher` — compares successive ``os.scandir`` snapshots of
+  the tree.  Used on CIFS/NFS mounts, where inotify does not report changes
+  made by other clients, and wherever inotify is unavailable.
+
+Both report the *files* that were created or modified since the previous
+call to ``changes()`` as paths relative to the watched root.  A return value
+of ``None`` means changes may have been missed (event-queue overflow, watch
+limit reached, root replaced) and the caller should fall back to a full
+listing.  Use :func:`create_watcher` to pick the right implementation for a
+directory.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+
+# Filesystem types on which inotify does not see changes made by other hosts
+NETWORK_FS_TYPES = frozenset(['cifs', 'smb3', 'smbfs', 'nfs', 'nfs4', 'fuse.sshfs', 'fuse.rclone'])
+
+# inotify constants (<sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _get_libc():
+    global _libc # pylint: disable=global-statement
+
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def filesystem_type(path: str) -> str:
+    """Return the filesystem type of the mount containing *path*.
+
+    Args:
+        path: Any existing path.
+
+    Returns:
+        The type column from ``/proc/mounts`` (e.g. ``'ext4'``, ``'cifs'``),
+        or ``None`` if it cannot be determined.
+    """
+
+    path = os.path.realpath(path)
+    best_mount, best_type = '', None
+
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8') as mounts:
+            for line in mounts:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+
+                # mount points escape whitespace as octal sequences
+                mount_point = parts[1].encode().decode('unicode_escape')
+                if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > len(best_mount):
+                    best_mount, best_type = mount_point, parts[2]
+    except OSError:
+        return None
+
+    return best_type
+
+
+def _walk_files(root: str, rel_dir: str = ''):
+    """Yield ``(rel_path, stat_result)`` for every regular file below *root*/*rel_dir*."""
+
+    stack = [rel_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, current)) as entries:
+                for entry in entries:
+                    rel_path = os.path.join(current, entry.name) if current else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(rel_path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield rel_path, entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+class PollingWatcher:
+    """Detect changed files by comparing ``(size, mtime)`` snapshots.
+
+    Attributes:
+        root: Directory being watched.
+        poll_interval: Suggested minimum number of seconds between calls to
+            :meth:`changes`; a snapshot walks the whole tree.
+    """
+
+    def __init__(self, root: str, poll_interval: float = 60):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.snapshot = self._scan()
+
+
+    def _scan(self):
+        return {rel_path: (st.st_size, st.st_mtime_ns) for rel_path, st in _walk_files(self.root)}
+
+
+    def changes(self):
+        """Return the set of files created or modified since the last call.
+
+        Returns:
+            A set of paths relative to :attr:`root`, or ``None`` if the root
+            directory has disappeared.
+        """
+
+        if not os.path.isdir(self.root):
+            return None
+
+        snapshot = self._scan()
+        changed = {rel_path for rel_path, sig in snapshot.items() if self.snapshot.get(rel_path) != sig}
+        self.snapshot = snapshot
+        return changed
+
+
+    def close(self):
+        """Release the snapshot."""
+
+        self.snapshot = {}
+
+
+class InotifyWatcher:
+    """Recursive inotify watch on a local directory tree.
+
+    A watch is added to every directory below :attr:`root`; directories
+    created (or moved in) later are watched as they appear and any files
+    already inside them are reported as changed.
+
+    Attributes:
+        root: Directory being watched.
+        poll_interval: Always ``0``; events are buffered by the kernel.
+
+    Raises:
+        OSError: If inotify is unavailable or the root cannot be watched.
+    """
+
+    poll_interval = 0
+
+    def __init__(self, root: str):
+        self.root = root
+        self.wd_to_dir = {}
+        self.pending = set()
+        self.lost = False
+
+        libc = _get_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        try:
+            self._add_watch('')
+        except OSError:
+            os.close(self.fd)
+            raise
+
+        for rel_dir, _, _ in os.walk(root):
+            rel_dir = os.path.relpath(rel_dir, root)
+            if rel_dir != '.':
+                self._try_add_watch(rel_dir)
+
+
+    def _add_watch(self, rel_dir):
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        wd = _get_libc().inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.wd_to_dir[wd] = rel_dir
+
+
+    def _try_add_watch(self, rel_dir):
+        try:
+            self._add_watch(rel_dir)
+        except OSError as exc:
+            if exc.errno == errno.ENOSPC:
+                logging.warning("inotify watch limit reached under %s (fs.inotify.max_user_watches)", self.root)
+                self.lost = True
+            elif exc.errno not in (errno.ENOENT, errno.ENOTDIR):
+                logging.warning("Unable to watch %s: %s", os.path.join(self.root, rel_dir), exc)
+                self.lost = True
+
+
+    def _add_tree(self, rel_dir):
+        """Watch a newly created directory and report the files already in it."""
+
+        self._try_add_watch(rel_dir)
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.root, rel_dir)):
+            sub_dir = os.path.relpath(dirpath, self.root)
+            for dirname in dirnames:
+                self._try_add_watch(os.path.join(sub_dir, dirname))
+            self.pending.update(os.path.join(sub_dir, filename) for filename in filenames)
+
+
+    def _read_events(self):
+        while True:
+            try:
+                buf = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                return
+            if not buf:
+                return
+
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(buf[offset:offset + name_len].rstrip(b'\0'))
+                offset += name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    logging.warning("inotify event queue overflowed for %s", self.root)
+                    self.lost = True
+                    continue
+
+                rel_dir = self.wd_to_dir.get(wd)
+                if rel_dir is None:
+                    continue
+
+                if mask & IN_IGNORED:
+                    del self.wd_to_dir[wd]
+                    if rel_dir == '':
+                        self.lost = True
+                    continue
+
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if rel_dir == '':
+                        self.lost = True
+                    continue
+
+                rel_path = os.path.join(rel_dir, name) if rel_dir else name
+
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._add_tree(rel_path)
+                    continue
+
+                if mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+                    self.pending.add(rel_path)
+
+
+    def changes(self, timeout: float = 0):
+        """Return the set of files created or modified since the last call.
+
+        Args:
+            timeout: Seconds to wait for the first event when none are
+                queued.
+
+        Returns:
+            A set of paths relative to :attr:`root`, or ``None`` if events
+            may have been lost since the last call.
+        """
+
+        if timeout and not self.pending:
+            select.select([self.fd], [], [], timeout)
+
+        self._read_events()
+
+        changed, self.pending = self.pending, set()
+
+        if self.lost:
+            self.lost = False
+            return None
+
+        return changed
+
+
+    def close(self):
+        """Remove all watches and close the inotify descriptor."""
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.wd_to_dir = {}
+
+
+def create_watcher(root: str, poll_interval: float = 60):
+    """Return the most suitable watcher for the directory *root*.
+
+    inotify is used for local filesystems; network filesystems (see
+    :data:`NETWORK_FS_TYPES`) and systems where inotify cannot be initialised
+    fall back to :class:`PollingWatcher`.
+
+    Args:
+        root: Existing directory to watch.
+        poll_interval: Polling interval in seconds for :class:`PollingWatcher`.
+
+    Returns:
+        An :class:`InotifyWatcher` or :class:`PollingWatcher`.
+    """
+
+    fs_type = filesystem_type(root)
+    if fs_type in NETWORK_FS_TYPES:
+        logging.debug("%s is on a %s mount, polling every %ss", root, fs_type, poll_interval)
+        return PollingWatcher(root, poll_interval)
+
+    try:
+        return InotifyWatcher(root)
+    except (OSError, AttributeError) as exc:
+        logging.warning("inotify unavailable for %s (%s), polling every %ss", root, exc, poll_interval)
+        return PollingWatcher(root, poll_interval)
@@ -3,118 +3,192 @@
 
 Used by the ``build_cruise_tracks`` and ``build_lowering_tracks`` utilities and
 the data-dashboard worker to aggregate per-file GeoJSON LineString data into a
-single FeatureCollection and optionally export it to KML 2.2 format.
+single FeatureCollection and optionally export it to KML 2.2 format.  Combined
+tracks can be built in memory (:func:`combine_geojson_files`) or streamed
+straight to disk (:func:`write_combined_track`).
 """
 
 import json
 import logging
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack
 from datetime import datetime, timezone
 from typing import Optional
 from xml.etree.ElementTree import Element, SubElement, tostring
 
-def combine_geojson_files(input_files: list, prefix: str, device_name: str) -> Optional[dict]:
-    """Combine GeoJSON LineString data from a list of OpenVDM dashboard files.
+import numpy as np
 
-    Reads each file, extracts ``visualizerData`` entries that are GeoJSON
-    ``FeatureCollection`` objects containing ``LineString`` features, and
-    merges their coordinates and ``coordTimes`` into a single
-    ``FeatureCollection``.
+from server.lib.dashboard_arrays import iter_linestring_arrays, load_dashboard_arrays, sidecar_path
+from server.lib.file_utils import json_encode, json_separators
 
-    Supports both the legacy dashboard format (top-level ``visualizerData``
-    key) and the newer multi-datatype format (nested per-datatype dicts).
+# Placeholders marking where streamed content is spliced into rendered documents
+_COORDS_MARKER = "@@OPENVDM_COORDINATES@@"
+_TIMES_MARKER = "@@OPENVDM_COORD_TIMES@@"
+
+# Reduced levels of detail written alongside the full-resolution trackline.
+# Tolerances are in decimal degrees (0.0001 ddeg is roughly 10 m).
+TRACK_LODS = {
+    "medium": {"tolerance": 0.0001},
+    "overview": {"max_points": 2000},
+}
+
+
+def _iter_visualizer_entries(data: dict):
+    """
+    Yield every visualizerData entry from legacy or new dashboard JSON.
+    """
+
+    # Legacy format
+    if "visualizerData" in data and isinstance(data["visualizerData"], list):
+        yield from data["visualizerData"]
+
+    # New format: multiple datatypes possible
+    for value in data.values():
+        if (
+            isinstance(value, dict)
+            and "visualizerData" in value
+            and isinstance(value["visualizerData"], list)
+        ):
+            yield from value["visualizerData"]
+
+
+def _load_sidecar_arrays(json_path: str) -> Optional[dict]:
+    """
+    Return the memory-mapped sidecar arrays for a dashboard file, or None if
+    there is no sidecar or it is older than the json file.
+    """
+
+    npz_path = sidecar_path(json_path)
+
+    try:
+        if os.path.getmtime(npz_path) < os.path.getmtime(json_path):
+            return None
+        return load_dashboard_arrays(npz_path)
+    except FileNotFoundError:
+        return None
+    except Exception as exc:
+        logging.warning("Could not read array sidecar %s, falling back to json", npz_path)
+        logging.debug(str(exc))
+        return None
+
+
+def iter_track_segments(input_files: list):
+    """Yield the ``LineString`` track segments found in OpenVDM dashboard files.
+
+    Files are read one at a time so memory use is bounded by the largest
+    single file.  When an up-to-date columnar sidecar (see
+    :mod:`server.lib.dashboard_arrays`) exists for a file, its memory-mapped
+    arrays are used instead of decoding the JSON.
 
     Args:
         input_files: List of absolute paths to OpenVDM dashboard JSON files.
-        prefix: Prefix string used to name the output feature
-            (``"{prefix}_{device_name}"``).
-        device_name: Name of the device or collection system.
 
-    Returns:
-        A GeoJSON ``FeatureCollection`` dict on success, or ``None`` if no
-        usable GeoJSON track data was found or a file could not be parsed.
+    Yields:
+        ``(coordinates, coordTimes)`` tuples of lists, one per ``LineString``
+        feature, in file order.
+
+    Raises:
+        OSError: If a file cannot be read.
+        ValueError: If a file does not contain valid JSON.
     """
 
-    def iter_visualizer_entries(data: dict):
-        """
-        Yield every visualizerData entry from legacy or new dashboard JSON.
-        """
+    for file in input_files:
+        arrays = _load_sidecar_arrays(file)
+        if arrays is not None:
+            for coords, times in iter_linestring_arrays(arrays):
+                yield coords.tolist(), times.tolist()
+            continue
 
-        # Legacy format
-        if "visualizerData" in data and isinstance(data["visualizerData"], list):
-            yield from data["visualizerData"]
+        with open(file, "r", encoding="utf-8") as f:
+            raw = json.load(f)
 
-        # New format: multiple datatypes possible
-        for value in data.values():
+        for entry in _iter_visualizer_entries(raw):
+            # Only GeoJSON FeatureCollections are relevant
             if (
-                isinstance(value, dict)
-                and "visualizerData" in value
-                and isinstance(value["visualizerData"], list)
+                not isinstance(entry, dict)
+                or entry.get("type") != "FeatureCollection"
+                or not isinstance(entry.get("features"), list)
             ):
-                yield from value["visualizerData"]
+                continue
 
-    # ------------------------------------------------------------------
+            for feature in entry["features"]:
+                geom = feature.get("geometry", {})
+                props = feature.get("properties", {})
 
-    if not input_files:
-        return None
+                if geom.get("type") != "LineString":
+                    continue
+
+                coords = geom.get("coordinates", [])
+                times = props.get("coordTimes", [])
 
-    combined = {
+                if not isinstance(coords, list) or not isinstance(times, list):
+                    continue
+
+                yield coords, times
+
+
+def _empty_track(prefix: str, device_name: str, coordinates=None, coord_times=None) -> dict:
+    return {
         "type": "FeatureCollection",
         "features": [
             {
                 "type": "Feature",
                 "geometry": {
                     "type": "LineString",
-                    "coordinates": [],
+                    "coordinates": [] if coordinates is None else coordinates,
                 },
                 "properties": {
                     "name": f"{prefix}_{device_name}",
-                    "coordTimes": [],
+                    "coordTimes": [] if coord_times is None else coord_times,
                 },
             }
         ],
     }
 
-    out_feature = combined["features"][0]
-    found_geojson = False
 
-    # ------------------------------------------------------------------
+def combine_geojson_files(input_files: list, prefix: str, device_name: str) -> Optional[dict]:
+    """Combine GeoJSON LineString data from a list of OpenVDM dashboard files.
 
-    for file in input_files:
-        try:
-            with open(file, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-
-            for entry in iter_visualizer_entries(raw):
-                # Only GeoJSON FeatureCollections are relevant
-                if (
-                    not isinstance(entry, dict)
-                    or entry.get("type") != "FeatureCollection"
-                    or not isinstance(entry.get("features"), list)
-                ):
-                    continue
+    Reads each file, extracts ``visualizerData`` entries that are GeoJSON
+    ``FeatureCollection`` objects containing ``LineString`` features, and
+    merges their coordinates and ``coordTimes`` into a single
+    ``FeatureCollection``.
 
-                found_geojson = True
+    Supports both the legacy dashboard format (top-level ``visualizerData``
+    key) and the newer multi-datatype format (nested per-datatype dicts).
+    See :func:`write_combined_track` to write the combined track to disk
+    without holding it in memory.
 
-                for feature in entry["features"]:
-                    geom = feature.get("geometry", {})
-                    props = feature.get("properties", {})
+    Args:
+        input_files: List of absolute paths to OpenVDM dashboard JSON files.
+        prefix: Prefix string used to name the output feature
+            (``"{prefix}_{device_name}"``).
+        device_name: Name of the device or collection system.
 
-                    if geom.get("type") != "LineString":
-                        continue
+    Returns:
+        A GeoJSON ``FeatureCollection`` dict on success, or ``None`` if no
+        usable GeoJSON track data was found or a file could not be parsed.
+    """
 
-                    coords = geom.get("coordinates", [])
-                    times = props.get("coordTimes", [])
+    if not input_files:
+        return None
 
-                    if not isinstance(coords, list) or not isinstance(times, list):
-                        continue
+    combined = _empty_track(prefix, device_name)
+    out_feature = combined["features"][0]
+    found_geojson = False
 
-                    out_feature["geometry"]["coordinates"].extend(coords)
-                    out_feature["properties"]["coordTimes"].extend(times)
+    try:
+        for coords, times in iter_track_segments(input_files):
+            found_geojson = True
+            out_feature["geometry"]["coordinates"].extend(coords)
+            out_feature["properties"]["coordTimes"].extend(times)
 
-        except Exception as exc:
-            logging.error("ERROR: Could not process file: %s", file)
-            logging.debug(str(exc))
-            return None
+    except Exception as exc:
+        logging.error("ERROR: Could not process dashboard files for %s", device_name)
+        logging.debug(str(exc))
+        return None
 
     if not found_geojson:
         logging.warning("No GeoJSON track data found for %s", device_name)
@@ -123,49 +197,414 @@ def combine_geojson_files(input_files: list, prefix: str, device_name: str) -> O
     return combined
 
 
+def write_combined_track(input_files: list, prefix: str, device_name: str,
+                         geojson_path: Optional[str] = None,
+                         kml_path: Optional[str] = None) -> dict:
+    """Combine dashboard track data and stream it straight to GeoJSON/KML files.
 
+    Produces the same files as writing :func:`combine_geojson_files` output
+    with :func:`~server.lib.file_utils.output_json_data_to_file` and
+    :func:`convert_to_kml`, but each input file's segments are encoded and
+    written as soon as they are read, so the combined track is never held
+    in memory.  ``coordTimes`` (GeoJSON) and the coordinate text (KML) are
+    spooled to temporary files because they follow other content in their
+    documents.  Outputs are written to a temporary name and moved into place
+    once complete.  A failure writing one output does not affect the other.
 
-def convert_to_kml(geojson_obj: dict) -> str:
-    """Convert a GeoJSON FeatureCollection to a KML 2.2 XML string.
+    Args:
+        input_files: List of absolute paths to OpenVDM dashboard JSON files.
+        prefix: Prefix string used to name the output feature.
+        device_name: Name of the device or collection system.
+        geojson_path: GeoJSON output path, or ``None`` to skip.
+        kml_path: KML output path, or ``None`` to skip.
 
-    Reads the first feature's ``LineString`` geometry and ``coordTimes``
-    property to build a KML ``Placemark`` with a ``<TimeSpan>`` element
-    derived from the first and last coordinate timestamps.
+    Returns:
+        A dict with keys ``'verdict'`` (``bool``), ``'written'`` (the output
+        paths written) and, on failure, ``'reason'``.
+    """
 
-    ``coordTimes`` values may be ISO 8601 strings, epoch milliseconds, or
-    epoch seconds — all are normalised to ISO 8601 for KML output.
+    if not input_files:
+        return {'verdict': False, 'written': [], 'reason': f"No dashboard files for {device_name}"}
+
+    item_sep = json_separators()[0]
+
+    with ExitStack() as stack:
+        geojson_file = times_spool = kml_spool = None
+        reasons = []
+
+        if geojson_path:
+            try:
+                geojson_file = stack.enter_context(open(f"{geojson_path}.tmp", "wb"))
+                times_spool = stack.enter_context(tempfile.TemporaryFile())
+            except OSError as exc:
+                reasons.append(f"Unable to write {geojson_path}: {exc}")
+                geojson_file = None
+        if kml_path:
+            try:
+                kml_spool = stack.enter_context(tempfile.TemporaryFile())
+            except OSError as exc:
+                reasons.append(f"Unable to write {kml_path}: {exc}")
+
+        skeleton = json_encode(_empty_track(prefix, device_name, _COORDS_MARKER, _TIMES_MARKER))
+        head, rest = skeleton.split(json_encode(_COORDS_MARKER))
+        middle, tail = rest.split(json_encode(_TIMES_MARKER))
+
+        if geojson_file:
+            geojson_file.write(head + b"[")
+
+        found_geojson = False
+        coords_written = times_written = 0
+        first_time = last_time = None
+        time_count = 0
+
+        try:
+            for coords, times in iter_track_segments(input_files):
+                found_geojson = True
+
+                if geojson_file:
+                    try:
+                        if coords:
+                            geojson_file.write((item_sep if coords_written else b"") + json_encode(coords)[1:-1])
+                            coords_written += len(coords)
+                        if times:
+                            times_spool.write((item_sep if times_written else b"") + json_encode(times)[1:-1])
+                            times_written += len(times)
+                    except OSError as exc:
+                        reasons.append(f"Unable to write {geojson_path}: {exc}")
+                        geojson_file.close()
+                        _discard_partial(geojson_path)
+                        geojson_file = None
+
+                if kml_spool and coords:
+                    text = " ".join(f"{lon},{lat},0" for lon, lat, *_ in coords)
+                    try:
+                        kml_spool.write(((" " if kml_spool.tell() else "") + text).encode("utf-8"))
+                    except OSError as exc:
+                        reasons.append(f"Unable to write {kml_path}: {exc}")
+                        kml_spool = None
+
+                if times:
+                    if first_time is None:
+                        first_time = times[0]
+                    last_time = times[-1]
+                    time_count += len(times)
+
+        except Exception as exc:
+            reason = f"Could not process dashboard files for {device_name}"
+            logging.error(reason)
+            logging.debug(str(exc))
+            _discard_partial(geojson_path, kml_path)
+            return {'verdict': False, 'written': [], 'reason': reason}
+
+        if not found_geojson:
+            _discard_partial(geojson_path, kml_path)
+            reason = f"No GeoJSON track data found for {device_name}"
+            logging.warning(reason)
+            return {'verdict': False, 'written': [], 'reason': reason}
+
+        written = []
+
+        if geojson_file:
+            try:
+                geojson_file.write(b"]" + middle + b"[")
+                times_spool.seek(0)
+                shutil.copyfileobj(times_spool, geojson_file)
+                geojson_file.write(b"]" + tail)
+                geojson_file.close()
+                os.replace(f"{geojson_path}.tmp", geojson_path)
+                written.append(geojson_path)
+            except OSError as exc:
+                _discard_partial(geojson_path)
+                reasons.append(f"Unable to write {geojson_path}: {exc}")
+
+        if kml_spool:
+            try:
+                kml_head, kml_tail = _kml_document(
+                    f"{prefix}_{device_name}",
+                    (first_time, last_time) if time_count >= 2 else None
+                )
+                with open(f"{kml_path}.tmp", "wb") as kml_file:
+                    kml_file.write(kml_head.encode("utf-8"))
+                    kml_spool.seek(0)
+                    shutil.copyfileobj(kml_spool, kml_file)
+                    kml_file.write(kml_tail.encode("utf-8"))
+                os.replace(f"{kml_path}.tmp", kml_path)
+                written.append(kml_path)
+            except OSError as exc:
+                _discard_partial(kml_path)
+                reasons.append(f"Unable to write {kml_path}: {exc}")
+
+    if reasons:
+        reason = f"Unable to write trackline files for {device_name}: {'; '.join(reasons)}"
+        logging.error(reason)
+        return {'verdict': False, 'written': written, 'reason': reason}
+
+    return {'verdict': True, 'written': written}
+
+
+def _segment_distances(points, seg_a, seg_b):
+    """
+    Distance from each point to the line segment between the matching rows of
+    seg_a and seg_b.
+    """
+
+    seg = seg_b - seg_a
+    seg_len2 = np.einsum("ij,ij->i", seg, seg)
+    t = np.einsum("ij,ij->i", points - seg_a, seg) / np.where(seg_len2 > 0, seg_len2, 1.0)
+    proj = seg_a + np.clip(t, 0.0, 1.0)[:, None] * seg
+    dist = np.hypot(points[:, 0] - proj[:, 0], points[:, 1] - proj[:, 1])
+    return np.nan_to_num(dist, nan=0.0)
+
+
+def douglas_peucker_importance(points) -> np.ndarray:
+    """Rank the vertices of a line by their Douglas-Peucker significance.
+
+    Each vertex is assigned the deviation at which the Douglas-Peucker
+    algorithm would retain it (clamped to its parent's value so the ranking
+    is hierarchical).  Keeping the vertices whose importance exceeds a
+    tolerance is equivalent to Douglas-Peucker simplification with that
+    tolerance, and keeping the *N* most important vertices gives the best
+    *N*-point approximation in the same hierarchy.  All segments at the same
+    recursion depth are processed in a single vectorized step.
 
     Args:
-        geojson_obj: A GeoJSON ``FeatureCollection`` dict as produced by
-            :func:`combine_geojson_files`.
+        points: ``(N, 2+)`` array-like of vertices; only the first two
+            columns (lon, lat) are used.
 
     Returns:
-        A KML 2.2 XML string with an ``<?xml?>`` declaration.
+        ``(N,)`` float array of importances; the end points are ``inf``.
     """
 
-    def _to_kml_time(value):
-        """
-        Convert coordTimes value to ISO-8601 string for KML.
-        Supports:
-          - ISO strings (pass-through)
-          - epoch milliseconds
-          - epoch seconds
-        """
-        if isinstance(value, str):
-            return value
+    count = len(points)
+    importance = np.zeros(count)
+    if count == 0:
+        return importance
 
-        if isinstance(value, (int, float)):
-            # Heuristic: milliseconds vs seconds
-            if value > 1e12:
-                value /= 1000.0
-            return datetime.fromtimestamp(value, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+    points = np.asarray(points, dtype=np.float64)[:, :2]
+    importance[[0, -1]] = np.inf
+    if count < 3:
+        return importance
 
-        raise ValueError(f"Unsupported coordTime type: {type(value)}")
+    starts = np.array([0])
+    ends = np.array([count - 1])
+    parents = np.array([np.inf])
 
-    feature = geojson_obj["features"][0]
-    props = feature.get("properties", {})
-    coords = feature["geometry"]["coordinates"]
-    coord_times = props.get("coordTimes", [])
+    while starts.size:
+        lengths = ends - starts - 1
+        group_starts = np.cumsum(lengths) - lengths
+        seg_ids = np.repeat(np.arange(starts.size), lengths)
+        idx = np.repeat(starts + 1 - group_starts, lengths) + np.arange(lengths.sum())
+
+        dist = _segment_distances(points[idx], points[starts][seg_ids], points[ends][seg_ids])
+
+        # first vertex with the maximum distance in each segment
+        maxes = np.maximum.reduceat(dist, group_starts)
+        is_max = dist == maxes[seg_ids]
+        _, first = np.unique(seg_ids[is_max], return_index=True)
+        splits = idx[is_max][first]
+
+        values = np.minimum(maxes, parents)
+        importance[splits] = values
+
+        starts, ends = np.concatenate([starts, splits]), np.concatenate([splits, ends])
+        parents = np.concatenate([values, values])
+
+        keep = ends - starts > 1
+        starts, ends, parents = starts[keep], ends[keep], parents[keep]
+
+    return importance
+
+
+def simplify_linestring(coords, coord_times=None, tolerance: Optional[float] = None,
+                        max_points: Optional[int] = None) -> tuple:
+    """Simplify a LineString, keeping the ``coordTimes`` of retained vertices.
+
+    With *tolerance* this is Douglas-Peucker simplification (vertices closer
+    than *tolerance* to the simplified line are dropped).  With *max_points*
+    the most significant vertices are kept up to that budget.  When both are
+    given both limits apply.  The first and last vertices are always kept.
+
+    Args:
+        coords: Sequence of ``[lon, lat(, alt)]`` vertices.
+        coord_times: Optional sequence of timestamps parallel to *coords*.
+        tolerance: Maximum deviation in decimal degrees.
+        max_points: Maximum number of vertices to keep (at least 2).
+
+    Returns:
+        Tuple ``(coords, coord_times)`` of lists; ``coord_times`` is ``None``
+        if none were given.
+
+    Raises:
+        ValueError: If *coord_times* is not the same length as *coords*.
+    """
+
+    if coord_times is not None and len(coord_times) != len(coords):
+        raise ValueError("coordTimes must be the same length as coordinates")
+
+    importance = douglas_peucker_importance(coords)
+    keep = np.ones(len(importance), dtype=bool)
+
+    if tolerance is not None:
+        keep &= importance > tolerance
+
+    if max_points is not None and np.count_nonzero(keep) > max(max_points, 2):
+        ranked = np.where(keep, importance, -1.0)
+        budget = np.zeros(len(importance), dtype=bool)
+        budget[np.argpartition(-ranked, max(max_points, 2) - 1)[:max(max_points, 2)]] = True
+        keep &= budget
+
+    kept = np.flatnonzero(keep)
+    coords_out = [coords[i] for i in kept]
+    times_out = [coord_times[i] for i in kept] if coord_times is not None else None
+
+    return coords_out, times_out
+
+
+def simplify_geojson(geojson_obj: dict, tolerance: Optional[float] = None,
+                     max_points: Optional[int] = None) -> dict:
+    """Return a copy of a GeoJSON FeatureCollection with simplified LineStrings.
+
+    See :func:`simplify_linestring` for the meaning of *tolerance* and
+    *max_points*, which apply to each ``LineString`` feature.  Other
+    features are copied unchanged.
+
+    Args:
+        geojson_obj: A GeoJSON ``FeatureCollection`` dict.
+        tolerance: Maximum deviation in decimal degrees.
+        max_points: Maximum number of vertices per LineString.
+
+    Returns:
+        A new ``FeatureCollection`` dict.
+    """
+
+    features = []
+    for feature in geojson_obj.get("features", []):
+        geom = feature.get("geometry") or {}
+        if geom.get("type") != "LineString":
+            features.append(feature)
+            continue
+
+        props = dict(feature.get("properties") or {})
+        coord_times = props.get("coordTimes")
+        if not isinstance(coord_times, list) or len(coord_times) != len(geom.get("coordinates", [])):
+            coord_times = None
+
+        coords, times = simplify_linestring(
+            geom.get("coordinates", []), coord_times, tolerance=tolerance, max_points=max_points
+        )
+        if times is not None:
+            props["coordTimes"] = times
+
+        features.append({
+            **feature,
+            "geometry": {**geom, "coordinates": coords},
+            "properties": props,
+        })
+
+    return {**geojson_obj, "features": features}
+
+
+def build_track_lods(input_files: list, prefix: str, device_name: str,
+                     lods: Optional[dict] = None) -> dict:
+    """Build reduced level-of-detail versions of a combined track.
+
+    Each track segment is simplified as it is read and the simplified
+    segments are merged, so, like :func:`write_combined_track`, the full
+    combined track is never held in memory.  Point-budgeted levels are
+    reduced again whenever they grow past twice their budget.
+
+    Args:
+        input_files: List of absolute paths to OpenVDM dashboard JSON files.
+        prefix: Prefix string used to name the output feature.
+        device_name: Name of the device or collection system.
+        lods: Mapping of level name to :func:`simplify_linestring` keyword
+            arguments.  Defaults to :data:`TRACK_LODS`.
+
+    Returns:
+        Dict mapping level name to a GeoJSON ``FeatureCollection`` dict, or an
+        empty dict if no track data was found or a file could not be parsed.
+    """
+
+    lods = lods or TRACK_LODS
+
+    # per level: simplified coordinates and coordTimes so far
+    buffers = {name: ([], []) for name in lods}
+    times_ok = True
+    point_count = 0
+
+    try:
+        for seg_coords, seg_times in iter_track_segments(input_files):
+            if not seg_coords:
+                continue
+
+            point_count += len(seg_coords)
+            if times_ok and len(seg_times) != len(seg_coords):
+                logging.warning("coordTimes do not match coordinates for %s, omitting them", device_name)
+                times_ok = False
+
+            for name, options in lods.items():
+                lod_coords, lod_times = buffers[name]
+                seg_lod_coords, seg_lod_times = simplify_linestring(seg_coords, seg_times if times_ok else None, **options)
+                lod_coords.extend(seg_lod_coords)
+                if times_ok:
+                    lod_times.extend(seg_lod_times)
+
+                # keep a point-budgeted level bounded while the track streams in
+                max_points = options.get("max_points")
+                if max_points is not None and len(lod_coords) > 2 * max(max_points, 2):
+                    lod_coords, lod_times = simplify_linestring(lod_coords, lod_times if times_ok else None, **options)
+                    buffers[name] = (lod_coords, lod_times or [])
+
+    except Exception as exc:
+        logging.error("ERROR: Could not process dashboard files for %s", device_name)
+        logging.debug(str(exc))
+        return {}
+
+    if not point_count:
+        return {}
+
+    results = {}
+    for name, options in lods.items():
+        # simplify the merged segments once more across segment boundaries
+        lod_coords, lod_times = buffers[name]
+        lod_coords, lod_times = simplify_linestring(lod_coords, lod_times if times_ok else None, **options)
+        logging.debug("%s %s LOD: %d of %d points", device_name, name, len(lod_coords), point_count)
+        results[name] = _empty_track(prefix, device_name, lod_coords, lod_times)
+
+    return results
+
+
+def _discard_partial(*paths):
+    for path in paths:
+        if path and os.path.isfile(f"{path}.tmp"):
+            os.remove(f"{path}.tmp")
+
+
+def _to_kml_time(value):
+    """
+    Convert coordTimes value to ISO-8601 string for KML.
+    Supports:
+      - ISO strings (pass-through)
+      - epoch milliseconds
+      - epoch seconds
+    """
+    if isinstance(value, str):
+        return value
+
+    if isinstance(value, (int, float)):
+        # Heuristic: milliseconds vs seconds
+        if value > 1e12:
+            value /= 1000.0
+        return datetime.fromtimestamp(value, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+    raise ValueError(f"Unsupported coordTime type: {type(value)}")
+
+
+def _kml_document(track_name: str, time_bounds: Optional[tuple]) -> tuple:
+    """
+    Render the KML document for a track and return the text before and after
+    the LineString coordinates so they can be written separately.
+    """
 
     kml = Element("kml")
     kml.set("xmlns", "http://www.opengis.net/kml/2.2")
@@ -175,7 +614,7 @@ def convert_to_kml(geojson_obj: dict) -> str:
 
     document = SubElement(kml, "Document")
     name = SubElement(document, "name")
-    name.text = f"{props.get('name', 'Trackline')}_Trackline.kml"
+    name.text = f"{track_name}_Trackline.kml"
 
     placemark = SubElement(document, "Placemark")
 
@@ -186,10 +625,10 @@ def convert_to_kml(geojson_obj: dict) -> str:
     # TimeSpan (optional, but recommended)
     # --------------------------------------------------
 
-    if coord_times and len(coord_times) >= 2:
+    if time_bounds:
         try:
-            begin = _to_kml_time(coord_times[0])
-            end = _to_kml_time(coord_times[-1])
+            begin = _to_kml_time(time_bounds[0])
+            end = _to_kml_time(time_bounds[1])
 
             if begin and end:
                 timespan = SubElement(placemark, "TimeSpan")
@@ -212,14 +651,47 @@ def convert_to_kml(geojson_obj: dict) -> str:
     tessellate.text = "1"
 
     coordinates_el = SubElement(linestring, "coordinates")
+    coordinates_el.text = _COORDS_MARKER
+
+    document_str = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        + tostring(kml, encoding="utf-8").decode("utf-8")
+    )
+
+    head, tail = document_str.split(_COORDS_MARKER)
+    return head, tail
+
+
+def convert_to_kml(geojson_obj: dict) -> str:
+    """Convert a GeoJSON FeatureCollection to a KML 2.2 XML string.
+
+    Reads the first feature's ``LineString`` geometry and ``coordTimes``
+    property to build a KML ``Placemark`` with a ``<TimeSpan>`` element
+    derived from the first and last coordinate timestamps.
+
+    ``coordTimes`` values may be ISO 8601 strings, epoch milliseconds, or
+    epoch seconds — all are normalised to ISO 8601 for KML output.
+
+    Args:
+        geojson_obj: A GeoJSON ``FeatureCollection`` dict as produced by
+            :func:`combine_geojson_files`.
+
+    Returns:
+        A KML 2.2 XML string with an ``<?xml?>`` declaration.
+    """
+
+    feature = geojson_obj["features"][0]
+    props = feature.get("properties", {})
+    coords = feature["geometry"]["coordinates"]
+    coord_times = props.get("coordTimes", [])
+
+    head, tail = _kml_document(
+        props.get('name', 'Trackline'),
+        (coord_times[0], coord_times[-1]) if coord_times and len(coord_times) >= 2 else None
+    )
 
     coordinates_text = []
     for lon, lat, *rest in coords:
         coordinates_text.append(f"{lon},{lat},0")
 
-    coordinates_el.text = " ".join(coordinates_text)
-
-    return (
-        '<?xml version="1.0" encoding="utf-8"?>'
-        + tostring(kml, encoding="utf-8").decode("utf-8")
-    )
+    return head + " ".join(coordinates_text) + tail
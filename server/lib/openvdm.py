@@ -311,6 +311,93 @@ class OpenVDM():
 
         return self.config.get('transferInterval')
 
+    def get_transfer_intervals(self):
+        """
+        Return the per-transfer intervals (transfer name -> minutes)
+        """
+
+        return self.config.get('transferIntervals') or {}
+
+    def get_rsync_streams(self):
+        """
+        Return the per-transfer parallel rsync settings (transfer name ->
+        stream count or {'streams': N, 'shardBy': 'size'|'subdir'})
+        """
+
+        return self.config.get('rsyncStreams') or {}
+
+    def get_transfer_ordering(self):
+        """
+        Return the per-transfer ordering settings (transfer name ->
+        {'order', 'largeFileSize', 'batchSize'})
+        """
+
+        return self.config.get('transferOrdering') or {}
+
+    def get_source_test_cache_ttl(self):
+        """
+        Return the number of seconds a passing collection system transfer
+        source test is reused by subsequent transfers (0 to always test)
+        """
+
+        return self.config.get('sourceTestCacheTTL')
+
+    def get_cruise_data_transfer_index(self):
+        """
+        Return the cruise data transfer file index settings, an empty dict
+        to estimate transfers with an rsync dry-run
+        """
+
+        return self.config.get('cruiseDataTransferIndex') or {}
+
+    def get_ship_to_shore_bandwidth(self):
+        """
+        Return the adaptive ship-to-shore bandwidth settings, an empty dict
+        for a fixed bandwidth limit
+        """
+
+        return self.config.get('shipToShoreBandwidth') or {}
+
+    def get_ship_to_shore_queue(self):
+        """
+        Return the ship-to-shore queue settings, an empty dict to send all
+        matching files in one pass
+        """
+
+        return self.config.get('shipToShoreQueue') or {}
+
+    def get_ship_to_shore_bundles(self):
+        """
+        Return the ship-to-shore bundling settings, an empty dict to send
+        every file as-is
+        """
+
+        return self.config.get('shipToShoreBundles') or {}
+
+    def get_ship_to_shore_journal(self):
+        """
+        Return the ship-to-shore delivery journal settings, an empty dict to
+        compare every file with the destination on each run
+        """
+
+        return self.config.get('shipToShoreJournal') or {}
+
+    def get_transfer_coordinator(self):
+        """
+        Return the settings limiting concurrent cruise data transfers, an
+        empty dict for no limit
+        """
+
+        return self.config.get('transferCoordinator') or {}
+
+    def get_watched_transfers(self):
+        """
+        Return the names of the transfers the transfer watcher should trigger,
+        None for all local/SMB transfers
+        """
+
+        return self.config.get('watchedTransfers')
+
     def get_transfer_log_dir(self):
         """
         Return the directory where transfer log files are stored
@@ -334,6 +421,23 @@ class OpenVDM():
         return self.config.get('logfilePurgeTimedelta')
 
 
+    def get_profile_parsers(self):
+        """
+        Return whether plugin parsers should record per-phase timings
+        """
+
+        return bool(self.config.get('profileParsers', False))
+
+
+    def get_dashboard_array_sidecar(self):
+        """
+        Return whether the data dashboard should write columnar (.npz) sidecar
+        files alongside the dashboard json files
+        """
+
+        return bool(self.config.get('dashboardArraySidecar', False))
+
+
     def get_cruise_id(self):
         """
         Return the current cruise id
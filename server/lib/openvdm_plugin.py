@@ -22,13 +22,15 @@ import fnmatch
 import re
 import json
 import logging
+import time
+from contextlib import contextmanager
 from datetime import datetime
 import numpy as np
 import pandas as pd
 
 from server.lib.openvdm import OpenVDM
 from server.lib.condense_to_ranges import condense_to_ranges
-from server.lib.file_utils import NpEncoder
+from server.lib.file_utils import NpEncoder, json_encode
 
 
 STAT_TYPES = [
@@ -49,6 +51,36 @@ QUALITY_TEST_RESULT_TYPES = [
 DEFAULT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ" # ISO8601 Format, OpenRVDAS style
 # DEFAULT_TIME_FORMAT = "%m/%d/%Y %H:%M:%S.%f" # SCS style
 
+PROFILE_PHASES = [
+    'read',
+    'parse',
+    'crop',
+    'stats',
+    'resample',
+    'round',
+    'visualization',
+    'sanitize'
+]
+
+# Default for parsers that are not explicitly told whether to record
+# per-phase timings.  Toggled by the data-dashboard worker via set_profiling().
+_PROFILE_PARSERS = False
+
+
+def set_profiling(enabled: bool) -> None:
+    """Enable or disable per-phase timing for parsers created afterwards.
+
+    Plugins instantiate their parsers internally, so the data-dashboard worker
+    uses this module-level switch rather than threading a flag through every
+    plugin and parser constructor.
+
+    Args:
+        enabled: ``True`` to record phase timings in newly created parsers.
+    """
+
+    global _PROFILE_PARSERS # pylint: disable=global-statement
+    _PROFILE_PARSERS = bool(enabled)
+
 
 class OpenVDMParserQualityTest():
     """Data object representing the result of a single OpenVDM QA/QC test.
@@ -278,15 +310,20 @@ class OpenVDMParser():
             error messages, or ``None`` when API access is disabled.
         plugin_data: Accumulated output dict with keys ``'visualizerData'``,
             ``'qualityTests'``, and ``'stats'``.
+        profile: If ``True``, wall-clock time spent in each parsing phase is
+            accumulated in :attr:`timings` (see :data:`PROFILE_PHASES`).
+        timings: Dict mapping phase name to elapsed seconds.
     """
 
-    def __init__(self, use_openvdm_api: bool = False) -> None:
+    def __init__(self, use_openvdm_api: bool = False, profile: bool = None) -> None:
         """Initialise the parser.
 
         Args:
             use_openvdm_api: If ``True``, instantiate an
                 :class:`~server.lib.openvdm.OpenVDM` connection so that
                 parsing errors can be posted as messages to the web UI.
+            profile: Record per-phase timings.  Defaults to the value set via
+                :func:`set_profiling`.
         """
         self.openvdm = OpenVDM() if use_openvdm_api else None
         self.plugin_data = {
@@ -295,6 +332,76 @@ class OpenVDMParser():
             'stats': []
         }
 
+        self.profile = _PROFILE_PARSERS if profile is None else profile
+        self.timings = {}
+        self._profile_current = None
+        self._profile_mark = None
+
+
+    def _add_timing(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+
+    def _profile_advance(self, phase):
+        """Charge the time since the last phase change to the running phase
+        and start timing *phase* (``None`` stops the clock).
+
+        Returns the phase that was running so callers can restore it.
+        """
+
+        previous = self._profile_current
+        if not self.profile:
+            return previous
+
+        now = time.perf_counter()
+        if previous is not None:
+            self._add_timing(previous, now - self._profile_mark)
+
+        self._profile_current = phase
+        self._profile_mark = now
+        return previous
+
+
+    @contextmanager
+    def profile_phase(self, phase):
+        """Context manager that charges the time spent in the block to *phase*.
+
+        The built-in helpers (line reading, cropping, resampling, rounding and
+        sanitising) are already instrumented; parsers may wrap any additional
+        block.  Does nothing unless :attr:`profile` is ``True``.
+
+        Args:
+            phase: Name of the phase, normally one of :data:`PROFILE_PHASES`.
+        """
+
+        if not self.profile:
+            yield
+            return
+
+        previous = self._profile_advance(phase)
+        try:
+            yield
+        finally:
+            self._profile_advance(previous)
+
+
+    def get_timings(self):
+        """
+        Return the recorded phase timings (in seconds, rounded to the
+        microsecond) plus their total, or None when profiling is disabled.
+        """
+
+        if not self.profile:
+            return None
+
+        # close the lap for whatever phase is still running
+        self._profile_advance(self._profile_current)
+
+        timings = {phase: round(self.timings[phase], 6) for phase in PROFILE_PHASES if phase in self.timings}
+        timings.update({phase: round(value, 6) for phase, value in self.timings.items() if phase not in timings})
+        timings['total'] = round(sum(self.timings.values()), 6)
+        return timings
+
 
     def get_plugin_data(self):
         """
@@ -354,11 +461,23 @@ class OpenVDMParser():
         self.plugin_data['visualizerData'].append(data)
 
 
+    def _enter_stats_phase(self):
+        """
+        Statistics and quality tests are computed inline by each parser, so
+        the first add_*() call marks the end of the data-loading phase.
+        """
+
+        if self.profile and self._profile_current not in ('stats', 'crop'):
+            self._profile_advance('stats')
+
+
     def add_quality_test_failed(self, name):
         """
         Add a failed QA test with the provided name
         """
 
+        self._enter_stats_phase()
+
         test = OpenVDMParserQualityTestFailed(name)
         self.plugin_data['qualityTests'].append(test.get_test_data())
 
@@ -368,6 +487,8 @@ class OpenVDMParser():
         Add a partially failed QA test with the provided name
         """
 
+        self._enter_stats_phase()
+
         test = OpenVDMParserQualityTestWarning(name)
         self.plugin_data['qualityTests'].append(test.get_test_data())
 
@@ -377,6 +498,8 @@ class OpenVDMParser():
         Add a passing QA test with the provided name
         """
 
+        self._enter_stats_phase()
+
         test = OpenVDMParserQualityTestPassed(name)
         self.plugin_data['qualityTests'].append(test.get_test_data())
 
@@ -386,6 +509,8 @@ class OpenVDMParser():
         Add a bounds statistic with the given name, value and unit of measure
         """
 
+        self._enter_stats_phase()
+
         stat = OpenVDMParserBoundsStat(value, name, uom)
         self.plugin_data['stats'].append(stat.get_stat_data())
 
@@ -395,6 +520,8 @@ class OpenVDMParser():
         Add a geoBounds statistic with the given name, value and unit of measure
         """
 
+        self._enter_stats_phase()
+
         stat = OpenVDMParserGeoBoundsStat(value, name, uom)
         self.plugin_data['stats'].append(stat.get_stat_data())
 
@@ -404,6 +531,8 @@ class OpenVDMParser():
         Add a rowValidity statistic with the given name, value and unit of measure
         """
 
+        self._enter_stats_phase()
+
         stat = OpenVDMParserRowValidityStat(value)
         self.plugin_data['stats'].append(stat.get_stat_data())
 
@@ -413,6 +542,8 @@ class OpenVDMParser():
         Add a timeBounds statistic with the given name, value and unit of measure
         """
 
+        self._enter_stats_phase()
+
         stat = OpenVDMParserTimeBoundsStat(value, name, uom)
         self.plugin_data['stats'].append(stat.get_stat_data())
 
@@ -422,6 +553,8 @@ class OpenVDMParser():
         Add a totalValue statistic with the given name, value and unit of measure
         """
 
+        self._enter_stats_phase()
+
         stat = OpenVDMParserTotalValueStat(value, name, uom)
         self.plugin_data['stats'].append(stat.get_stat_data())
 
@@ -431,6 +564,8 @@ class OpenVDMParser():
         Add a valueValidity statistic with the given name, value and unit of measure
         """
 
+        self._enter_stats_phase()
+
         stat = OpenVDMParserValueValidityStat(value, name)
         self.plugin_data['stats'].append(stat.get_stat_data())
 
@@ -508,6 +643,11 @@ class OpenVDMCSVParser(OpenVDMParser):
     def _sanitize_for_json(self, obj):
         """Recursively convert NumPy types and datetimes to JSON-native types.
 
+        The ``visualizerData`` list is passed through untouched: it only
+        holds epoch timestamps and numeric values, whose NumPy types are
+        serialised natively by :func:`~server.lib.file_utils.json_encode`, and
+        it accounts for nearly all of the data in a dashboard file.
+
         Args:
             obj: Object to sanitise (dict, list, NumPy scalar, datetime, or
                 any JSON-native type).
@@ -515,10 +655,25 @@ class OpenVDMCSVParser(OpenVDMParser):
         Returns:
             A JSON-serialisable equivalent of *obj*.
         """
+
+        if not self.profile:
+            return self._sanitize_value(obj)
+
+        self._profile_advance('sanitize')
+        try:
+            return self._sanitize_value(obj)
+        finally:
+            # sanitising is the final step of parse(), stop the clock
+            self._profile_advance(None)
+
+    def _sanitize_value(self, obj):
         if isinstance(obj, dict):
-            return {k: self._sanitize_for_json(v) for k, v in obj.items()}
+            return {
+                k: v if k == 'visualizerData' else self._sanitize_value(v)
+                for k, v in obj.items()
+            }
         if isinstance(obj, list):
-            return [self._sanitize_for_json(v) for v in obj]
+            return [self._sanitize_value(v) for v in obj]
         if isinstance(obj, np.generic):
             return obj.item()
         if isinstance(obj, datetime):
@@ -570,8 +725,15 @@ class OpenVDMCSVParser(OpenVDMParser):
 
         filter_predicate = make_filter_predicate(nmea_filter)
 
+        # When profiling, time spent inside this generator is charged to
+        # 'read' and time spent in the caller's loop body to 'parse'.
+        profile = self.profile
+
         errors = []
         try:
+            if profile:
+                self._profile_advance('read')
+
             with open(filepath, 'r', encoding='utf-8') as f:
                 for lineno, line in enumerate(f):
                     line = line.strip()
@@ -590,17 +752,31 @@ class OpenVDMCSVParser(OpenVDMParser):
                     if filter_predicate and not filter_predicate(fields):
                         continue
 
-                    yield lineno, timestamp_str, remainder, fields
+                    if profile:
+                        self._profile_advance('parse')
+                        yield lineno, timestamp_str, remainder, fields
+                        self._profile_advance('read')
+                    else:
+                        yield lineno, timestamp_str, remainder, fields
 
         except Exception as err:
             logging.error("Failed to read file %s: %s", filepath, err)
             return
 
+        finally:
+            if profile:
+                self._profile_advance('parse')
+
     def crop_data(self, data_frame):
         """
         Crop the data to the start/stop time specified in the parser object
         """
 
+        with self.profile_phase('crop'):
+            return self._crop_data(data_frame)
+
+
+    def _crop_data(self, data_frame):
         try:
             if self.start_dt is not None:
                 logging.debug("  start_dt: %s", self.start_dt)
@@ -617,12 +793,13 @@ class OpenVDMCSVParser(OpenVDMParser):
         return data_frame
 
 
-    @staticmethod
-    def resample_data(data_frame, resample_interval='1min'):
+    def resample_data(self, data_frame, resample_interval='1min'):
         """
         Resample the data to the specified interval
         """
 
+        self._profile_advance('resample')
+
         try:
             resample_df = data_frame.resample(resample_interval, label='right', closed='right').mean()
         except Exception as exc:
@@ -631,15 +808,27 @@ class OpenVDMCSVParser(OpenVDMParser):
             raise exc
 
         # reset index
-        return resample_df.reset_index()
+        resample_df = resample_df.reset_index()
 
+        self._profile_advance('visualization')
+        return resample_df
 
-    @staticmethod
-    def round_data(data_frame, precision=None):
+
+    def round_data(self, data_frame, precision=None):
         """
         Round the data to the specified precision
         """
 
+        with self.profile_phase('round'):
+            data_frame = self._round_data(data_frame, precision)
+
+        # Rounding is the last step before the visualization data is built
+        self._profile_advance('visualization')
+        return data_frame
+
+
+    @staticmethod
+    def _round_data(data_frame, precision=None):
         if precision is None or bool(precision):
             try:
                 decimals = pd.Series(precision.values(), index=precision.keys())
@@ -702,16 +891,16 @@ class OpenVDMCSVParser(OpenVDMParser):
         Output the plugin data as a json-formatted string.
         """
 
-        return json.dumps(self.get_plugin_data(), cls=NpEncoder)
+        return json_encode(self.get_plugin_data()).decode('utf-8')
 
     @classmethod
     def run_cli(cls) -> None:
         """Entry point for running the parser from the command line.
 
         Parses standard OpenVDM CLI arguments (``-v``, ``--startDT``,
-        ``--stopDT``, ``--timeFormat``, and ``dataFile``), instantiates the
-        parser, calls :meth:`process_file`, and prints the JSON result to
-        stdout.
+        ``--stopDT``, ``--timeFormat``, ``--profile``, ``--profileFile``, and
+        ``dataFile``), instantiates the parser, calls :meth:`process_file`,
+        and prints the JSON result to stdout.
 
         Subclasses can extend the argument set by overriding
         :meth:`add_cli_arguments` and ``_extract_custom_cli_kwargs``.
@@ -731,6 +920,11 @@ class OpenVDMCSVParser(OpenVDMParser):
         parser.add_argument('--stopDT', default=None,
                             type=lambda s: datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ'),
                             help='Crop stop timestamp (iso8601)')
+        parser.add_argument('--profile', action='store_true', default=False,
+                            help='Run under cProfile and report per-phase timings')
+        parser.add_argument('--profileFile', default=None, metavar='FILE',
+                            help='Write the cProfile stats to FILE (pstats format) '
+                                 'instead of stderr')
         parser.add_argument('dataFile', metavar='dataFile',
                             help='The raw data file to process')
 
@@ -757,11 +951,31 @@ class OpenVDMCSVParser(OpenVDMParser):
         if hasattr(cls, '_extract_custom_cli_kwargs'):
             instance_kwargs.update(cls._extract_custom_cli_kwargs(args))
 
+        if args.profile:
+            set_profiling(True)
+
         parser_instance = cls(**instance_kwargs)
 
         try:
             logging.info("Processing file: %s", args.dataFile)
-            parser_instance.process_file(args.dataFile)
+            if args.profile:
+                import cProfile
+                import pstats
+                import sys
+
+                profiler = cProfile.Profile()
+                profiler.runcall(parser_instance.process_file, args.dataFile)
+
+                if args.profileFile:
+                    profiler.dump_stats(args.profileFile)
+                    logging.warning("cProfile stats written to: %s", args.profileFile)
+                else:
+                    pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+
+                logging.warning("Phase timings (s): %s", json.dumps(parser_instance.get_timings()))
+            else:
+                parser_instance.process_file(args.dataFile)
+
             print(parser_instance.to_json())
             logging.info("Done!")
         except Exception as err:
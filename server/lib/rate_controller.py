@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Adaptive bandwidth limit for transfers over a shared, metered link.
+
+:class:`AdaptiveRateController` adjusts a transfer's bandwidth limit between
+runs of the transfer using an additive-increase / multiplicative-decrease
+rule, the same scheme TCP uses to share a link:
+
+* if the round-trip time to the destination rises well above the lowest
+  RTT seen (packets are queueing, so the link is saturated and other
+  traffic is being starved) the limit is cut by ``decrease_factor``;
+* otherwise, if the transfer used (nearly) all of its limit, the limit is
+  raised by ``increase_step``;
+* otherwise the limit is left alone — the transfer was not limited by it.
+
+The limit is kept between ``min_rate`` and ``max_rate`` and can be saved so
+the next transfer starts from the rate learned by the previous one.
+"""
+
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+
+# Directory holding the learned rates of adaptive transfers
+RATE_STATE_DIR = os.path.join(tempfile.gettempdir(), 'openvdm_rates')
+
+# Fraction of the limit a transfer must reach to count as limited by it
+LIMITED_FRACTION = 0.9
+
+
+def measure_rtt(host: str, port: int = 22, timeout: float = 10) -> float:
+    """Measure the round-trip time to *host* as the time to open a TCP connection.
+
+    A TCP handshake takes one round trip and, unlike ICMP ping, needs no
+    privileges and passes the same firewalls as the transfer itself.
+
+    Args:
+        host: Destination host name or address.
+        port: TCP port the destination listens on.
+        timeout: Seconds to wait for the connection.
+
+    Returns:
+        The round-trip time in seconds, or ``None`` if the connection failed.
+    """
+
+    start = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return time.monotonic() - start
+    except OSError as exc:
+        logging.debug("Unable to measure RTT to %s:%s: %s", host, port, exc)
+        return None
+
+
+class AdaptiveRateController():
+    """AIMD bandwidth limit driven by achieved throughput and RTT.
+
+    Attributes:
+        rate: Current bandwidth limit in KB/s.
+        min_rate: Lowest limit in KB/s.
+        max_rate: Highest limit in KB/s.
+        increase_step: KB/s added when the transfer is limited by the rate.
+        decrease_factor: Multiplier applied when congestion is detected.
+        rtt_threshold: RTT, as a multiple of the baseline, that counts as
+            congestion.
+        base_rtt: Lowest RTT seen, in seconds.
+    """
+
+    def __init__(self, min_rate: int, max_rate: int, rate: int = None,
+                 increase_step: int = None, decrease_factor: float = 0.7,
+                 rtt_threshold: float = 1.5):
+        self.min_rate = max(1, int(min_rate))
+        self.max_rate = max(self.min_rate, int(max_rate))
+        self.rate = self._clamp(rate if rate else self.max_rate)
+        self.increase_step = max(1, int(increase_step or self.max_rate // 10))
+        self.decrease_factor = decrease_factor
+        self.rtt_threshold = rtt_threshold
+        self.base_rtt = None
+
+
+    def _clamp(self, rate):
+        return int(min(self.max_rate, max(self.min_rate, rate)))
+
+
+    def update(self, throughput: float, rtt: float = None) -> int:
+        """Adjust the limit after a run of the transfer.
+
+        Args:
+            throughput: Achieved throughput in KB/s.
+            rtt: Round-trip time measured during the run, in seconds, or
+                ``None`` if unknown.
+
+        Returns:
+            The new limit in KB/s.
+        """
+
+        congested = False
+        if rtt is not None:
+            if self.base_rtt is None or rtt < self.base_rtt:
+                self.base_rtt = rtt
+            congested = rtt > self.base_rtt * self.rtt_threshold
+
+        if congested:
+            rate = self._clamp(self.rate * self.decrease_factor)
+            logging.info("RTT %.0fms (baseline %.0fms), reducing bandwidth limit to %d KB/s",
+                         rtt * 1000, self.base_rtt * 1000, rate)
+        elif throughput >= self.rate * LIMITED_FRACTION:
+            rate = self._clamp(self.rate + self.increase_step)
+            if rate != self.rate:
+                logging.info("Throughput %.0f KB/s at limit, raising bandwidth limit to %d KB/s", throughput, rate)
+        else:
+            rate = self.rate
+
+        self.rate = rate
+        return rate
+
+
+    def load(self, name: str) -> None:
+        """Restore the rate saved under *name*, if any.
+
+        The baseline RTT is not restored: the route to the destination may
+        have changed since, so it is measured again by each transfer.
+        """
+
+        try:
+            with open(os.path.join(RATE_STATE_DIR, f'{name}.json'), 'r', encoding='utf-8') as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logging.warning("Unable to read saved bandwidth limit: %s", str(exc))
+            return
+
+        self.rate = self._clamp(state.get('rate', self.rate))
+        logging.debug("Resuming at bandwidth limit %d KB/s", self.rate)
+
+
+    def save(self, name: str) -> None:
+        """Save the current rate under *name*."""
+
+        state_path = os.path.join(RATE_STATE_DIR, f'{name}.json')
+        try:
+            os.makedirs(RATE_STATE_DIR, mode=0o700, exist_ok=True)
+            tmp_path = f'{state_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as state_file:
+                json.dump({'rate': self.rate, 'time': time.time()}, state_file)
+            os.replace(tmp_path, state_path)
+        except OSError as exc:
+            logging.warning("Unable to save bandwidth limit: %s", str(exc))
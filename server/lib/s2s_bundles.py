@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""Compressed bundles and append deltas for ship-to-shore transfers.
+
+Over a satellite link the bytes sent, and the per-file round trips, are what
+matter.  :class:`BundleStage` prepares the files of a ship-to-shore transfer
+before they are sent:
+
+* files that grew since they were last staged, and whose previously staged
+  content is unchanged (append-only logs), are reduced to the appended
+  bytes;
+* other small files are packed together;
+
+both into tar archives per priority class, compressed with zstd (the
+``zstandard`` package) or, when it is not installed, xz.  Larger files are
+left to be sent as they are.
+
+Each bundle is accompanied by a JSON manifest listing its members with
+their SHA-256 checksums.  On the shore side :func:`unpack_bundles` (see
+``bin/unpack_ssdw_bundles.py.dist``) applies the bundles in the order they
+were created, verifying every file and delta, and removes each bundle once
+it has been applied.  Each bundle is sent before its manifest, so a manifest
+on the destination means its bundle has been sent.
+
+Bundles and manifests are written to ``<cruiseID>/.ovdm_bundles/`` so they
+arrive at the destination next to the cruise data they unpack into.
+"""
+
+import hashlib
+import json
+import logging
+import lzma
+import os
+import tarfile
+import tempfile
+import time
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+# Directory, inside the cruise directory on the destination, receiving bundles
+BUNDLE_DIR = '.ovdm_bundles'
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Directory holding what each ship-to-shore transfer has staged so far
+STAGE_STATE_DIR = os.path.join(tempfile.gettempdir(), 'openvdm_s2s_bundles')
+
+# Files up to this size (bytes) are bundled
+DEFAULT_SMALL_FILE_SIZE = 1024 * 1024
+
+# Uncompressed bytes per bundle
+DEFAULT_BUNDLE_SIZE = 64 * 1024 * 1024
+
+DEFAULT_ZSTD_LEVEL = 10
+
+_READ_SIZE = 1024 * 1024
+
+# Errors raised reading a damaged bundle
+_BUNDLE_READ_ERRORS = (OSError, EOFError, tarfile.TarError, lzma.LZMAError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def file_sha256(path: str, length: int = None) -> str:
+    """Return the SHA-256 hex digest of *path*, or of its first *length* bytes."""
+
+    digest = hashlib.sha256()
+    remaining = length
+
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(_READ_SIZE if remaining is None else min(_READ_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    return digest.hexdigest()
+
+
+def _spool_member(f, length, digest, max_size):
+    """
+    Copy the next *length* bytes of *f* to a spooled temporary file, fed to
+    *digest* as read.  Returns the spool rewound, None if *f* ended early.
+    """
+
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size) # pylint: disable=consider-using-with
+    remaining = length
+
+    while remaining > 0:
+        chunk = f.read(min(_READ_SIZE, remaining))
+        if not chunk:
+            spool.close()
+            return None
+        digest.update(chunk)
+        spool.write(chunk)
+        remaining -= len(chunk)
+
+    spool.seek(0)
+    return spool
+
+
+def _bundle_extension():
+    return '.tar.zst' if zstandard is not None else '.tar.xz'
+
+
+def _open_bundle(path, mode):
+    """
+    Return (tarfile, raw file object) for reading ('r') or writing ('w') a
+    bundle, zstd or xz by file extension
+    """
+
+    raw = open(path, f'{mode}b') # pylint: disable=consider-using-with
+
+    if path.endswith('.tar.zst'):
+        if zstandard is None:
+            raw.close()
+            raise RuntimeError(f'zstandard is required to read {path}')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor(level=DEFAULT_ZSTD_LEVEL).stream_writer(raw, closefd=False)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+    else:
+        stream = lzma.LZMAFile(raw, mode)
+
+    return tarfile.open(fileobj=stream, mode=f'{mode}|'), stream, raw
+
+
+class BundleStage():
+    """Stage the files of a ship-to-shore transfer as bundles and deltas.
+
+    The stage remembers, per transfer, the size, mtime and checksum of every
+    file it has staged.  Unchanged files are not staged again; files that
+    grew with their staged content intact are staged as deltas.
+
+    Attributes:
+        name: Transfer name, used for the state file.
+        base_dir: Directory the file paths are relative to.
+        small_file_size: Largest file (bytes) to bundle whole.
+        bundle_size: Uncompressed bytes per bundle.
+        state: Dict mapping path to ``[size, mtime_ns, sha256]`` of the
+            content last staged.
+    """
+
+    def __init__(self, name, base_dir, small_file_size=DEFAULT_SMALL_FILE_SIZE, bundle_size=DEFAULT_BUNDLE_SIZE):
+        self.name = name
+        self.base_dir = base_dir
+        self.small_file_size = small_file_size
+        self.bundle_size = bundle_size
+        self.state = {}
+
+
+    def _state_path(self):
+        return os.path.join(STAGE_STATE_DIR, f'{self.name}.json')
+
+
+    def load(self):
+        """
+        Restore what previous runs staged
+        """
+
+        try:
+            with open(self._state_path(), 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {}
+        except (OSError, ValueError) as exc:
+            logging.warning("Unable to read bundle state: %s", str(exc))
+            self.state = {}
+
+
+    def save(self):
+        """
+        Save what has been staged and delivered
+        """
+
+        state_path = self._state_path()
+        try:
+            os.makedirs(STAGE_STATE_DIR, mode=0o700, exist_ok=True)
+            tmp_path = f'{state_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, state_path)
+        except OSError as exc:
+            logging.warning("Unable to save bundle state: %s", str(exc))
+
+
+    def plan(self, paths, priorities):
+        """Decide how each file is sent.
+
+        Args:
+            paths: File paths relative to :attr:`base_dir`.
+            priorities: Priority of each file.
+
+        Returns:
+            A dict with ``'raw'`` (``[(path, priority)]`` to send as-is),
+            ``'bundle'`` and ``'append'`` (``[(path, priority, size, mtime_ns,
+            offset)]`` to stage whole or from *offset*), and ``'unchanged'``
+            (paths staged before and not modified since).
+        """
+
+        plan = {'raw': [], 'bundle': [], 'append': [], 'unchanged': []}
+
+        for path, priority in zip(paths, priorities):
+            try:
+                stat = os.stat(os.path.join(self.base_dir, path))
+            except OSError:
+                continue
+
+            previous = self.state.get(path)
+
+            if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+                plan['unchanged'].append(path)
+                continue
+
+            if previous and stat.st_size > previous[0]:
+                try:
+                    if file_sha256(os.path.join(self.base_dir, path), previous[0]) == previous[2]:
+                        plan['append'].append((path, priority, stat.st_size, stat.st_mtime_ns, previous[0]))
+                        continue
+                except OSError:
+                    continue
+
+            if stat.st_size <= self.small_file_size:
+                plan['bundle'].append((path, priority, stat.st_size, stat.st_mtime_ns, 0))
+            else:
+                # sent as-is from now on, so later growth cannot be a delta
+                self.state.pop(path, None)
+                plan['raw'].append((path, priority))
+
+        logging.info("Bundling %d file(s), %d append delta(s), %d file(s) sent as-is, %d unchanged",
+                     len(plan['bundle']), len(plan['append']), len(plan['raw']), len(plan['unchanged']))
+
+        return plan
+
+
+    def build(self, plan, staging_root, bundle_dir):
+        """Write the bundles and manifests for *plan*.
+
+        Args:
+            plan: Dict as returned by :meth:`plan`.
+            staging_root: Local directory standing in for the destination
+                base directory.
+            bundle_dir: Directory, relative to *staging_root*, to write the
+                bundles to (normally ``<cruiseID>/.ovdm_bundles``).
+
+        Returns:
+            A list of ``(priority, paths, updates)``, one per bundle in the
+            order the bundles must be sent: *paths* are the bundle and
+            manifest files relative to *staging_root*, *updates* the state
+            to :meth:`commit` once they have been delivered.
+        """
+
+        entries = sorted(plan['append'] + plan['bundle'], key=lambda entry: int(entry[1]))
+        os.makedirs(os.path.join(staging_root, bundle_dir), exist_ok=True)
+
+        bundles = []
+        batch = []
+        batch_bytes = 0
+
+        def _flush():
+            if not batch:
+                return
+            name = f"{time.time_ns():020d}_p{batch[0][1]}"
+            updates = {}
+            files = self._write_bundle(os.path.join(staging_root, bundle_dir, name), batch, updates)
+            if files:
+                bundles.append((batch[0][1], [os.path.join(bundle_dir, filename) for filename in files], updates))
+
+        for entry in entries:
+            if batch and (entry[1] != batch[0][1] or batch_bytes + entry[2] - entry[4] > self.bundle_size):
+                _flush()
+                batch = []
+                batch_bytes = 0
+
+            batch.append(entry)
+            batch_bytes += entry[2] - entry[4]
+
+        _flush()
+
+        return bundles
+
+
+    def _write_bundle(self, stem, entries, updates):
+        """
+        Write one bundle and its manifest, returning their file names.  Each
+        member is copied aside before its header is written, so a file that
+        shrank since it was planned is left out instead of corrupting the
+        bundle.  Nothing is written if the bundle itself cannot be.
+        """
+
+        bundle_path = f'{stem}{_bundle_extension()}'
+        members = []
+        staged = {}
+
+        try:
+            tar, stream, raw = _open_bundle(bundle_path, 'w')
+            try:
+                for path, _, size, mtime_ns, offset in entries:
+                    full_path = os.path.join(self.base_dir, path)
+                    try:
+                        with open(full_path, 'rb') as f:
+                            # hash the whole file as staged: prefix, then the bundled part
+                            digest = hashlib.sha256()
+                            remaining = offset
+                            while remaining > 0:
+                                chunk = f.read(min(_READ_SIZE, remaining))
+                                if not chunk:
+                                    break
+                                digest.update(chunk)
+                                remaining -= len(chunk)
+                            prefix_sha256 = digest.hexdigest() if offset else None
+
+                            spool = None if remaining else _spool_member(f, size - offset, digest, self.small_file_size)
+                    except OSError as exc:
+                        logging.warning("Unable to bundle %s: %s", path, str(exc))
+                        continue
+
+                    if spool is None:
+                        logging.warning("Unable to bundle %s: file shrank since it was listed", path)
+                        continue
+
+                    with spool:
+                        tarinfo = tarfile.TarInfo(f'{path}.delta' if offset else path)
+                        tarinfo.size = size - offset
+                        tarinfo.mtime = mtime_ns // 1_000_000_000
+                        tarinfo.mode = 0o644
+                        tar.addfile(tarinfo, spool)
+
+                    file_sha = digest.hexdigest()
+
+                    members.append({
+                        'path': path,
+                        'type': 'append' if offset else 'file',
+                        'offset': offset,
+                        'size': size,
+                        'mtime': mtime_ns / 1e9,
+                        'prefixSha256': prefix_sha256,
+                        'sha256': file_sha,
+                    })
+                    staged[path] = [size, mtime_ns, file_sha]
+            finally:
+                try:
+                    tar.close()
+                    stream.close()
+                finally:
+                    raw.close()
+        except (OSError, tarfile.TarError) as exc:
+            logging.warning("Unable to write bundle %s: %s", bundle_path, str(exc))
+            members = []
+
+        if not members:
+            if os.path.exists(bundle_path):
+                os.remove(bundle_path)
+            return []
+
+        manifest_path = f'{stem}{MANIFEST_SUFFIX}'
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'bundle': os.path.basename(bundle_path),
+                'sha256': file_sha256(bundle_path),
+                'created': time.time(),
+                'files': members,
+            }, f)
+
+        updates.update(staged)
+
+        return [os.path.basename(bundle_path), os.path.basename(manifest_path)]
+
+
+    def commit(self, updates):
+        """
+        Record the files of a delivered bundle
+        """
+
+        self.state.update(updates)
+        self.save()
+
+
+def _read_manifest(manifest_path):
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _bundle_received(bundle_dir, manifest):
+    """
+    Return whether the bundle of manifest has been completely received
+    """
+
+    bundle_path = os.path.join(bundle_dir, manifest['bundle'])
+    return os.path.isfile(bundle_path) and file_sha256(bundle_path) == manifest['sha256']
+
+
+def _any_bundle_received(bundle_dir, manifest_names):
+    """
+    Return whether the bundle of any of the manifests has been completely
+    received
+    """
+
+    for manifest_name in manifest_names:
+        try:
+            if _bundle_received(bundle_dir, _read_manifest(os.path.join(bundle_dir, manifest_name))):
+                return True
+        except (OSError, ValueError, KeyError):
+            continue
+
+    return False
+
+
+def unpack_bundles(base_dir: str, cruise_id: str) -> dict:
+    """Apply the bundles received for a cruise.
+
+    Bundles in ``<base_dir>/<cruise_id>/.ovdm_bundles`` are applied oldest
+    first.  Whole files are written next to their final location and moved
+    into place once their checksum matches; deltas are only appended to a
+    file whose size and checksum match the manifest, and skipped if already
+    applied.  A bundle is removed once every member listed in its manifest
+    has been applied; a bundle with a failed or missing member is kept (and
+    later bundles are not applied) so the problem can be investigated.
+
+    The ship sends each bundle before its manifest.  A bundle that has not
+    been completely received stops the run, unless a later bundle has been:
+    then the send was interrupted and the ship has bundled the files again,
+    so the incomplete bundle is discarded.  Bundles whose manifest never
+    arrived are removed once a later bundle has been applied.
+
+    Args:
+        base_dir: Destination base directory (the SSDW ``destDir``).
+        cruise_id: Cruise whose bundles to apply.
+
+    Returns:
+        A dict with keys ``'verdict'`` (``bool``), ``'files'`` (paths
+        written) and, on failure, ``'reason'``.
+    """
+
+    bundle_dir = os.path.join(base_dir, cruise_id, BUNDLE_DIR)
+    written = []
+
+    if not os.path.isdir(bundle_dir):
+        return {'verdict': True, 'files': written}
+
+    manifest_names = sorted(name for name in os.listdir(bundle_dir) if name.endswith(MANIFEST_SUFFIX))
+    last_applied = None
+
+    for idx, manifest_name in enumerate(manifest_names):
+        manifest_path = os.path.join(bundle_dir, manifest_name)
+
+        try:
+            manifest = _read_manifest(manifest_path)
+        except (OSError, ValueError) as exc:
+            return {'verdict': False, 'files': written, 'reason': f'Unable to read manifest {manifest_name}: {exc}'}
+
+        bundle_path = os.path.join(bundle_dir, manifest['bundle'])
+        if not _bundle_received(bundle_dir, manifest):
+            if not _any_bundle_received(bundle_dir, manifest_names[idx + 1:]):
+                # not (completely) received yet
+                logging.info("Bundle %s incomplete, stopping", manifest['bundle'])
+                break
+
+            # the ship re-bundled these files after an interrupted send, this bundle will never arrive
+            logging.warning("Bundle %s superseded by a later bundle, discarding it", manifest['bundle'])
+            for path in (bundle_path, manifest_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            continue
+
+        members = {member['path'] + ('.delta' if member['type'] == 'append' else ''): member for member in manifest['files']}
+        applied = set()
+
+        try:
+            tar, stream, raw = _open_bundle(bundle_path, 'r')
+        except (OSError, RuntimeError) as exc:
+            return {'verdict': False, 'files': written, 'reason': f"Unable to open bundle {manifest['bundle']}: {exc}"}
+
+        try:
+            for tarinfo in tar:
+                member = members.get(tarinfo.name)
+                if member is None or not tarinfo.isfile():
+                    continue
+
+                target = os.path.join(base_dir, member['path'])
+                data = tar.extractfile(tarinfo)
+
+                if member['type'] == 'append':
+                    if os.path.isfile(target) and os.path.getsize(target) == member['size'] and file_sha256(target) == member['sha256']:
+                        # applied by an earlier, interrupted run
+                        applied.add(tarinfo.name)
+                        continue
+
+                    if not os.path.isfile(target) or os.path.getsize(target) != member['offset'] or file_sha256(target) != member['prefixSha256']:
+                        return {'verdict': False, 'files': written, 'reason': f"Cannot apply delta to {member['path']}: file differs from the ship's copy"}
+
+                    with open(target, 'ab') as f:
+                        while chunk := data.read(_READ_SIZE):
+                            f.write(chunk)
+
+                    if file_sha256(target) != member['sha256']:
+                        return {'verdict': False, 'files': written, 'reason': f"Checksum mismatch after applying delta to {member['path']}"}
+
+                else:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    tmp_target = f'{target}.ovdm-tmp'
+                    with open(tmp_target, 'wb') as f:
+                        while chunk := data.read(_READ_SIZE):
+                            f.write(chunk)
+
+                    if file_sha256(tmp_target) != member['sha256']:
+                        os.remove(tmp_target)
+                        return {'verdict': False, 'files': written, 'reason': f"Checksum mismatch for {member['path']}"}
+
+                    os.replace(tmp_target, target)
+
+                os.utime(target, (member['mtime'], member['mtime']))
+                written.append(member['path'])
+                applied.add(tarinfo.name)
+        except _BUNDLE_READ_ERRORS as exc:
+            return {'verdict': False, 'files': written, 'reason': f"Unable to read bundle {manifest['bundle']}: {exc}"}
+        finally:
+            tar.close()
+            stream.close()
+            raw.close()
+
+        missing = sorted(set(members) - applied)
+        if missing:
+            return {'verdict': False, 'files': written, 'reason': f"Bundle {manifest['bundle']} is missing {len(missing)} member(s), e.g. {missing[0]}"}
+
+        os.remove(bundle_path)
+        os.remove(manifest_path)
+        last_applied = manifest_name[:-len(MANIFEST_SUFFIX)]
+
+    if last_applied is not None:
+        # bundles whose manifest was never delivered, re-bundled since
+        referenced = {name[:-len(MANIFEST_SUFFIX)] for name in os.listdir(bundle_dir) if name.endswith(MANIFEST_SUFFIX)}
+        for name in os.listdir(bundle_dir):
+            stem = name.split('.', 1)[0]
+            if '.tar.' in name and stem < last_applied and stem not in referenced:
+                logging.warning("Removing bundle %s, its manifest never arrived", name)
+                os.remove(os.path.join(bundle_dir, name))
+
+    return {'verdict': True, 'files': written}
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""Cross-process coordination of transfers that read the data warehouse.
+
+Several full-cruise rsync/rclone transfers reading the same warehouse disks
+at once slow each other down far more than running them a few at a time.
+:class:`TransferCoordinator` hands out a limited number of *reader slots*
+to the transfer workers (all worker processes on the host share the state
+directory):
+
+* at most ``maxReaders`` transfers run at once;
+* at most ``maxPerDestination`` of them send to the same destination host;
+* waiting transfers start in arrival order, skipping over those whose
+  destination is saturated so one busy destination cannot hold up the
+  others;
+* each destination may have a bandwidth budget (KB/s) which is split
+  evenly between the transfers allowed to run to it.
+
+Every waiting or running transfer is represented by a ticket file that its
+process holds an ``flock`` on, so tickets left behind by a crashed worker
+are recognised and discarded by the next process that looks at the queue.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Directory holding the coordinator state shared by all worker processes
+COORDINATOR_DIR = os.path.join(tempfile.gettempdir(), 'openvdm_transfers')
+
+# Default number of transfers allowed to read the warehouse at once
+DEFAULT_MAX_READERS = 2
+
+# Default number of transfers allowed to run to the same destination at once
+DEFAULT_MAX_PER_DESTINATION = 1
+
+# Seconds between checks of the queue while waiting for a slot
+WAIT_POLL_INTERVAL = 2
+
+
+def transfer_destination(cfg: dict) -> str:
+    """Return the destination host of a cruise data transfer configuration.
+
+    Args:
+        cfg: Cruise data transfer configuration dict.
+
+    Returns:
+        The rsync, ssh or SMB server name, the rclone remote name for rclone
+        destinations, or ``'local'``.
+    """
+
+    if ':' in (cfg.get('destDir') or ''):
+        return cfg['destDir'].split(':', 1)[0]
+
+    for key in ('rsyncServer', 'sshServer', 'smbServer'):
+        if cfg.get(key):
+            return cfg[key].lstrip('/').split('/', 1)[0]
+
+    return 'local'
+
+
+def interleave_by_destination(transfers: list) -> list:
+    """Order cruise data transfers round-robin by destination.
+
+    Jobs submitted in this order reach the Gearman queue alternating
+    between destinations, so the workers picking them up do not all start
+    on the same destination.
+
+    Args:
+        transfers: Cruise data transfer configuration dicts.
+
+    Returns:
+        The same transfers, reordered.
+    """
+
+    by_destination = {}
+    for transfer in transfers:
+        by_destination.setdefault(transfer_destination(transfer), []).append(transfer)
+
+    ordered = []
+    queues = list(by_destination.values())
+    while queues:
+        ordered.extend(queue.pop(0) for queue in queues)
+        queues = [queue for queue in queues if queue]
+
+    return ordered
+
+
+class TransferCoordinator():
+    """Reader slots shared by all transfer worker processes on the host.
+
+    Attributes:
+        max_readers: Maximum number of concurrent transfers.
+        max_per_destination: Maximum number of concurrent transfers to the
+            same destination.
+        destination_bandwidth: Dict mapping destination host to its
+            bandwidth budget in KB/s.
+        state_dir: Directory holding the ``waiting`` and ``active`` tickets.
+    """
+
+    def __init__(self, max_readers: int = DEFAULT_MAX_READERS,
+                 max_per_destination: int = DEFAULT_MAX_PER_DESTINATION,
+                 destination_bandwidth: dict = None, state_dir: str = COORDINATOR_DIR):
+        self.max_readers = max(1, int(max_readers))
+        self.max_per_destination = max(1, int(max_per_destination))
+        self.destination_bandwidth = destination_bandwidth or {}
+        self.state_dir = state_dir
+
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """Create a coordinator from the ``transferCoordinator`` settings.
+
+        Args:
+            config: Dict as returned by
+                :meth:`~server.lib.openvdm.OpenVDM.get_transfer_coordinator`.
+
+        Returns:
+            A :class:`TransferCoordinator`, or ``None`` when *config* is
+            empty (coordination disabled).
+        """
+
+        if not config:
+            return None
+
+        return cls(
+            max_readers=config.get('maxReaders', DEFAULT_MAX_READERS),
+            max_per_destination=config.get('maxPerDestination', DEFAULT_MAX_PER_DESTINATION),
+            destination_bandwidth=config.get('destinationBandwidth')
+        )
+
+
+    def bandwidth_limit(self, destination: str) -> int:
+        """Return the bandwidth (KB/s) for one transfer to *destination*, or ``None``.
+
+        The budget is always split ``maxPerDestination`` ways, however many
+        transfers to the destination are running, so that a transfer
+        starting later never pushes the total over the budget.
+        """
+
+        budget = self.destination_bandwidth.get(destination)
+        if not budget:
+            return None
+
+        return max(1, int(budget) // self.max_per_destination)
+
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.join(self.state_dir, 'waiting'), mode=0o700, exist_ok=True)
+        os.makedirs(os.path.join(self.state_dir, 'active'), mode=0o700, exist_ok=True)
+
+        with open(os.path.join(self.state_dir, 'coordinator.lock'), 'a', encoding='utf-8') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def _read_tickets(self, state):
+        """
+        Return the live tickets in the waiting or active directory, oldest
+        first, removing tickets whose process has gone.  Call with the
+        coordinator lock held.
+        """
+
+        tickets = []
+        state_dir = os.path.join(self.state_dir, state)
+
+        for name in sorted(os.listdir(state_dir)):
+            path = os.path.join(state_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as ticket_file:
+                    try:
+                        fcntl.flock(ticket_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        ticket = json.load(ticket_file)
+                        ticket['name'] = name
+                        tickets.append(ticket)
+                        continue
+
+                # nobody holds the ticket, its process is gone
+                logging.debug("Removing stale transfer ticket: %s", name)
+                os.remove(path)
+
+            except (OSError, ValueError):
+                continue
+
+        return tickets
+
+
+    def _try_start(self, name):
+        """
+        Move the waiting ticket to active if it is the oldest waiting ticket
+        that is allowed to start.  Call with the coordinator lock held.
+        """
+
+        active = self._read_tickets('active')
+        if len(active) >= self.max_readers:
+            return False
+
+        per_destination = {}
+        for ticket in active:
+            per_destination[ticket['destination']] = per_destination.get(ticket['destination'], 0) + 1
+
+        for ticket in self._read_tickets('waiting'):
+            if per_destination.get(ticket['destination'], 0) >= self.max_per_destination:
+                continue
+
+            if ticket['name'] != name:
+                return False # an older transfer goes first
+
+            os.rename(os.path.join(self.state_dir, 'waiting', name), os.path.join(self.state_dir, 'active', name))
+            return True
+
+        return False
+
+
+    @contextmanager
+    def reader_slot(self, transfer: str, destination: str, should_stop=None, on_wait=None):
+        """Wait for and hold a reader slot for the duration of a transfer.
+
+        Args:
+            transfer: Transfer name, for logging.
+            destination: Destination host (see :func:`transfer_destination`).
+            should_stop: Optional callable polled while waiting; when it
+                returns ``True`` the wait is abandoned.
+            on_wait: Optional callable run once if the transfer has to wait.
+
+        Yields:
+            ``(acquired, bandwidth_limit)``.  *acquired* is ``False`` if the
+            wait was abandoned through *should_stop*; *bandwidth_limit* is
+            the KB/s allotted to this transfer or ``None`` for no limit.
+        """
+
+        name = f"{time.time_ns():020d}-{os.getpid()}"
+        ticket_file = None
+        acquired = False
+        waited = False
+
+        try:
+            with self._locked():
+                ticket_file = open(os.path.join(self.state_dir, 'waiting', name), 'w', encoding='utf-8') # pylint: disable=consider-using-with
+                fcntl.flock(ticket_file, fcntl.LOCK_EX)
+                json.dump({'transfer': transfer, 'destination': destination, 'pid': os.getpid()}, ticket_file)
+                ticket_file.flush()
+
+            while True:
+                with self._locked():
+                    if self._try_start(name):
+                        acquired = True
+                        break
+
+                if should_stop is not None and should_stop():
+                    logging.info("Stopped while waiting for a transfer slot")
+                    break
+
+                if not waited:
+                    logging.info("Waiting for a transfer slot (%d reader(s), %d per destination)",
+                                 self.max_readers, self.max_per_destination)
+                    if on_wait is not None:
+                        on_wait()
+                    waited = True
+
+                time.sleep(WAIT_POLL_INTERVAL)
+
+            yield acquired, self.bandwidth_limit(destination) if acquired else None
+
+        finally:
+            with self._locked():
+                for state in ('active', 'waiting'):
+                    try:
+                        os.remove(os.path.join(self.state_dir, state, name))
+                        break
+                    except FileNotFoundError:
+                        continue
+
+            if ticket_file is not None:
+                ticket_file.close()
@@ -0,0 +1,49 @@
+"""Tests for the columnar dashboard sidecar."""
+
+import json
+import os
+
+from server.lib.dashboard_arrays import sidecar_path, write_dashboard_arrays
+from server.lib.geojson_utils import iter_track_segments
+
+
+def _track(coords, times):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'LineString', 'coordinates': coords},
+        'properties': {'coordTimes': times},
+    }
+
+
+def _dashboard(*features):
+    return {'gga': {'visualizerData': [{'type': 'FeatureCollection', 'features': list(features)}]}}
+
+
+def _write(tmp_path, contents):
+    json_path = str(tmp_path / 'track.json')
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(contents, f)
+    return json_path, write_dashboard_arrays(sidecar_path(json_path), contents)
+
+
+def test_sidecar_matches_json(tmp_path):
+    contents = _dashboard(_track([[1.0, 2.0], [3.0, 4.0]], ['t1', 't2']))
+    json_path, result = _write(tmp_path, contents)
+
+    assert result['verdict']
+    assert os.path.isfile(sidecar_path(json_path))
+    assert list(iter_track_segments([json_path])) == [([[1.0, 2.0], [3.0, 4.0]], ['t1', 't2'])]
+
+
+def test_no_sidecar_for_irregular_tracks(tmp_path):
+    regular = _track([[1.0, 2.0], [3.0, 4.0]], ['t1', 't2'])
+    json_path, _ = _write(tmp_path, _dashboard(regular))
+    assert os.path.isfile(sidecar_path(json_path))
+
+    # mixed 2-D and 3-D coordinates: the stale sidecar must not hide them
+    irregular = _track([[1.0, 2.0], [3.0, 4.0, 5.0]], ['t1', 't2'])
+    json_path, result = _write(tmp_path, _dashboard(regular, irregular))
+
+    assert result['verdict']
+    assert not os.path.exists(sidecar_path(json_path))
+    assert len(list(iter_track_segments([json_path]))) == 2
@@ -0,0 +1,11 @@
+"""Tests for server.lib.file_utils helpers."""
+
+from server.lib.file_utils import with_parent_dirs
+
+
+def test_with_parent_dirs():
+    paths = ['a/b/c.txt', '/base/d.txt', '/elsewhere/e.txt']
+
+    assert with_parent_dirs(paths, '/base') == ['a', 'a/b', 'a/b/c.txt', 'd.txt']
+    assert with_parent_dirs(paths, '/base', include_base=True) == ['.', 'a', 'a/b', 'a/b/c.txt', 'd.txt']
+    assert with_parent_dirs([], '/base', include_base=True) == []
@@ -0,0 +1,148 @@
+"""Tests for ship-to-shore bundles: staging on the ship, unpacking ashore."""
+
+import json
+import os
+
+import pytest
+
+from server.lib import s2s_bundles
+from server.lib.s2s_bundles import BUNDLE_DIR, MANIFEST_SUFFIX, BundleStage, unpack_bundles
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(s2s_bundles, 'STAGE_STATE_DIR', str(tmp_path / 'state'))
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    ship, shore = tmp_path / 'ship', tmp_path / 'shore'
+    (ship / 'C' / 'data').mkdir(parents=True)
+    shore.mkdir()
+    return str(ship), str(shore)
+
+
+def _write(base_dir, path, data, mode='wb'):
+    with open(os.path.join(base_dir, path), mode) as f:
+        f.write(data)
+
+
+def _read(base_dir, path):
+    with open(os.path.join(base_dir, path), 'rb') as f:
+        return f.read()
+
+
+def _send(stage, paths, shore):
+    """Plan, build and deliver (into shore) the bundles for paths."""
+
+    plan = stage.plan(paths, ['1'] * len(paths))
+    bundles = stage.build(plan, shore, os.path.join('C', BUNDLE_DIR))
+    for _, _, updates in bundles:
+        stage.commit(updates)
+    return plan, bundles
+
+
+def test_round_trip_files_and_append_delta(dirs):
+    ship, shore = dirs
+    _write(ship, 'C/data/small.txt', b'small file\n')
+    _write(ship, 'C/data/log.txt', b'line 1\n')
+
+    stage = BundleStage('SSDW', ship)
+    stage.load()
+    _send(stage, ['C/data/small.txt', 'C/data/log.txt'], shore)
+
+    results = unpack_bundles(shore, 'C')
+    assert results['verdict']
+    assert sorted(results['files']) == ['C/data/log.txt', 'C/data/small.txt']
+    assert os.listdir(os.path.join(shore, 'C', BUNDLE_DIR)) == []
+
+    _write(ship, 'C/data/log.txt', b'line 2\n', mode='ab')
+    plan, _ = _send(stage, ['C/data/small.txt', 'C/data/log.txt'], shore)
+    assert plan['unchanged'] == ['C/data/small.txt']
+    assert [entry[0] for entry in plan['append']] == ['C/data/log.txt']
+
+    assert unpack_bundles(shore, 'C') == {'verdict': True, 'files': ['C/data/log.txt']}
+    assert _read(shore, 'C/data/log.txt') == b'line 1\nline 2\n'
+
+
+def test_file_shrinking_before_build_is_not_lost(dirs):
+    ship, shore = dirs
+    _write(ship, 'C/data/a.txt', b'a' * 100)
+    _write(ship, 'C/data/b.txt', b'b' * 100)
+
+    stage = BundleStage('SSDW', ship)
+    plan = stage.plan(['C/data/a.txt', 'C/data/b.txt'], ['1', '1'])
+    _write(ship, 'C/data/a.txt', b'a')
+    for _, _, updates in stage.build(plan, shore, os.path.join('C', BUNDLE_DIR)):
+        stage.commit(updates)
+
+    assert 'C/data/a.txt' not in stage.state
+    assert unpack_bundles(shore, 'C') == {'verdict': True, 'files': ['C/data/b.txt']}
+
+    # staged again on the next run
+    _send(stage, ['C/data/a.txt', 'C/data/b.txt'], shore)
+    assert unpack_bundles(shore, 'C') == {'verdict': True, 'files': ['C/data/a.txt']}
+    assert _read(shore, 'C/data/a.txt') == b'a'
+
+
+def test_bundle_missing_a_member_is_kept(dirs):
+    ship, shore = dirs
+    _write(ship, 'C/data/a.txt', b'a' * 100)
+
+    stage = BundleStage('SSDW', ship)
+    _, bundles = _send(stage, ['C/data/a.txt'], shore)
+
+    manifest_path = os.path.join(shore, next(path for path in bundles[0][1] if path.endswith(MANIFEST_SUFFIX)))
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['files'].append(dict(manifest['files'][0], path='C/data/gone.txt'))
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    results = unpack_bundles(shore, 'C')
+    assert not results['verdict']
+    assert 'missing' in results['reason']
+    assert sorted(os.listdir(os.path.join(shore, 'C', BUNDLE_DIR))) == sorted(os.path.basename(path) for path in bundles[0][1])
+
+
+def test_incomplete_bundle_is_left_for_the_next_run(dirs):
+    ship, shore = dirs
+    _write(ship, 'C/data/a.txt', b'a' * 100)
+
+    stage = BundleStage('SSDW', ship)
+    _, bundles = _send(stage, ['C/data/a.txt'], shore)
+
+    bundle_path = os.path.join(shore, next(path for path in bundles[0][1] if not path.endswith(MANIFEST_SUFFIX)))
+    with open(bundle_path, 'r+b') as f:
+        f.truncate(10)
+
+    assert unpack_bundles(shore, 'C') == {'verdict': True, 'files': []}
+    assert os.path.exists(bundle_path)
+
+
+def test_interrupted_send_is_superseded_by_the_next_bundle(dirs):
+    ship, shore = dirs
+    _write(ship, 'C/data/a.txt', b'a' * 100)
+    _write(ship, 'C/data/b.txt', b'b' * 100)
+
+    # the first send is interrupted after the manifest (or only the bundle) arrived
+    stage = BundleStage('SSDW', ship)
+    plan = stage.plan(['C/data/a.txt'], ['1'])
+    first = stage.build(plan, shore, os.path.join('C', BUNDLE_DIR))[0][1]
+    os.remove(os.path.join(shore, first[0]))
+
+    plan = stage.plan(['C/data/b.txt'], ['1'])
+    second = stage.build(plan, shore, os.path.join('C', BUNDLE_DIR))[0][1]
+    os.remove(os.path.join(shore, second[1]))
+
+    # nothing complete yet: wait
+    assert unpack_bundles(shore, 'C') == {'verdict': True, 'files': []}
+    assert os.path.exists(os.path.join(shore, first[1]))
+
+    # the next run bundles both files again
+    _send(stage, ['C/data/a.txt', 'C/data/b.txt'], shore)
+
+    results = unpack_bundles(shore, 'C')
+    assert results['verdict']
+    assert sorted(results['files']) == ['C/data/a.txt', 'C/data/b.txt']
+    assert os.listdir(os.path.join(shore, 'C', BUNDLE_DIR)) == []
@@ -0,0 +1,189 @@
+"""Tests for the ship-to-shore queue and delivery journal."""
+
+import os
+import time
+
+import pytest
+
+from server.workers import run_ship_to_shore_transfer as s2st
+from server.workers.run_ship_to_shore_transfer import DeliveryJournal, OVDMGearmanWorker, ShipToShoreQueue
+
+
+@pytest.fixture(autouse=True)
+def state_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(s2st, 'SSDW_QUEUE_DIR', str(tmp_path / 'queue'))
+    monkeypatch.setattr(s2st, 'SSDW_DELIVERED_DIR', str(tmp_path / 'delivered'))
+
+
+def _write(base_dir, path, size, mtime=None):
+    full_path = os.path.join(base_dir, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'wb') as f:
+        f.write(b'x' * size)
+    if mtime is not None:
+        os.utime(full_path, (mtime, mtime))
+
+
+def _worker(base_dir, results):
+    worker = OVDMGearmanWorker.__new__(OVDMGearmanWorker)
+    worker.stop = False
+    worker.cruise_id = 'C'
+    worker.cruise_data_transfer = {'name': 'SSDW', 'destDir': '/ssdw', 'bandwidthLimit': '0'}
+    worker.shipboard_data_warehouse_config = {'shipboardDataWarehouseBaseDir': str(base_dir)}
+    worker.run_transfer_command = lambda *args, **kwargs: results.pop(0)
+    return worker
+
+
+def test_journal_outstanding_and_record(tmp_path):
+    _write(tmp_path, 'C/a', 10)
+    _write(tmp_path, 'C/b', 10)
+
+    journal = DeliveryJournal('SSDW', 'host:/ssdw')
+    paths, priorities = journal.outstanding(str(tmp_path), ['C/a', 'C/b'], ['1', '2'])
+    assert paths == ['C/a', 'C/b'] and priorities == ['1', '2']
+
+    journal.record(['C/a'])
+    journal.save()
+
+    journal = DeliveryJournal('SSDW', 'host:/ssdw')
+    journal.load()
+    assert journal.outstanding(str(tmp_path), ['C/a', 'C/b'], ['1', '2']) == (['C/b'], ['2'])
+
+    _write(tmp_path, 'C/a', 20)
+    assert journal.outstanding(str(tmp_path), ['C/a', 'C/b'], ['1', '2']) == (['C/a', 'C/b'], ['1', '2'])
+
+
+def test_journal_discarded_for_new_destination_or_age(tmp_path):
+    _write(tmp_path, 'C/a', 10)
+
+    journal = DeliveryJournal('SSDW', 'host:/ssdw')
+    journal.outstanding(str(tmp_path), ['C/a'], ['1'])
+    journal.record(['C/a'])
+    journal.save()
+
+    moved = DeliveryJournal('SSDW', 'other:/ssdw')
+    moved.load()
+    assert moved.entries == {}
+
+    expired = DeliveryJournal('SSDW', 'host:/ssdw', max_age=60)
+    journal.created = time.time() - 120
+    journal.save()
+    expired.load()
+    assert expired.entries == {}
+
+
+def test_queue_next_chunk_by_priority_and_budget(tmp_path):
+    now = time.time()
+    _write(tmp_path, 'C/old', 100, now - 10)
+    _write(tmp_path, 'C/new', 100, now)
+    _write(tmp_path, 'C/low', 100, now)
+
+    queue = ShipToShoreQueue('SSDW', budgets={'1': 150 / 1024 / 1024}, persistent=False)
+    assert queue.update(str(tmp_path), ['C/old', 'C/new', 'C/low'], ['1', '1', '3']) == 3
+
+    # newest first, limited by what is left of the budget
+    priority, chunk = queue.next_chunk(max_bytes=1000, max_files=10)
+    assert (priority, chunk) == ('1', ['C/new'])
+    queue.complete(priority, chunk, 100)
+
+    # priority 1 is over budget for this cycle
+    assert queue.next_chunk(max_bytes=1000, max_files=10) == ('3', ['C/low'])
+
+
+def test_queue_update_skips_files_already_sent(tmp_path):
+    _write(tmp_path, 'C/a', 10)
+    _write(tmp_path, 'C/b', 10)
+
+    queue = ShipToShoreQueue('SSDW', persistent=False)
+    queue.update(str(tmp_path), ['C/a', 'C/b'], ['1', '1'], replace=True)
+    priority, chunk = queue.next_chunk(max_bytes=1000, max_files=10)
+    queue.complete(priority, chunk, 20)
+
+    assert queue.update(str(tmp_path), ['C/a', 'C/b'], ['1', '1']) == 0
+
+    _write(tmp_path, 'C/a', 30)
+    assert queue.update(str(tmp_path), ['C/a', 'C/b'], ['1', '1']) == 1
+    assert list(queue.pending) == ['C/a']
+
+
+def test_queue_save_and_load(tmp_path):
+    _write(tmp_path, 'C/a', 10)
+
+    queue = ShipToShoreQueue('SSDW', budgets={'1': 1})
+    queue.update(str(tmp_path), ['C/a'], ['1'])
+    queue.sent = {'1': 5}
+    queue.save()
+
+    restored = ShipToShoreQueue('SSDW', budgets={'1': 1})
+    restored.load()
+    assert restored.pending == queue.pending
+    assert restored.sent == {'1': 5}
+
+
+def test_send_queue_completes_and_journals_delivered_chunks(tmp_path):
+    _write(tmp_path, 'C/a', 10)
+
+    journal = DeliveryJournal('SSDW', 'host:/ssdw')
+    paths, priorities = journal.outstanding(str(tmp_path), ['C/a'], ['1'])
+    queue = ShipToShoreQueue('SSDW', persistent=False)
+    queue.update(str(tmp_path), paths, priorities, replace=True)
+
+    worker = _worker(tmp_path, [(['C/a'], [], [], 10, True)])
+    new_files, _, _ = worker.send_queue(None, queue, str(tmp_path), lambda include_file, cfg: ['true'], journal=journal)
+
+    assert new_files == ['C/a']
+    assert queue.pending == {}
+    assert queue.sent == {'1': 10}
+    assert 'C/a' in journal.entries
+
+
+def test_send_queue_leaves_failed_chunk_queued(tmp_path):
+    _write(tmp_path, 'C/a', 10)
+
+    journal = DeliveryJournal('SSDW', 'host:/ssdw')
+    paths, priorities = journal.outstanding(str(tmp_path), ['C/a'], ['1'])
+    queue = ShipToShoreQueue('SSDW', persistent=False)
+    queue.update(str(tmp_path), paths, priorities, replace=True)
+
+    worker = _worker(tmp_path, [([], [], [], 0, False)])
+    worker.send_queue(None, queue, str(tmp_path), lambda include_file, cfg: ['false'], journal=journal)
+
+    assert list(queue.pending) == ['C/a']
+    assert queue.sent == {}
+    assert journal.entries == {}
+    assert not os.path.exists(os.path.join(s2st.SSDW_DELIVERED_DIR, 'SSDW.json'))
+
+
+def test_send_queue_interrupts_lower_priority_chunk_for_new_priority_one_files(tmp_path):
+    _write(tmp_path, 'C/large', 1000)
+
+    queue = ShipToShoreQueue('SSDW', persistent=False)
+    queue.update(str(tmp_path), ['C/large'], ['2'], replace=True)
+
+    sent = []
+
+    def _run_transfer_command(current_job, cmd, file_count, should_stop=None, **kwargs):
+        with open(cmd[0], 'r', encoding='utf-8') as f:
+            chunk = f.read().rstrip('\0').split('\n')
+        sent.append(chunk)
+
+        if chunk == ['C/large'] and len(sent) == 1:
+            # a priority-1 file arrives while the large file is on its way
+            _write(tmp_path, 'C/urgent', 10)
+            assert should_stop()
+            return [], [], [], 400, False
+
+        return chunk, [], [], 10, True
+
+    worker = _worker(tmp_path, [])
+    worker.run_transfer_command = _run_transfer_command
+    worker.build_filelist = lambda priorities=None: {
+        'verdict': True,
+        'files': {'include': ['urgent'] if os.path.exists(tmp_path / 'C' / 'urgent') else [], 'priority': ['1']},
+    }
+
+    worker.send_queue(None, queue, str(tmp_path), lambda include_file, cfg: [include_file], queue_cfg={'preemptCheck': 0})
+
+    assert sent == [['C/large'], ['C/urgent'], ['C/large']]
+    assert queue.pending == {}
+    assert queue.sent == {'1': 10, '2': 410}
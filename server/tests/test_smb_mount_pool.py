@@ -0,0 +1,57 @@
+"""Tests for the SMB mount pool, with mounting replaced by directories."""
+
+import os
+
+import pytest
+
+from server.lib import connection_utils
+from server.lib.connection_utils import SMBMountPool
+
+CFG = {'smbServer': '//server/share', 'smbDomain': 'WORKGROUP', 'smbUser': 'survey', 'smbPass': 'secret', 'removeSourceFiles': '0'}
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    mounted = set()
+    unmounted = []
+
+    def _unmount(mntpoint):
+        mounted.discard(mntpoint)
+        unmounted.append(mntpoint)
+        os.rmdir(mntpoint)
+
+    monkeypatch.setattr(connection_utils, 'detect_smb_version', lambda cfg: ('3.0', ''))
+    monkeypatch.setattr(connection_utils, 'mount_smb_share', lambda cfg, mntpoint, version: (mounted.add(mntpoint), (True, ''))[1])
+    monkeypatch.setattr(SMBMountPool, '_is_healthy', staticmethod(lambda mntpoint: mntpoint in mounted))
+    monkeypatch.setattr(SMBMountPool, '_unmount', staticmethod(_unmount))
+
+    smb_pool = SMBMountPool()
+    smb_pool.mounted, smb_pool.unmounted = mounted, unmounted
+    yield smb_pool
+    smb_pool.close()
+
+
+def test_mount_is_shared(pool):
+    first, _, _ = pool.acquire(CFG)
+    second, _, _ = pool.acquire(CFG)
+
+    assert first == second
+    pool.release(first)
+    pool.release(second)
+    assert pool.unmounted == []
+
+
+def test_unhealthy_mount_in_use_is_unmounted_on_release(pool):
+    old, _, _ = pool.acquire(CFG)
+    pool.mounted.discard(old)
+
+    new, _, _ = pool.acquire(CFG)
+    assert new != old
+    assert pool.unmounted == []
+
+    pool.release(old)
+    assert pool.unmounted == [old]
+    assert pool.retired == []
+
+    pool.release(new)
+    assert pool.unmounted == [old]
@@ -37,6 +37,7 @@ from server.workers.data_dashboard import TASK_NAMES as DATA_DASHBOARD_TASK_NAME
 from server.workers.md5_summary import TASK_NAMES as MD5_TASK_NAMES
 
 from server.lib.openvdm import OpenVDM
+from server.lib.transfer_coordinator import interleave_by_destination
 
 TASK_NAMES = {
     'CREATE_CRUISE': 'setupNewCruise',
@@ -692,7 +693,7 @@ def task_finalize_current_cruise(worker, current_job): # pylint: disable=too-man
     }
 
     cruise_data_transfer_jobs = []
-    cruise_data_transfers = worker.ovdm.get_active_cruise_data_transfers()
+    cruise_data_transfers = interleave_by_destination(worker.ovdm.get_active_cruise_data_transfers())
 
     for cruise_data_transfer in cruise_data_transfers:
         logging.debug("Queuing %s job for %s", CDT_TASK_NAMES['RUN_CRUISE_DATA_TRANSFER'], cruise_data_transfer['name'])
@@ -23,7 +23,7 @@ import python3_gearman
 
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
 
-from server.lib.file_utils import create_directories, lockdown_directory, set_owner_group_permissions
+from server.lib.file_utils import PERMISSION_WORKERS, create_directories, lockdown_directory, set_owner_group_permissions
 from server.lib.openvdm import OpenVDM
 
 TASK_NAMES = {
@@ -345,7 +345,7 @@ def task_create_cruise_directory(worker, current_job):
     logging.info("Setting ownership/permissions for cruise directory")
     worker.send_job_status(current_job, 8, 10)
 
-    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.cruise_dir)
+    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.cruise_dir, max_workers=PERMISSION_WORKERS)
 
     if not output_results['verdict']:
         job_results['parts'].append({"partName": "Set cruise directory ownership/permissions", "result": "Fail", "reason": output_results['reason']})
@@ -389,7 +389,7 @@ def task_set_cruisedata_directory_permissions(worker, current_job):
         job_results['parts'].append({"partName": "Set directory permissions for current cruise", "result": "Fail", "reason": reason})
         return json.dumps(job_results)
 
-    set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.cruise_dir)
+    set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.cruise_dir, max_workers=PERMISSION_WORKERS)
     job_results['parts'].append({"partName": "Set Directory permissions for current cruise", "result": "Pass"})
 
     worker.send_job_status(current_job, 10, 10)
@@ -448,7 +448,7 @@ def task_rebuild_cruise_directory(worker, current_job):
     logging.info("Set directory ownership/permissions")
     worker.send_job_status(current_job, 7, 10)
 
-    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.cruise_dir)
+    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.cruise_dir, max_workers=PERMISSION_WORKERS)
 
     if not output_results['verdict']:
         job_results['parts'].append({"partName": "Set directory ownership/permissions", "result": "Fail", "reason": output_results['reason']})
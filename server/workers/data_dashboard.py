@@ -22,14 +22,17 @@ import logging
 import os
 import signal
 import sys
+import time
 
 import python3_gearman
 
 from os.path import dirname, realpath
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
 
-from server.lib.file_utils import build_filelist, output_json_data_to_file, set_owner_group_permissions
+from server.lib.dashboard_arrays import sidecar_path, write_dashboard_arrays
+from server.lib.file_utils import build_filelist, output_json_data_to_file, set_owner_group_permissions, with_parent_dirs
 from server.lib.openvdm import OpenVDM
+from server.lib.openvdm_plugin import set_profiling
 
 # PYTHON_BINARY = os.path.join(dirname(dirname(dirname(realpath(__file__)))), 'venv/bin/python')
 
@@ -73,6 +76,8 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker): # pylint: disable=too-ma
         self.data_dashboard_dir = None
         self.data_dashboard_manifest_file_path = None
         self.collection_system_transfer = None
+        self.profile = False
+        self.write_sidecar = False
 
         super().__init__(host_list=[self.ovdm.get_gearman_server()])
 
@@ -144,7 +149,9 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker): # pylint: disable=too-ma
 
             try:
                 logging.info("Processing file: %s", filename)
+                plugin_start = time.perf_counter()
                 out_obj = plugin_callable(raw_path)
+                plugin_elapsed = time.perf_counter() - plugin_start
             except Exception as exc:
                 logging.error("Error processing file %s: %s", filename, str(exc))
                 job_results['parts'].append({"partName": f"Processing file: {filename}", "result": "Fail", "reason": str(exc)})
@@ -157,7 +164,25 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker): # pylint: disable=too-ma
                 self._remove_manifest_entry(remove_manifest_entries, json_path, raw_path, base_dir)
                 continue
 
+            # Phase timings are reported with the job results, not written to
+            # the dashboard file
+            parser_timings = {
+                dtype: data.pop('profile') for dtype, data in out_obj.items()
+                if isinstance(data, dict) and 'profile' in data
+            }
+
+            write_start = time.perf_counter()
             result = output_json_data_to_file(json_path, out_obj)
+            write_elapsed = time.perf_counter() - write_start
+
+            if self.profile:
+                job_results.setdefault('profile', []).append({
+                    "file": filename,
+                    "plugin": round(plugin_elapsed, 6),
+                    "write": round(write_elapsed, 6),
+                    "parsers": parser_timings
+                })
+
             if result['verdict']:
                 job_results['parts'].append({"partName": f"Write dashboard file: {filename}", "result": "Pass"})
             else:
@@ -166,6 +191,11 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker): # pylint: disable=too-ma
                 job_results['parts'].append({"partName": f"Write dashboard file: {filename}", "result": "Fail", "reason": result['reason']})
                 continue
 
+            if self.write_sidecar:
+                result = write_dashboard_arrays(sidecar_path(json_path), out_obj)
+                if not result['verdict']:
+                    job_results['parts'].append({"partName": f"Write dashboard array file: {filename}", "result": "Fail", "reason": result['reason']})
+
             data_types = list(out_obj.keys()) or ['unknown']
             for dtype in data_types:
                 self._add_manifest_entry(new_manifest_entries, dtype, json_path, raw_path, base_dir)
@@ -198,6 +228,10 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker): # pylint: disable=too-ma
         logging.info("Job Started: %s", current_job.handle)
 
         self.shipboard_data_warehouse_config = self.ovdm.get_shipboard_data_warehouse_config()
+        self.profile = self.ovdm.get_profile_parsers()
+        set_profiling(self.profile)
+        self.write_sidecar = self.ovdm.get_dashboard_array_sidecar()
+
         self.cruise_id = payload_obj.get('cruiseID', self.ovdm.get_cruise_id())
         self.cruise_dir = os.path.join(self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir'], self.cruise_id)
         self.lowering_id = payload_obj.get('loweringID', self.ovdm.get_lowering_id())
@@ -353,6 +387,8 @@ def task_update_data_dashboard(worker, current_job):
             dd_json_path = os.path.join(base_dir, rm['dd_json'])
             if os.path.isfile(dd_json_path):
                 os.remove(dd_json_path)
+            if os.path.isfile(sidecar_path(dd_json_path)):
+                os.remove(sidecar_path(dd_json_path))
 
     # Update/add new entries
     for entry in new_entries:
@@ -369,8 +405,16 @@ def task_update_data_dashboard(worker, current_job):
         return json.dumps(job_results)
     job_results['parts'].append({"partName": "Writing dashboard manifest file", "result": "Pass"})
 
-    # Set permissions
-    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.data_dashboard_dir)
+    # Set permissions on the files written, and the directories created for them
+    changed = {worker.data_dashboard_manifest_file_path}
+    for entry in new_entries:
+        dd_json_path = os.path.join(base_dir, entry['dd_json'])
+        changed.add(dd_json_path)
+        if worker.write_sidecar and os.path.isfile(sidecar_path(dd_json_path)):
+            changed.add(sidecar_path(dd_json_path))
+
+    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.data_dashboard_dir,
+                                                 files=with_parent_dirs(list(changed), worker.data_dashboard_dir, include_base=True))
     part_result = {"partName": "Set file/directory ownership", "result": "Pass" if output_results['verdict'] else "Fail"}
     if not output_results['verdict']:
         part_result['reason'] = output_results['reason']
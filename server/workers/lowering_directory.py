@@ -23,7 +23,7 @@ import python3_gearman
 
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
 
-from server.lib.file_utils import create_directories, set_owner_group_permissions
+from server.lib.file_utils import PERMISSION_WORKERS, create_directories, set_owner_group_permissions
 from server.lib.openvdm import OpenVDM
 
 TASK_NAMES = {
@@ -311,7 +311,7 @@ def task_create_lowering_directory(worker, current_job):
     logging.debug("Setting lowering directory ownership/permissions")
     worker.send_job_status(current_job, 8, 10)
 
-    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.lowering_full_dir)
+    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.lowering_full_dir, max_workers=PERMISSION_WORKERS)
 
     if not output_results['verdict']:
         job_results['parts'].append({"partName": "Set cruise directory ownership/permissions", "result": "Fail", "reason": output_results['reason']})
@@ -398,7 +398,7 @@ def task_rebuild_lowering_directory(worker, current_job):
     logging.info("Setting directory ownership/permissions")
     worker.send_job_status(current_job, 7, 10)
 
-    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.lowering_full_dir)
+    output_results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.lowering_full_dir, max_workers=PERMISSION_WORKERS)
 
     if not output_results['verdict']:
         logging.error("Failed to set directory ownership")
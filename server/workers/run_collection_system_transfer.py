@@ -8,9 +8,17 @@ OpenVDM database.
 
 Key responsibilities:
 
-- Mount SMB shares and unmount them on completion.
+- Mount SMB shares through the shared SMB mount pool, so the source test
+  and the transfer (and later jobs) reuse one mount.
 - Apply per-transfer include/exclude filename filters and date-range filters.
 - Handle wildcard source directories.
+- Optionally split large transfers across several concurrent rsync streams
+  (``rsyncStreams`` in ``openvdm.yaml``).
+- Optionally order transfers (newest-first, smallest-first, round-robin by
+  subdirectory) and move large files into their own rsync runs
+  (``transferOrdering`` in ``openvdm.yaml``).
+- Use the ``changedFiles`` list supplied by the transfer watcher, when present,
+  instead of walking local/SMB source directories.
 - Submit a ``updateDataDashboard`` job after a successful transfer.
 - Log transferred file counts and sizes.
 """
@@ -19,26 +27,37 @@ import argparse
 import calendar
 import fnmatch
 import glob as glob_module
+import heapq
+import itertools
 import json
 import logging
 import os
-import re
 import sys
 import signal
 import subprocess
+import tempfile
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 from datetime import datetime, timedelta, timezone
 from os.path import dirname, realpath
 from random import randint
 import python3_gearman
 
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
-from server.lib.file_utils import build_include_file, is_ascii, is_default_ignore, delete_from_dest, output_json_data_to_file, set_owner_group_permissions, temporary_directory
-from server.lib.connection_utils import build_rsync_command, build_rsync_options, check_darwin, detect_smb_version, get_transfer_type, has_wildcard, mount_smb_share, test_cst_source
+from server.lib.file_utils import build_include_file, is_ascii, is_default_ignore, delete_from_dest, output_json_data_to_file, set_owner_group_permissions, temporary_directory, with_parent_dirs
+from server.lib.connection_utils import CST_TEST_CACHE_TTL, SMB_MOUNT_POOL, build_rsync_command, build_rsync_options, build_rsync_ssh_args, check_darwin, get_transfer_type, has_wildcard, invalidate_cst_source_test, run_rsync, test_cst_source
 from server.lib.openvdm import OpenVDM
 
-TO_CHK_RE = re.compile(r'to-chk=(\d+)/(\d+)')
+# Ways of splitting an include list across parallel rsync streams
+SHARD_MODES = ('size', 'subdir')
+
+# Transfer ordering policies (see order_filelist)
+ORDER_POLICIES = ('newest', 'smallest', 'subdir')
+
+# Default number of files per rsync run when a transfer is ordered
+DEFAULT_ORDERED_BATCH_SIZE = 500
 
 TASK_NAMES = {
     'RUN_COLLECTION_SYSTEM_TRANSFER': 'runCollectionSystemTransfer'
@@ -61,8 +80,9 @@ def process_batch(batch: list, filters: dict, data_start_time: float, data_end_t
             (inclusive).
 
     Returns:
-        List of ``(action, filepath, size_str)`` tuples where *action* is
-        ``"include"`` or ``"exclude"``.  Files that are skipped entirely
+        List of ``(action, filepath, size_str, mtime)`` tuples where *action*
+        is ``"include"`` or ``"exclude"`` (``size_str`` and ``mtime`` are
+        ``None`` for excluded files).  Files that are skipped entirely
         (symlinks, default-ignored, out-of-range) are omitted from the result.
     """
 
@@ -87,18 +107,18 @@ def process_batch(batch: list, filters: dict, data_start_time: float, data_end_t
                 return None
 
             if not is_ascii(filepath):
-                return ("exclude", filepath, None)
+                return ("exclude", filepath, None, None)
 
             if any(fnmatch.fnmatch(filepath, p) for p in filters['ignore_filters']):
                 return None
 
             if any(fnmatch.fnmatch(filepath, p) for p in filters['include_filters']):
                 if any(fnmatch.fnmatch(filepath, p) for p in filters['exclude_filters']):
-                    return ("exclude", filepath, None)
+                    return ("exclude", filepath, None, None)
 
-                return ("include", filepath, str(size))
+                return ("include", filepath, str(size), mod_time)
 
-            return ("exclude", filepath, None)
+            return ("exclude", filepath, None, None)
 
         except FileNotFoundError:
             return None
@@ -147,18 +167,18 @@ def process_rsync_batch(batch, filters, data_start_time, data_end_time, epoch):
             return None
 
         if not is_ascii(filepath):
-            return ('exclude', filepath, None)
+            return ('exclude', filepath, None, None)
 
         if any(fnmatch.fnmatch(filepath, p) for p in filters['ignore_filters']):
             return None
 
         if any(fnmatch.fnmatch(filepath, p) for p in filters['include_filters']):
             if any(fnmatch.fnmatch(filepath, p) for p in filters['exclude_filters']):
-                return ('exclude', filepath, None)
+                return ('exclude', filepath, None, None)
 
-            return ('include', filepath, size)
+            return ('include', filepath, size, file_mod_time_seconds)
 
-        return ('exclude', filepath, None)
+        return ('exclude', filepath, None, None)
 
 
     results = []
@@ -169,13 +189,140 @@ def process_rsync_batch(batch, filters, data_start_time, data_end_time, epoch):
     return results
 
 
+def _size_to_int(size) -> int:
+    """Convert a file size from os.stat or rsync output (``1,234``) to int."""
+
+    try:
+        return int(str(size).replace(',', ''))
+    except (TypeError, ValueError):
+        return 0
+
+
+def shard_filelist(files: list, sizes: list, streams: int, shard_by: str = 'size') -> list:
+    """Split an include list into at most *streams* byte-balanced shards.
+
+    Uses greedy longest-processing-time assignment: the heaviest remaining
+    item goes to the currently lightest shard.
+
+    Args:
+        files: Relative file paths.
+        sizes: File sizes aligned with *files* (ints or rsync size strings).
+        streams: Maximum number of shards.
+        shard_by: ``'size'`` balances individual files; ``'subdir'`` keeps
+            each top-level subdirectory together in one shard.
+
+    Returns:
+        A list of non-empty lists of file paths.
+    """
+
+    if streams <= 1 or len(files) <= 1:
+        return [list(files)]
+
+    if shard_by == 'subdir':
+        groups = {}
+        for filepath, size in zip(files, sizes):
+            top = filepath.split('/', 1)[0] if '/' in filepath else ''
+            group = groups.setdefault(top, [0, []])
+            group[0] += _size_to_int(size)
+            group[1].append(filepath)
+        items = [tuple(group) for group in groups.values()]
+    else:
+        items = [(_size_to_int(size), [filepath]) for filepath, size in zip(files, sizes)]
+
+    shards = [[] for _ in range(streams)]
+    loads = [(0, idx) for idx in range(streams)]
+
+    for weight, paths in sorted(items, key=lambda item: item[0], reverse=True):
+        load, idx = heapq.heappop(loads)
+        shards[idx].extend(paths)
+        heapq.heappush(loads, (load + weight, idx))
+
+    return [shard for shard in shards if shard]
+
+
+def order_filelist(files: list, sizes: list, mtimes: list, policy: str = None) -> list:
+    """Order an include list according to a transfer ordering policy.
+
+    Args:
+        files: Relative file paths.
+        sizes: File sizes aligned with *files*.
+        mtimes: Modification times (Unix epoch) aligned with *files*.
+        policy: ``'newest'`` (most recently modified first), ``'smallest'``
+            (smallest first), ``'subdir'`` (round-robin across top-level
+            subdirectories, each in path order) or ``None`` to keep the
+            existing order.
+
+    Returns:
+        A list of ``(filepath, size, mtime)`` tuples.
+    """
+
+    entries = list(zip(files, sizes, mtimes))
+
+    if policy == 'newest':
+        entries.sort(key=lambda entry: entry[2] or 0, reverse=True)
+    elif policy == 'smallest':
+        entries.sort(key=lambda entry: _size_to_int(entry[1]))
+    elif policy == 'subdir':
+        groups = {}
+        for entry in sorted(entries):
+            groups.setdefault(entry[0].split('/', 1)[0] if '/' in entry[0] else '', []).append(entry)
+        entries = [entry for row in itertools.zip_longest(*groups.values()) for entry in row if entry is not None]
+
+    return entries
+
+
+def plan_transfer_batches(files: list, sizes: list, mtimes: list, policy: str = None,
+                          large_file_size: int = None, batch_size: int = DEFAULT_ORDERED_BATCH_SIZE,
+                          streams: int = 1) -> list:
+    """Split an include list into an ordered sequence of rsync runs.
+
+    rsync sorts its file list, so the order files reach the destination can
+    only be controlled between runs, not within one.  Files are ordered with
+    :func:`order_filelist` and cut into runs of *batch_size* files; files of
+    at least *large_file_size* bytes are held back and transferred last, up
+    to *streams* at a time, so they never delay the small files.
+
+    Args:
+        files: Relative file paths.
+        sizes: File sizes aligned with *files*.
+        mtimes: Modification times aligned with *files*.
+        policy: Ordering policy (see :func:`order_filelist`).  When ``None``
+            and no *large_file_size* is set, a single run is returned.
+        large_file_size: Size in bytes at or above which a file is large.
+        batch_size: Maximum number of small files per run.
+        streams: Number of concurrent rsync streams.
+
+    Returns:
+        A list of ``(files, sizes)`` tuples, one per run, in transfer order.
+    """
+
+    if policy is None and not large_file_size:
+        return [(list(files), list(sizes))]
+
+    small = []
+    large = []
+    for entry in order_filelist(files, sizes, mtimes, policy):
+        if large_file_size and _size_to_int(entry[1]) >= large_file_size:
+            large.append(entry)
+        else:
+            small.append(entry)
+
+    if policy is None:
+        batch_size = max(len(small), 1)
+
+    batches = [small[i:i + batch_size] for i in range(0, len(small), batch_size)]
+    batches += [large[i:i + streams] for i in range(0, len(large), streams)]
+
+    return [([entry[0] for entry in batch], [entry[1] for entry in batch]) for batch in batches]
+
+
 def run_transfer_command(worker: "OVDMGearmanWorker", current_job, cmd: list, file_count: int) -> tuple:
     """Execute an rsync transfer command and collect new/updated file lists.
 
-    Streams rsync item-change output (``>f+++++++++`` / ``>f.``) to classify
-    files as new or updated, and reports percentage progress to the Gearman
-    job via ``to-chk=`` lines.  Honours ``worker.stop`` to allow graceful
-    early termination.
+    Runs *cmd* through :func:`~server.lib.connection_utils.run_rsync`, which
+    reports each transferred file as a structured record, and reports
+    percentage progress to the Gearman job via ``to-chk=`` lines.  Honours
+    ``worker.stop`` to allow graceful early termination.
 
     Args:
         worker: The active :py:class:`OVDMGearmanWorker` instance.
@@ -196,45 +343,90 @@ def run_transfer_command(worker: "OVDMGearmanWorker", current_job, cmd: list, fi
 
     logging.debug('Transfer Command: %s', ' '.join(cmd))
 
-    new_files = []
-    updated_files = []
-    last_percent_reported = -1
+    last_percent_reported = [-1]
 
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    while proc.poll() is None:
+    def _report(done, total):
+        if total <= 0:
+            return
 
-        for line in proc.stdout:
+        percent = int(100 * done / total)
+        if percent != last_percent_reported[0]:
+            logging.info("Progress Update: %d%%", percent)
+            if current_job:
+                worker.send_job_status(current_job, int(90 * percent / 100) + 5, 100) # 95 - 5
+            last_percent_reported[0] = percent
 
-            if worker.stop:
-                logging.info("Stopping")
-                proc.terminate()
-                break
+    result = run_rsync(cmd, progress_callback=_report, should_stop=lambda: worker.stop)
 
-            line = line.strip()
+    return result['files']['new'], result['files']['updated']
 
-            if not line:
-                continue
 
-            if line.startswith( '>f+++++++++' ):
-                filename = line.split(' ',1)[1]
-                new_files.append(filename.rstrip('\n'))
-            elif line.startswith( '>f.' ):
-                filename = line.split(' ',1)[1]
-                updated_files.append(filename.rstrip('\n'))
-
-            # Extract progress from `to-chk=` lines
-            match = TO_CHK_RE.search(line)
-            if match:
-                remaining = int(match.group(1))
-                total = int(match.group(2))
-                if total > 0:
-                    percent = int(100 * (total - remaining) / total)
-
-                    if percent != last_percent_reported:
-                        logging.info("Progress Update: %d%%", percent)
-                        if current_job:
-                            worker.send_job_status(current_job, int(90 * percent / 100) + 5, 100) # 95 - 5
-                        last_percent_reported = percent
+def run_transfer_commands(worker: "OVDMGearmanWorker", current_job, cmds: list, file_counts: list,
+                          progress_offset: int = 0, progress_total: int = None) -> tuple:
+    """Run several rsync transfer commands concurrently.
+
+    Each command runs in its own thread.  ``to-chk=`` progress from all
+    streams is combined into a single percentage reported through
+    ``worker.send_job_status``, and the new/updated file lists are merged.
+    Honours ``worker.stop`` by terminating every stream.
+
+    Args:
+        worker: The active :py:class:`OVDMGearmanWorker` instance.
+        current_job: The Gearman job object, or ``None``.
+        cmds: rsync commands, one per stream.
+        file_counts: Number of files each command is expected to transfer.
+        progress_offset: Files already transferred by earlier runs of the
+            same job, for progress reporting.
+        progress_total: Total files for the whole job; defaults to the sum
+            of *file_counts*.
+
+    Returns:
+        A two-tuple ``(new_files, updated_files)`` of relative file paths.
+    """
+
+    if len(cmds) == 1 and progress_total is None:
+        return run_transfer_command(worker, current_job, cmds[0], file_counts[0])
+
+    lock = threading.Lock()
+    progress = [[0, count] for count in file_counts]  # [done, total] per stream
+    last_percent_reported = [-1]
+
+    def _report(idx, done, total):
+        with lock:
+            progress[idx] = [done, max(total, file_counts[idx])]
+            total_files = max(progress_total or 0, progress_offset + sum(p[1] for p in progress))
+            done_files = progress_offset + sum(p[0] for p in progress)
+            percent = int(100 * done_files / total_files) if total_files else 0
+
+            if percent != last_percent_reported[0]:
+                logging.info("Progress Update: %d%%", percent)
+                if current_job:
+                    worker.send_job_status(current_job, int(90 * percent / 100) + 5, 100) # 95 - 5
+                last_percent_reported[0] = percent
+
+    def _run_stream(idx, cmd):
+        if file_counts[idx] == 0:
+            return [], []
+
+        logging.debug('Transfer Command (stream %d): %s', idx + 1, ' '.join(cmd))
+
+        result = run_rsync(cmd, progress_callback=lambda done, total: _report(idx, done, total),
+                           should_stop=lambda: worker.stop)
+
+        return result['files']['new'], result['files']['updated']
+
+    if len(cmds) > 1:
+        logging.info("Running %d transfer streams", len(cmds))
+
+    new_files = []
+    updated_files = []
+
+    with ThreadPoolExecutor(max_workers=len(cmds)) as executor:
+        futures = [executor.submit(_run_stream, idx, cmd) for idx, cmd in enumerate(cmds)]
+        for future in futures:
+            stream_new, stream_updated = future.result()
+            new_files.extend(stream_new)
+            updated_files.extend(stream_updated)
 
     return new_files, updated_files
 
@@ -266,6 +458,7 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
         self.cruise_dir = None
         self.source_dir = None
         self.dest_dir = None
+        self.changed_files = None
 
         self.data_start_date = None
         self.data_end_date = None
@@ -388,9 +581,9 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
         if transfer_type == 'ssh':
             user = cst_cfg['sshUser']
             host = cst_cfg['sshServer']
-            cmd = ['rsync', '-e', 'ssh', f"{user}@{host}:{parent}/"]
+            cmd = ['rsync'] + build_rsync_ssh_args() + [f"{user}@{host}:{parent}/"]
             if not is_darwin:
-                cmd.insert(2, '--protect-args')
+                cmd.insert(1, '--protect-args')
             if cst_cfg.get('sshUseKey') == 0:
                 cmd = ['sshpass', '-p', cst_cfg.get('sshPass', '')] + cmd
             proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
@@ -411,10 +604,21 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
         return [(source_dir, None)]
 
 
-    def build_cst_filelist(self, prefix=None, rsync_password_filepath=None, is_darwin=False, batch_size=500, max_workers=16, override_source_dir=None):
+    def build_cst_filelist(self, prefix=None, rsync_password_filepath=None, is_darwin=False, batch_size=500, max_workers=16, override_source_dir=None, changed_files=None,
+                           listing=None, check_staleness=True):
         """
         Build the list of files to include, exclude, ignore for the given transfer.
+        The returned 'filesize' and 'filemtime' lists are aligned with
+        'include'.
         override_source_dir, when provided, is used instead of self.source_dir.
+        changed_files, when provided for local/SMB transfers, is the list of
+        candidate paths (relative to the source directory) to filter instead
+        of walking the whole source directory.
+        listing, when provided for rsync/ssh transfers, is an already
+        retrieved recursive listing of the source directory (see
+        remote_listing) used instead of listing it again.
+        check_staleness=False skips the staleness re-check so the caller can
+        do it for several source directories at once.
         """
 
         def _build_filters(cst_cfg, cruise_id, lowering_id):
@@ -455,10 +659,10 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
             """
 
             verified = []
-            for filepath, old_size in paths_sizes:
+            for filepath, old_size, mtime in paths_sizes:
                 try:
                     if os.stat(filepath).st_size == int(old_size):
-                        verified.append((filepath, old_size))
+                        verified.append((filepath, old_size, mtime))
                 except FileNotFoundError:
                     continue
             return verified
@@ -474,40 +678,27 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
         data_start_time = calendar.timegm(time.strptime(self.data_start_date, "%Y/%m/%d %H:%M"))
         data_end_time = calendar.timegm(time.strptime(self.data_end_date, "%Y/%m/%d %H:%M:%S"))
 
-        return_files = {'include': [], 'exclude': [], 'new': [], 'updated': [], 'filesize': []}
+        return_files = {'include': [], 'exclude': [], 'new': [], 'updated': [], 'filesize': [], 'filemtime': []}
 
         # Get file list based on transfer_type
-        if transfer_type in ['local', 'smb']:
+        if transfer_type in ['local', 'smb'] and changed_files is not None:
+            filepaths = []
+            for rel_path in changed_files:
+                rel_path = os.path.normpath(rel_path)
+                if os.path.isabs(rel_path) or rel_path.startswith('..'):
+                    continue
+                filepath = os.path.join(source_dir, rel_path)
+                if os.path.isfile(filepath):
+                    filepaths.append(filepath)
+        elif transfer_type in ['local', 'smb']:
             filepaths = []
             for root, _, filenames in os.walk(source_dir):
                 for filename in filenames:
                     filepaths.append(os.path.join(root, filename))
         else:
-            command = ['rsync', '-r']
-            if cst_cfg.get('skipEmptyFiles') == 1:
-                command.append('--min-size=1')
-
-            if cst_cfg.get('skipEmptyDirs') == 1:
-                command.append('-m')
-
-            if transfer_type == 'rsync':
-                command += [f'--password-file={rsync_password_filepath}', '--no-motd',
-                            f"rsync://{cst_cfg['rsyncUser']}@"
-                            f"{cst_cfg['rsyncServer']}"
-                            f"{raw_source_dir}/"]
-            elif transfer_type == 'ssh':
-                command += ['-e', 'ssh',
-                            f"{cst_cfg['sshUser']}@"
-                            f"{cst_cfg['sshServer']}:{raw_source_dir}/"]
-                if not is_darwin:
-                    command.insert(2, '--protect-args')
-                if cst_cfg.get('sshUseKey') == 0:
-                    command = ['sshpass', '-p', cst_cfg.get('sshPass', '')] + command
-
-            logging.debug("File list Command: %s", ' '.join(command).replace(f'-p {cst_cfg.get("sshPass", "")}', '-p ****'))
-            proc = subprocess.run(command, capture_output=True, text=True, check=False)
-            filepaths = proc.stdout.splitlines()
-            filepaths = [filepath for filepath in filepaths if filepath.startswith('-')]
+            if listing is None:
+                listing = self.remote_listing(raw_source_dir, rsync_password_filepath, is_darwin)
+            filepaths = [filepath for filepath in listing if filepath.startswith('-')]
 
         total_files = len(filepaths)
         logging.debug("Discovered %d files", total_files)
@@ -530,44 +721,38 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
                         if item[0] == 'include':
                             return_files['include'].append(item[1])
                             return_files['filesize'].append(item[2])
+                            return_files['filemtime'].append(item[3])
                         elif item[0] == 'exclude':
                             return_files['exclude'].append(item[1])
 
         # Optional staleness check
         staleness = cst_cfg.get('staleness')
-        if staleness and staleness != 0:
+        if check_staleness and staleness and staleness != 0:
             logging.debug("Checking staleness (wait %ss)...", staleness)
             time.sleep(int(staleness))
 
             if transfer_type in ['local', 'smb']:
-                paths_sizes = list(zip(return_files['include'], return_files['filesize']))
+                paths_sizes = list(zip(return_files['include'], return_files['filesize'], return_files['filemtime']))
                 stale_batches = [paths_sizes[i:i + batch_size] for i in range(0, len(paths_sizes), batch_size)]
                 verified_paths = []
                 verified_sizes = []
+                verified_mtimes = []
                 with ThreadPoolExecutor(max_workers=max_workers) as executor:
                     futures = [executor.submit(_verify_staleness_batch, batch) for batch in stale_batches]
                     for future in as_completed(futures):
-                        for filepath, size in future.result():
+                        for filepath, size, mtime in future.result():
                             verified_paths.append(filepath)
                             verified_sizes.append(size)
+                            verified_mtimes.append(mtime)
                 return_files['include'] = verified_paths
                 return_files['filesize'] = verified_sizes
+                return_files['filemtime'] = verified_mtimes
             else:
-                proc = subprocess.run(command, capture_output=True, text=True, check=False)
-                for line in proc.stdout.splitlines():
-                    try:
-                        file_or_dir, size, *_ , filepath = line.split(None, 4)
-                        if not file_or_dir.startswith('-'):
-                            continue
-                        idx = return_files['include'].index(filepath)
-                        if return_files['filesize'][idx] != size:
-                            del return_files['filesize'][idx]
-                            del return_files['include'][idx]
-                    except Exception as exc:
-                        logging.warning("Staleness check error: %s", str(exc))
+                stale = self.stale_remote_files(raw_source_dir, return_files['include'], return_files['filesize'],
+                                                rsync_password_filepath, is_darwin)
+                self.drop_files(return_files, stale)
 
         # Format final output
-        del return_files['filesize']
         if transfer_type in ['local', 'smb']:
             base_len = len(source_dir.rstrip(os.sep)) + 1
             return_files['include'] = [f[base_len:] for f in return_files['include']]
@@ -576,6 +761,165 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
         return {'verdict': True, 'files': return_files}
 
 
+    def remote_listing(self, raw_dir, rsync_password_filepath=None, is_darwin=False, files_from=None):
+        """
+        Return the lines of a recursive rsync listing of raw_dir on the
+        rsync/ssh source.  files_from, a file of paths relative to raw_dir,
+        limits the listing to those paths.
+        """
+
+        cst_cfg = self.collection_system_transfer
+        transfer_type = get_transfer_type(cst_cfg['transferType'])
+
+        command = ['rsync', '-r']
+        if files_from is not None:
+            command.append(f'--files-from={files_from}')
+
+        if cst_cfg.get('skipEmptyFiles') == 1:
+            command.append('--min-size=1')
+
+        if cst_cfg.get('skipEmptyDirs') == 1:
+            command.append('-m')
+
+        if transfer_type == 'rsync':
+            command += [f'--password-file={rsync_password_filepath}', '--no-motd',
+                        f"rsync://{cst_cfg['rsyncUser']}@"
+                        f"{cst_cfg['rsyncServer']}"
+                        f"{raw_dir}/"]
+        elif transfer_type == 'ssh':
+            command += build_rsync_ssh_args() + [
+                        f"{cst_cfg['sshUser']}@"
+                        f"{cst_cfg['sshServer']}:{raw_dir}/"]
+            if not is_darwin:
+                command.insert(1, '--protect-args')
+            if cst_cfg.get('sshUseKey') == 0:
+                command = ['sshpass', '-p', cst_cfg.get('sshPass', '')] + command
+
+        logging.debug("File list Command: %s", ' '.join(command).replace(f'-p {cst_cfg.get("sshPass", "")}', '-p ****'))
+        proc = subprocess.run(command, capture_output=True, text=True, check=False)
+        return proc.stdout.splitlines()
+
+
+    def stale_remote_files(self, raw_dir, filepaths, sizes, rsync_password_filepath=None, is_darwin=False):
+        """
+        Re-list only filepaths (relative to raw_dir) on the rsync/ssh source
+        and return the set of those whose size no longer matches sizes or that
+        have disappeared
+        """
+
+        if not filepaths:
+            return set()
+
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt') as candidates:
+            candidates.write('\n'.join(filepaths) + '\n')
+            candidates.flush()
+            listing = self.remote_listing(raw_dir, rsync_password_filepath, is_darwin, files_from=candidates.name)
+
+        current = {}
+        for line in listing:
+            parts = line.split(None, 4)
+            if len(parts) == 5 and parts[0].startswith('-'):
+                current[parts[4]] = parts[1]
+
+        return {filepath for filepath, size in zip(filepaths, sizes) if current.get(filepath) != size}
+
+
+    @staticmethod
+    def drop_files(files, drop):
+        """
+        Remove the paths in drop from files['include'] and the aligned
+        'filesize'/'filemtime' lists
+        """
+
+        if not drop:
+            return
+
+        keep = [idx for idx, filepath in enumerate(files['include']) if filepath not in drop]
+        for key in ['include', 'filesize', 'filemtime']:
+            files[key] = [files[key][idx] for idx in keep]
+
+
+    def partition_wildcard_listing(self, source_dir, listing):
+        """
+        Split a recursive listing of the parent of a wildcard source_dir into
+        [(concrete_source_dir, dest_basename, listing)] for each matching
+        subdirectory, with paths made relative to that subdirectory
+        """
+
+        parent = os.path.dirname(source_dir)
+        pattern = os.path.basename(source_dir)
+
+        matched = set()
+        per_dir = {}
+        for line in listing:
+            parts = line.split(None, 4)
+            if len(parts) < 5:
+                continue
+
+            file_or_dir, size, mdate, mtime, path = parts
+            top, _, rel_path = path.partition('/')
+
+            if top in ('.', '..') or not fnmatch.fnmatch(top, pattern):
+                continue
+
+            if not rel_path:
+                if file_or_dir.startswith('d'):
+                    matched.add(top)
+                continue
+
+            per_dir.setdefault(top, []).append(f'{file_or_dir} {size} {mdate} {mtime} {rel_path}')
+
+        return [(os.path.join(parent, name), name, per_dir.get(name, [])) for name in sorted(matched)]
+
+
+    def rsync_stream_config(self):
+        """
+        Return the (streams, shard_by) parallel rsync settings for the current
+        transfer from rsyncStreams in openvdm.yaml
+        """
+
+        stream_cfg = self.ovdm.get_rsync_streams().get(self.collection_system_transfer['name'], 1)
+        shard_by = 'size'
+
+        if isinstance(stream_cfg, dict):
+            shard_by = stream_cfg.get('shardBy', 'size')
+            stream_cfg = stream_cfg.get('streams', 1)
+
+        if shard_by not in SHARD_MODES:
+            logging.warning("Unknown shardBy value: %s, using 'size'", shard_by)
+            shard_by = 'size'
+
+        try:
+            streams = max(1, int(stream_cfg))
+        except (TypeError, ValueError):
+            logging.warning("Invalid rsyncStreams value: %s", stream_cfg)
+            streams = 1
+
+        return streams, shard_by
+
+
+    def transfer_ordering_config(self):
+        """
+        Return the (policy, large_file_size, batch_size) transfer ordering
+        settings for the current transfer from transferOrdering in
+        openvdm.yaml
+        """
+
+        order_cfg = self.ovdm.get_transfer_ordering().get(self.collection_system_transfer['name']) or {}
+
+        policy = order_cfg.get('order')
+        if policy is not None and policy not in ORDER_POLICIES:
+            logging.warning("Unknown transfer order: %s", policy)
+            policy = None
+
+        large_file_size = order_cfg.get('largeFileSize')
+        large_file_size = int(float(large_file_size) * 1024 * 1024) if large_file_size else None
+
+        batch_size = int(order_cfg.get('batchSize', DEFAULT_ORDERED_BATCH_SIZE))
+
+        return policy, large_file_size, max(batch_size, 1)
+
+
     def test_destination_dir(self):
         """
         Verify the destination directory exists
@@ -615,22 +959,20 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
         mntpoint = None
         is_darwin = False
 
-        with temporary_directory() as tmpdir:
+        with temporary_directory() as tmpdir, ExitStack() as cleanup:
             include_file = os.path.join(tmpdir, 'rsyncFileList.txt')
             password_file = os.path.join(tmpdir, 'passwordFile')
 
             # Adjustments for SMB
             if transfer_type == 'smb':
-                # Mount SMB Share
-                mntpoint = os.path.join(tmpdir, 'mntpoint')
-                os.mkdir(mntpoint, 0o755)
-                smb_version, smb_detail = detect_smb_version(cst_cfg)
-                success, mount_detail = mount_smb_share(cst_cfg, mntpoint, smb_version)
-                if not success:
+                # Mount SMB Share (reusing the mount from the source test)
+                mntpoint, _, mount_detail = SMB_MOUNT_POOL.acquire(cst_cfg)
+                if not mntpoint:
                     reason = 'Failed to mount SMB share'
                     if mount_detail:
                         reason += f' — {mount_detail}'
                     return {'verdict': False, 'reason': reason}
+                cleanup.callback(SMB_MOUNT_POOL.release, mntpoint)
                 prefix = mntpoint
 
             # Adjustments for RSYNC
@@ -655,8 +997,23 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
             if transfer_type == 'ssh':
                 is_darwin = check_darwin(cst_cfg)
 
-            # Enumerate source directories (expands wildcards if present)
-            source_pairs = self._enumerate_sources(transfer_type, source_dir, prefix, password_file, is_darwin)
+            # Enumerate source directories (expands wildcards if present).
+            # Wildcard rsync/ssh sources are listed once, recursively, at the
+            # wildcard's parent and the listing is split per matched directory.
+            listings = {}
+            wildcard_parent = os.path.dirname(source_dir) if has_wildcard(source_dir) else None
+
+            if transfer_type in ['rsync', 'ssh'] and wildcard_parent and not has_wildcard(wildcard_parent):
+                partitions = self.partition_wildcard_listing(
+                    source_dir, self.remote_listing(wildcard_parent, password_file, is_darwin)
+                )
+                if not partitions:
+                    logging.warning("No directories matched wildcard: %s", source_dir)
+                source_pairs = [(src_dir, dest_name) for src_dir, dest_name, _ in partitions]
+                listings = {dest_name: listing for _, dest_name, listing in partitions}
+            else:
+                wildcard_parent = None
+                source_pairs = self._enumerate_sources(transfer_type, source_dir, prefix, password_file, is_darwin)
 
             if not source_pairs:
                 return {'verdict': False, 'reason': f'No source directories found matching: {source_dir}', 'files': []}
@@ -666,30 +1023,64 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
                 all_files['deleted'] = []
 
             rsync_flags = build_rsync_options(cst_cfg, mode='real', is_darwin=is_darwin)
+            streams, shard_by = self.rsync_stream_config()
+            order_policy, large_file_size, ordered_batch_size = self.transfer_ordering_config()
+
+            # Changed paths from the transfer watcher can't drive a sync (the
+            # include list must be complete for deletions)
+            changed_files = self.changed_files
+            if changed_files is not None and (transfer_type not in ['local', 'smb'] or cst_cfg['syncFromSource'] == 1):
+                changed_files = None
 
+            if changed_files is not None:
+                logging.info("Using %d changed path(s) from job payload", len(changed_files))
+
+            filelists = []
             for src_dir, dest_name in source_pairs:
-                effective_dest = os.path.join(dest_dir, dest_name) if dest_name else dest_dir
-                if dest_name:
-                    os.makedirs(effective_dest, exist_ok=True)
+
+                # Changed paths for wildcard sources are relative to the wildcard's parent
+                src_changed_files = changed_files
+                if changed_files is not None and dest_name:
+                    src_changed_files = [f[len(dest_name) + 1:] for f in changed_files if f.startswith(dest_name + '/')]
 
                 # Build filelist for this source directory
                 filelist_result = self.build_cst_filelist(
                     prefix=prefix,
                     rsync_password_filepath=password_file,
                     is_darwin=is_darwin,
-                    override_source_dir=src_dir
+                    override_source_dir=src_dir,
+                    changed_files=src_changed_files,
+                    listing=listings.get(dest_name),
+                    check_staleness=wildcard_parent is None
                 )
 
                 if not filelist_result['verdict']:
                     logging.warning("Filelist build failed for %s: %s", src_dir, filelist_result.get('reason', 'Unknown'))
                     continue
 
-                files = filelist_result['files']
+                filelists.append((src_dir, dest_name, filelist_result['files']))
 
-                # Write file list
-                if not build_include_file(files['include'], include_file):
-                    logging.warning("Error writing file list for %s, skipping", src_dir)
-                    continue
+            # Staleness re-check for a single-listing wildcard source: one
+            # listing of the parent limited to the candidate files
+            staleness = cst_cfg.get('staleness')
+            if wildcard_parent and staleness and staleness != 0:
+                logging.debug("Checking staleness (wait %ss)...", staleness)
+                time.sleep(int(staleness))
+
+                candidates = [(os.path.join(dest_name, f), size)
+                              for _, dest_name, files in filelists
+                              for f, size in zip(files['include'], files['filesize'])]
+                stale = self.stale_remote_files(wildcard_parent, [c[0] for c in candidates], [c[1] for c in candidates],
+                                                password_file, is_darwin)
+
+                for _, dest_name, files in filelists:
+                    prefix_len = len(dest_name) + 1
+                    self.drop_files(files, {f[prefix_len:] for f in stale if f.startswith(dest_name + '/')})
+
+            for src_dir, dest_name, files in filelists:
+                effective_dest = os.path.join(dest_dir, dest_name) if dest_name else dest_dir
+                if dest_name:
+                    os.makedirs(effective_dest, exist_ok=True)
 
                 # Build rsync source path
                 if transfer_type == 'local':
@@ -705,19 +1096,53 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
 
                 extra_args = []
                 if transfer_type == 'ssh':
-                    extra_args = ['-e', 'ssh']
+                    extra_args = build_rsync_ssh_args()
                 elif transfer_type == 'rsync':
                     extra_args = [f"--password-file={password_file}"]
 
-                cmd = build_rsync_command(rsync_flags, extra_args, source_path, effective_dest, include_file)
-                if transfer_type == 'ssh' and cst_cfg.get('sshUseKey') == 0:
-                    cmd = ['sshpass', '-p', cst_cfg.get('sshPass', '')] + cmd
-
-                new_files, updated_files = run_transfer_command(
-                    self, current_job, cmd, len(files['include'])
+                # Ordered runs (small files first), each split across the rsync streams
+                batches = plan_transfer_batches(
+                    files['include'], files['filesize'], files['filemtime'],
+                    policy=order_policy, large_file_size=large_file_size,
+                    batch_size=ordered_batch_size, streams=streams
                 )
-                files['new'] = new_files
-                files['updated'] = updated_files
+
+                if len(batches) > 1:
+                    logging.info("Transferring %d file(s) in %d ordered run(s)", len(files['include']), len(batches))
+
+                files['new'] = []
+                files['updated'] = []
+                transferred = 0
+
+                for batch_files, batch_sizes in batches:
+                    if self.stop:
+                        break
+
+                    # Write file list(s), one per rsync stream
+                    shards = shard_filelist(batch_files, batch_sizes, streams, shard_by)
+                    include_files = [include_file] if len(shards) == 1 else [
+                        os.path.join(tmpdir, f'rsyncFileList_{idx}.txt') for idx in range(len(shards))
+                    ]
+
+                    if not all(build_include_file(shard, shard_file) for shard, shard_file in zip(shards, include_files)):
+                        logging.warning("Error writing file list for %s, skipping", src_dir)
+                        break
+
+                    cmds = []
+                    for shard_file in include_files:
+                        cmd = build_rsync_command(rsync_flags, extra_args, source_path, effective_dest, shard_file)
+                        if transfer_type == 'ssh' and cst_cfg.get('sshUseKey') == 0:
+                            cmd = ['sshpass', '-p', cst_cfg.get('sshPass', '')] + cmd
+                        cmds.append(cmd)
+
+                    new_files, updated_files = run_transfer_commands(
+                        self, current_job, cmds, [len(shard) for shard in shards],
+                        progress_offset=transferred,
+                        progress_total=len(files['include']) if len(batches) > 1 else None
+                    )
+                    files['new'].extend(new_files)
+                    files['updated'].extend(updated_files)
+                    transferred += len(batch_files)
 
                 # Delete files if sync'ing with source
                 if cst_cfg['syncFromSource'] == 1:
@@ -752,6 +1177,7 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):  # pylint: disable=too-m
 
             cst_cfg = payload_obj.get('collectionSystemTransfer', {})
             cst_id = cst_cfg.get('collectionSystemTransferID')
+            self.changed_files = payload_obj.get('changedFiles')
 
             self.collection_system_transfer = self.ovdm.get_collection_system_transfer(cst_id)
 
@@ -988,7 +1414,8 @@ def task_run_collection_system_transfer(worker, current_job): # pylint: disable=
     logging.info("Testing source")
     worker.send_job_status(current_job, 1, 100)
 
-    results = test_cst_source(cst_cfg, worker.source_dir)
+    cache_ttl = worker.ovdm.get_source_test_cache_ttl()
+    results = test_cst_source(cst_cfg, worker.source_dir, cache_ttl=CST_TEST_CACHE_TTL if cache_ttl is None else int(cache_ttl))
 
     if results[-1]['result'] == "Fail": # Final Verdict
         logging.warning("Source test failed, quitting job")
@@ -1016,6 +1443,7 @@ def task_run_collection_system_transfer(worker, current_job): # pylint: disable=
 
     if not results['verdict']:
         logging.error("Transfer of remote files failed: %s", results['reason'])
+        invalidate_cst_source_test(cst_cfg)
         job_results['parts'].append({"partName": "Transfer Files", "result": "Fail", "reason": results['reason']})
         return json.dumps(job_results)
 
@@ -1036,7 +1464,9 @@ def task_run_collection_system_transfer(worker, current_job): # pylint: disable=
             logging.info("Setting file permissions")
             worker.send_job_status(current_job, 96, 100)
 
-            results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.dest_dir)
+            # only what this transfer wrote, and the directories (dest_dir included) created for it
+            changed = with_parent_dirs(job_results['files']['new'] + job_results['files']['updated'], worker.dest_dir, include_base=True)
+            results = set_owner_group_permissions(worker.shipboard_data_warehouse_config['shipboardDataWarehouseUsername'], worker.dest_dir, files=changed)
 
             if not results['verdict']:
                 logging.error("Error setting destination directory file/directory ownership/permissions: %s", worker.dest_dir)
@@ -17,6 +17,7 @@ Key responsibilities:
 """
 
 import argparse
+import hashlib
 import json
 import logging
 import os
@@ -24,19 +25,39 @@ import re
 import sys
 import signal
 import subprocess
+import tempfile
 import time
+from contextlib import nullcontext
 from os.path import dirname, realpath
 from random import randint
 import python3_gearman
 
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
-from server.lib.file_utils import is_ascii, default_ignore_patterns, set_owner_group_permissions, temporary_directory
-from server.lib.connection_utils import build_rclone_config_for_ssh, build_rclone_options, build_rsync_options, check_darwin, detect_smb_version, get_transfer_type, mount_smb_share, test_cdt_destination, test_cdt_rclone_destination
+from server.lib.file_utils import is_ascii, build_file_index, default_ignore_patterns, diff_file_index, set_owner_group_permissions, temporary_directory
+from server.lib.connection_utils import build_rclone_config_for_ssh, build_rclone_options, build_rsync_options, build_rsync_ssh_args, check_darwin, detect_smb_version, get_transfer_type, mount_smb_share, normalize_transfer_config, run_rsync, test_cdt_destination, test_cdt_rclone_destination
 from server.lib.openvdm import OpenVDM
+from server.lib.transfer_coordinator import TransferCoordinator, transfer_destination
 
-TO_CHK_RE = re.compile(r'to-chk=(\d+)/(\d+)')
 RCLONE_PROGRESS_RE = re.compile(r'Transferred:\s+[\d.]+\w+\s+\/\s+[\d.]+\w+,\s+(\d+)%')
 
+# Directory holding the cruise directory index of each cruise data transfer
+CDT_INDEX_DIR = os.path.join(tempfile.gettempdir(), 'openvdm_cdt_index')
+
+# Default number of seconds a cruise directory index is trusted
+CDT_INDEX_MAX_AGE = 86400
+
+# Cruise data transfer fields that change what is sent to the destination
+_CDT_INDEX_FIELDS = (
+    'transferType', 'destDir', 'localDirIsMountPoint',
+    'smbServer', 'smbDomain', 'smbUser',
+    'rsyncServer', 'rsyncUser', 'sshServer', 'sshUser',
+    'includeOVDMFiles', 'excludedCollectionSystems', 'excludedExtraDirectories',
+    'skipEmptyFiles', 'skipEmptyDirs', 'syncToDest',
+)
+
+# Seconds a cruise data transfer exclude list built from the OpenVDM API is reused
+EXCLUDE_CACHE_TTL = 900
+
 TASK_NAMES = {
     'RUN_CRUISE_DATA_TRANSFER': 'runCruiseDataTransfer'
 }
@@ -52,6 +73,13 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
         cruise_data_transfer: Configuration dict for the active transfer.
         shipboard_data_warehouse_config: Warehouse configuration snapshot.
         cruise_dir: Absolute path to the cruise data directory.
+        exclude_cache: Dict mapping cruise data transfer ID to the
+            ``(config hash, time, filters)`` of its last API-derived exclude
+            list.
+        non_ascii_root: Directory described by :attr:`non_ascii_dirs`.
+        non_ascii_dirs: Dict mapping each directory below
+            :attr:`non_ascii_root` to ``(mtime_ns, non-ASCII file names,
+            subdirectory names)`` from its last scan.
     """
 
     def __init__(self):
@@ -64,23 +92,76 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
 
         self.cruise_dir = None
 
+        self.exclude_cache = {}
+        self.non_ascii_root = None
+        self.non_ascii_dirs = {}
+
         super().__init__(host_list=[self.ovdm.get_gearman_server()])
 
 
-    def build_exclude_filterlist(self):
+    def find_non_ascii_files(self):
         """
-        Build exclude filter for the transfer
+        Return the files in the cruise directory with non-ascii names.
+
+        A directory's mtime changes whenever an entry is added, removed or
+        renamed, so only directories whose mtime differs from the previous
+        scan are listed again; the others reuse their cached result.
         """
 
-        #exclude non-ascii filenames
-        def _find_non_ascii_files(source_dir):
-            non_ascii_files = []
-            for root, dirs, files in os.walk(source_dir):
-                for name in files:
-                    if not is_ascii(name):
-                        full_path = os.path.join(root, name)
-                        non_ascii_files.append(os.path.relpath(full_path, source_dir))
-            return non_ascii_files
+        if self.non_ascii_root != self.cruise_dir:
+            self.non_ascii_root = self.cruise_dir
+            self.non_ascii_dirs = {}
+
+        scanned = {}
+        rescanned = 0
+        pending = ['']
+
+        while pending:
+            rel_dir = pending.pop()
+            dir_path = os.path.join(self.cruise_dir, rel_dir) if rel_dir else self.cruise_dir
+
+            try:
+                mtime = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+
+            cached = self.non_ascii_dirs.get(rel_dir)
+            if cached is None or cached[0] != mtime:
+                names = []
+                subdirs = []
+                try:
+                    with os.scandir(dir_path) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.name)
+                            elif not is_ascii(entry.name):
+                                names.append(entry.name)
+                except OSError as exc:
+                    logging.warning("Unable to scan directory: %s", str(exc))
+                    continue
+
+                cached = (mtime, names, subdirs)
+                rescanned += 1
+
+            scanned[rel_dir] = cached
+            pending.extend(os.path.join(rel_dir, subdir) if rel_dir else subdir for subdir in cached[2])
+
+        logging.debug("Rescanned %d of %d directories for non-ascii filenames", rescanned, len(scanned))
+        self.non_ascii_dirs = scanned
+
+        return [os.path.join(rel_dir, name) if rel_dir else name for rel_dir, (_, names, _) in scanned.items() for name in names]
+
+
+    def build_config_filterlist(self):
+        """
+        Build the exclude filters defined by the transfer configuration
+        (OpenVDM files, excluded collection systems and extra directories).
+
+        The filters only change with the cruise, the lowerings and the
+        configuration, so they are cached per transfer and rebuilt when any
+        of these change or after EXCLUDE_CACHE_TTL seconds (to pick up edits
+        to the excluded collection systems/extra directories).
+        """
 
         exclude_filterlist = []
 
@@ -88,6 +169,20 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
         cdt_cfg = self.cruise_data_transfer
         lowerings = self.ovdm.get_lowerings() or []
 
+        config_hash = hashlib.sha256(json.dumps({
+            'cruiseID': self.cruise_id,
+            'lowerings': lowerings,
+            'includeOVDMFiles': cdt_cfg.get('includeOVDMFiles'),
+            'excludedCollectionSystems': cdt_cfg.get('excludedCollectionSystems'),
+            'excludedExtraDirectories': cdt_cfg.get('excludedExtraDirectories'),
+            'warehouse': [wh_cfg.get(key) for key in ('cruiseConfigFn', 'md5SummaryFn', 'md5SummaryMd5Fn', 'loweringDataBaseDir')],
+        }, sort_keys=True, default=str).encode()).hexdigest()
+
+        cached = self.exclude_cache.get(cdt_cfg.get('cruiseDataTransferID'))
+        if cached and cached[0] == config_hash and time.time() - cached[1] < EXCLUDE_CACHE_TTL:
+            logging.debug("Using cached exclude filters")
+            return list(cached[2])
+
         # Exclude OVDM-related files if flag is set
         if cdt_cfg.get('includeOVDMFiles') == 0:
             exclude_filterlist.extend([
@@ -102,6 +197,9 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
         # Handle excluded collection systems
         ex_cst_ids = cdt_cfg.get('excludedCollectionSystems', '').split(',') if cdt_cfg.get('excludedCollectionSystems') else []
 
+        # a failed lookup leaves the filters incomplete, don't cache them
+        complete = True
+
         for cst_id in filter(lambda x: x and x != 0, ex_cst_ids):
             try:
                 cst_cfg = self.ovdm.get_collection_system_transfer(cst_id)
@@ -119,6 +217,7 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
 
             except Exception as exc:
                 logging.warning("Could not retrieve collection system transfer %s: %s", cst_id, str(exc))
+                complete = False
 
         # Handle excluded extra directories
         ex_ed_ids = cdt_cfg.get('excludedExtraDirectories', '').split(',') if cdt_cfg.get('excludedExtraDirectories') else []
@@ -140,8 +239,23 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
 
             except Exception as exc:
                 logging.warning("Could not retrieve extra directory %s: %s", ed_id, str(exc))
+                complete = False
+
+        if complete:
+            self.exclude_cache[cdt_cfg.get('cruiseDataTransferID')] = (config_hash, time.time(), list(exclude_filterlist))
+
+        return exclude_filterlist
+
+
+    def build_exclude_filterlist(self):
+        """
+        Build exclude filter for the transfer
+        """
+
+        exclude_filterlist = self.build_config_filterlist()
 
-        exclude_filterlist.extend(_find_non_ascii_files(self.cruise_dir))
+        #exclude non-ascii filenames
+        exclude_filterlist.extend(self.find_non_ascii_files())
         #exclude_filterlist = [ '{self.cruise_id}/{path_filter}' for path_filter in exclude_filterlist ]
         exclude_filterlist.extend(default_ignore_patterns)  # rsync partial files, Synology files, .DS_Store, etc
 
@@ -158,6 +272,82 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
         return test_cdt_destination(self.cruise_data_transfer)
 
 
+    def _file_index_entry(self):
+        """
+        Return (index file path, config hash) for the cruise directory index
+        of the current transfer
+        """
+
+        cdt_cfg = self.cruise_data_transfer
+        fields = {field: cdt_cfg.get(field) for field in _CDT_INDEX_FIELDS}
+        fields['cruiseDir'] = self.cruise_dir
+        config_hash = hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+        index_file = os.path.join(CDT_INDEX_DIR, f"{cdt_cfg['cruiseDataTransferID']}.json")
+        return index_file, config_hash
+
+
+    def estimate_file_count(self, max_age):
+        """
+        Estimate the number of files the transfer will send by comparing the
+        cruise directory with its index from the last successful transfer.
+
+        Returns (file_count, index).  file_count is None when there is no
+        usable index (first transfer, configuration change, index older than
+        max_age seconds) and the transfer has to compare everything with the
+        destination.  index is the current state of the cruise directory, to
+        be saved with save_file_index once the transfer succeeds.
+        """
+
+        index_file, config_hash = self._file_index_entry()
+        index = build_file_index(self.cruise_dir)
+
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            logging.info("No cruise directory index, transferring everything")
+            return None, index
+        except (OSError, ValueError) as exc:
+            logging.warning("Unable to read cruise directory index %s: %s", index_file, str(exc))
+            return None, index
+
+        if cached.get('hash') != config_hash:
+            logging.info("Transfer configuration changed, transferring everything")
+            return None, index
+
+        if time.time() - cached.get('time', 0) > max_age:
+            logging.info("Cruise directory index expired, transferring everything")
+            return None, index
+
+        changed, removed = diff_file_index(cached.get('files', {}), index)
+        file_count = len(changed)
+
+        # removals only need a transfer when they are synced to the destination
+        if normalize_transfer_config(self.cruise_data_transfer).get('syncToDest', 0) == 1:
+            file_count += len(removed)
+
+        logging.info("Estimated File Count: %d", file_count)
+        return file_count, index
+
+
+    def save_file_index(self, index):
+        """
+        Save the cruise directory index after a successful transfer
+        """
+
+        index_file, config_hash = self._file_index_entry()
+
+        try:
+            os.makedirs(CDT_INDEX_DIR, mode=0o700, exist_ok=True)
+            tmp_file = f'{index_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'hash': config_hash, 'time': time.time(), 'files': index}, f)
+            os.replace(tmp_file, index_file)
+        except OSError as exc:
+            logging.warning("Unable to save cruise directory index: %s", str(exc))
+
+
     def make_cruise_dir(self, dest_dir, extra_args=None):
         """
         Run the rsync command and return the list of new/updated files
@@ -182,30 +372,11 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
 
     def run_transfer_command(self, current_job, command, file_count):
         """
-        Run the rsync command and return the list of new/updated files
+        Run the rsync or rclone command and return the list of new/updated
+        files and whether the transfer completed successfully.  A file_count
+        of None means the number of files is not known in advance.
         """
 
-        def _process_rsync_line(line, last_percent):
-            if line.startswith(('>f+', '<f+')):
-                new_files.append(line.split(' ', 1)[1].rstrip('\n'))
-            elif line.startswith(('>f.', '<f.')):
-                updated_files.append(line.split(' ', 1)[1].rstrip('\n'))
-
-            # Extract progress from `to-chk=` lines
-            match = TO_CHK_RE.search(line)
-            if match:
-                remaining = int(match.group(1))
-                total = int(match.group(2))
-                if total > 0:
-                    percent = max(last_percent, min(100, int(100 * (total - remaining) / total)))
-
-                    if percent != last_percent:
-                        logging.info("Progress Update: %d%%", percent)
-                        self.send_job_status(current_job, int(90 * percent/100) + 5, 100)  # 95 - 5
-                        last_percent = percent
-
-            return last_percent
-
         def _process_rclone_line(line, last_percent):
             # Try to extract progress percentage from rclone's output
             match = RCLONE_PROGRESS_RE.search(line)
@@ -222,17 +393,33 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
         # if there are no files to transfer, then don't
         if file_count == 0:
             logging.debug("Skipping Transfer Command: nothing to transfer")
-            return [], []
+            return [], [], True
 
         logging.debug('Transfer Command: %s', ' '.join(command))
 
-        # file_index = 0
-        new_files = []
-        updated_files = []
         last_percent_reported = -1
 
+        if command[0] != 'rclone':
+            def _report(done, total):
+                nonlocal last_percent_reported
+                if total > 0:
+                    percent = max(last_percent_reported, min(100, int(100 * done / total)))
+
+                    if percent != last_percent_reported:
+                        logging.info("Progress Update: %d%%", percent)
+                        self.send_job_status(current_job, int(90 * percent/100) + 5, 100)  # 95 - 5
+                        last_percent_reported = percent
+
+            result = run_rsync(command, progress_callback=_report, should_stop=lambda: self.stop)
+
+            success = result['returncode'] == 0 and not result['stopped']
+            if result['returncode'] != 0 and not result['stopped']:
+                logging.error("Transfer failed: %s", subprocess.CalledProcessError(result['returncode'], command))
+
+            return result['files']['new'], result['files']['updated'], success
+
+        success = False
         proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        # while proc.poll() is None:
         try:
 
             for line in proc.stdout:
@@ -246,23 +433,20 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
                 if not line:
                     continue
 
-                if command[0] == 'rsync':
-                    last_percent_reported = _process_rsync_line(line, last_percent_reported)
-
-
-                if command[0] == 'rclone':
-                    last_percent_reported = _process_rclone_line(line, last_percent_reported)
+                last_percent_reported = _process_rclone_line(line, last_percent_reported)
 
             proc.wait()
 
             if proc.returncode != 0:
                 raise subprocess.CalledProcessError(proc.returncode, command)
 
+            success = not self.stop
+
         except Exception as e:
             logging.error("Transfer failed: %s", e)
             proc.terminate()
 
-        return new_files, updated_files
+        return [], [], success
 
 
     def transfer_to_destination(self, current_job):
@@ -361,29 +545,36 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
             else:  # local
                 dest_dir = cdt_cfg['destDir']
 
-            # === DRY RUN ===
-            dry_flags = build_rsync_options(cdt_cfg, mode='dry-run', is_darwin=is_darwin)
-
             extra_args = []
             if transfer_type == 'ssh':
-                extra_args += ['-e', 'ssh']
+                extra_args += build_rsync_ssh_args()
             elif transfer_type == 'rsync':
                 extra_args += [f"--password-file={password_file}"]
 
-            dr_dest_dir = f'{tmpdir}/{self.cruise_id}' if ':' in dest_dir else f'{dest_dir.rstrip("/")}/{self.cruise_id}'
-            dry_cmd = _build_rsync_command(dry_flags, extra_args, self.cruise_dir, dr_dest_dir, exclude_file)
-            if transfer_type == 'ssh' and cdt_cfg.get('sshUseKey') == 0:
-                dry_cmd = ['sshpass', '-p', cdt_cfg.get('sshPass', '')] + dry_cmd
+            index_cfg = self.ovdm.get_cruise_data_transfer_index()
+            file_index = None
 
-            logging.debug("Dry run command: %s", ' '.join(dry_cmd).replace(f'-p {cdt_cfg.get("sshPass", "")}', '-p ****'))
-            proc = subprocess.run(dry_cmd, capture_output=True, text=True, check=False)
+            if index_cfg:
+                file_count, file_index = self.estimate_file_count(index_cfg.get('maxAge', CDT_INDEX_MAX_AGE))
 
-            file_count = 0
-            for line in proc.stdout.splitlines():
-                if line.startswith('Number of regular files transferred:'):
-                    file_count = int(line.split(':')[1].replace(',', ''))
-                    logging.info("File Count: %d", file_count)
-                    break
+            else:
+                # === DRY RUN ===
+                dry_flags = build_rsync_options(cdt_cfg, mode='dry-run', is_darwin=is_darwin)
+
+                dr_dest_dir = f'{tmpdir}/{self.cruise_id}' if ':' in dest_dir else f'{dest_dir.rstrip("/")}/{self.cruise_id}'
+                dry_cmd = _build_rsync_command(dry_flags, extra_args, self.cruise_dir, dr_dest_dir, exclude_file)
+                if transfer_type == 'ssh' and cdt_cfg.get('sshUseKey') == 0:
+                    dry_cmd = ['sshpass', '-p', cdt_cfg.get('sshPass', '')] + dry_cmd
+
+                logging.debug("Dry run command: %s", ' '.join(dry_cmd).replace(f'-p {cdt_cfg.get("sshPass", "")}', '-p ****'))
+                proc = subprocess.run(dry_cmd, capture_output=True, text=True, check=False)
+
+                file_count = 0
+                for line in proc.stdout.splitlines():
+                    if line.startswith('Number of regular files transferred:'):
+                        file_count = int(line.split(':')[1].replace(',', ''))
+                        logging.info("File Count: %d", file_count)
+                        break
 
             if file_count == 0:
                 logging.debug("Nothing to transfer")
@@ -403,7 +594,7 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
                     os.path.join(dest_dir, self.cruise_id), exclude_file
                 )
 
-                files['new'], files['updated'] = self.run_transfer_command(current_job, cmd, file_count)
+                files['new'], files['updated'], success = self.run_transfer_command(current_job, cmd, file_count)
 
             elif transfer_type == 'ssh':
                 rclone_config = os.path.join(tmpdir, 'rclone_config')
@@ -423,7 +614,7 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
 
                 logging.debug(' '.join(cmd))
 
-                files['new'], files['updated'] = self.run_transfer_command(current_job, cmd, file_count)
+                files['new'], files['updated'], success = self.run_transfer_command(current_job, cmd, file_count)
 
             # === USING RSYNC ===
             else:
@@ -433,7 +624,10 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
                 if transfer_type == 'ssh' and cdt_cfg.get('sshUseKey') == 0:
                     real_cmd = ['sshpass', '-p', cdt_cfg.get('sshPass', '')] + real_cmd
 
-                files['new'], files['updated'] = self.run_transfer_command(current_job, real_cmd, file_count)
+                files['new'], files['updated'], success = self.run_transfer_command(current_job, real_cmd, file_count)
+
+            if file_index is not None and success:
+                self.save_file_index(file_index)
 
             # === PERMISSIONS (local only) ===
             if transfer_type == 'local' and ':' not in dest_dir and cdt_cfg.get('localDirIsMountPoint') == 0:
@@ -632,10 +826,28 @@ def task_run_cruise_data_transfer(worker, current_job):
 
     job_results['parts'].append({"partName": "Connection test", "result": "Pass"})
 
-    logging.info("Transferring files")
-    worker.send_job_status(current_job, 2, 100)
+    coordinator = TransferCoordinator.from_config(worker.ovdm.get_transfer_coordinator())
+    if coordinator is None:
+        slot = nullcontext((True, None))
+    else:
+        slot = coordinator.reader_slot(cdt_cfg['name'], transfer_destination(cdt_cfg),
+                                       should_stop=lambda: worker.stop,
+                                       on_wait=lambda: worker.send_job_status(current_job, 2, 100))
+
+    with slot as (acquired, bandwidth_limit):
+        if not acquired:
+            job_results['parts'].append({"partName": "Transfer slot", "result": "Fail", "reason": "Stopped while waiting for a transfer slot"})
+            return json.dumps(job_results)
+
+        if bandwidth_limit:
+            current_limit = normalize_transfer_config(cdt_cfg).get('bandwidthLimit') or 0
+            cdt_cfg['bandwidthLimit'] = min(current_limit, bandwidth_limit) if current_limit else bandwidth_limit
+            logging.info("Bandwidth limit: %s KB/s", cdt_cfg['bandwidthLimit'])
+
+        logging.info("Transferring files")
+        worker.send_job_status(current_job, 2, 100)
 
-    results = worker.transfer_to_destination(current_job)
+        results = worker.transfer_to_destination(current_job)
 
     if not results['verdict']:
         logging.error("Transfer of remote files failed: %s", results['reason'])
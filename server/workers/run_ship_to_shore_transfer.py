@@ -9,10 +9,21 @@ server, SSH (via rclone), and generic rclone remote.
 Key responsibilities:
 
 - Test the shoreside destination before transferring.
-- Apply per-file include/exclude filters in parallel batches.
+- Match files against the include filters, compiled into a single matcher,
+  walking only the directories the filters can reach and, between runs,
+  re-matching only the files that changed.
+- Optionally send files from a persistent queue: highest priority and
+  newest first, in chunks, within per-priority byte budgets per cycle, with
+  newly arrived priority-1 files jumping ahead between chunks.
 - Report real-time transfer progress to the Gearman job.
 - Restart automatically every hour (via ``stopJob`` submitted by the
-  :py:mod:`scheduler` worker).
+  :py:mod:`scheduler` worker), or, with ``shipToShoreBandwidth`` set in
+  ``openvdm.yaml``, send the files in chunks whose bandwidth limit adapts to
+  the measured throughput and RTT, and stop cleanly after ``maxRunTime``.
+- Optionally keep a journal of the files delivered to the destination so
+  later runs only send, and compare, what is outstanding.
+- Optionally pack small files and the growth of append-only logs into
+  compressed bundles that the shore side unpacks and verifies.
 """
 
 import argparse
@@ -24,74 +35,557 @@ import re
 import sys
 import signal
 import subprocess
+import tempfile
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from os.path import dirname, realpath
 from random import randint
 import python3_gearman
 
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
 from server.lib.file_utils import is_ascii, is_default_ignore, output_json_data_to_file, set_owner_group_permissions, temporary_directory
-from server.lib.connection_utils import build_rclone_options, build_rsync_options, check_darwin, normalize_transfer_config, test_cdt_destination, test_cdt_rclone_destination
+from server.lib.connection_utils import build_rclone_options, build_rsync_options, build_rsync_ssh_args, check_darwin, normalize_transfer_config, run_rsync, test_cdt_destination, test_cdt_rclone_destination
+from server.lib.fs_watch import create_watcher
 from server.lib.openvdm import OpenVDM
+from server.lib.rate_controller import AdaptiveRateController, measure_rtt
+from server.lib.s2s_bundles import BUNDLE_DIR, DEFAULT_BUNDLE_SIZE, DEFAULT_SMALL_FILE_SIZE, BundleStage
 
-TO_CHK_RE = re.compile(r'to-chk=(\d+)/(\d+)')
 RCLONE_PROGRESS_RE = re.compile(r'Transferred:\s+[\d.]+\w+\s+\/\s+[\d.]+\w+,\s+(\d+)%')
 
+GLOB_MAGIC_RE = re.compile(r'[*?[]')
+
+# Stands in for {loweringID} while the filters are translated to a regex
+LOWERING_TOKEN = 'OVDMLOWERINGID'
+
+# Defaults for the shipToShoreBandwidth settings
+DEFAULT_MIN_RATE = 16 # KB/s
+DEFAULT_CHUNK_SECONDS = 300
+DEFAULT_MAX_RUN_TIME = 3300
+
+# Defaults for the shipToShoreQueue settings
+DEFAULT_CYCLE_SECONDS = 3600
+DEFAULT_CHUNK_FILES = 500
+DEFAULT_CHUNK_BYTES = 100 # MB
+DEFAULT_PREEMPT_CHECK = 60
+
+# Directory holding the persistent ship-to-shore queues
+SSDW_QUEUE_DIR = os.path.join(tempfile.gettempdir(), 'openvdm_ssdw_queue')
+
+# Directory holding the journals of files delivered to each SSDW destination
+SSDW_DELIVERED_DIR = os.path.join(tempfile.gettempdir(), 'openvdm_ssdw_delivered')
+
+# Default for the shipToShoreJournal settings
+DEFAULT_JOURNAL_MAX_AGE = 604800
+
+# Directory (on the destination) where rsync keeps partially sent files so an
+# interrupted transfer resumes where it stopped
+RSYNC_PARTIAL_DIR = '.rsync-partial'
+
 TASK_NAMES = {
     'RUN_SHIP_TO_SHORE_TRANSFER': 'runShipToShoreTransfer'
 }
 
-def process_batch(batch: list, filters: dict) -> list:
-    """Filter a batch of file paths against ship-to-shore transfer criteria.
+def compile_priority_filters(filters: dict, lowerings: list):
+    """Compile the priority-ordered include filters into a single matcher.
+
+    The glob patterns of every priority are translated into one regular
+    expression with a named group per priority, so a file path is tested
+    once instead of against each pattern in turn.  ``{loweringID}`` in a
+    pattern matches any of *lowerings* rather than being expanded into a
+    pattern per lowering.
+
+    Args:
+        filters: Ordered dict mapping priority keys (``'1'``-``'5'``) to lists
+            of glob patterns (absolute paths).  As with ``fnmatch``, ``*``
+            also matches ``/``.
+        lowerings: Lowering IDs substituted for ``{loweringID}``.
+
+    Returns:
+        A compiled pattern whose ``lastgroup`` on a match is ``'p'``
+        followed by the priority of the first matching pattern, or ``None``
+        if there are no patterns.
+    """
+
+    lowering_re = f"(?:{'|'.join(re.escape(lowering) for lowering in lowerings)})" if lowerings else None
+    groups = []
+
+    for priority, patterns in filters.items():
+        translated = []
+        for pattern in patterns:
+            if '{loweringID}' not in pattern:
+                translated.append(fnmatch.translate(pattern))
+            elif lowering_re is not None:
+                translated.append(fnmatch.translate(pattern.replace('{loweringID}', LOWERING_TOKEN)).replace(LOWERING_TOKEN, lowering_re))
 
-    Each file is evaluated for default-ignore status, ASCII filename
-    requirement, and priority-ordered include/exclude filter patterns.
+        if translated:
+            groups.append(f"(?P<p{priority}>{'|'.join(translated)})")
+
+    return re.compile('|'.join(groups)) if groups else None
+
+
+def filter_roots(filters: dict, lowerings: list, top_dir: str) -> list:
+    """Return the directories below which the filters can match files.
+
+    Each pattern can only match files below its leading directory
+    components without wildcards.  Directories that do not exist yet are
+    replaced by their nearest existing ancestor so files created in them
+    are still found.
 
     Args:
-        batch: List of absolute file paths to evaluate.
-        filters: Ordered dict mapping priority keys to lists of glob patterns.
-            Files are matched against patterns in priority order; the first
-            match determines the action.
+        filters: Dict mapping priority keys to lists of glob patterns.
+        lowerings: Lowering IDs substituted for ``{loweringID}``.
+        top_dir: Directory all patterns are expected to be under.
 
     Returns:
-        List of ``(action, filepath, priority)`` tuples where *action* is
-        ``"include"`` or ``"exclude"``.  Symlinks, default-ignored files, and
-        unmatched files are omitted.
+        Sorted list of existing directories, none of them below another.
+    """
+
+    top_dir = top_dir.rstrip(os.sep)
+    roots = set()
+
+    for patterns in filters.values():
+        for pattern in patterns:
+            if '{loweringID}' in pattern:
+                expanded = [pattern.replace('{loweringID}', lowering) for lowering in lowerings]
+            else:
+                expanded = [pattern]
+
+            for flt in expanded:
+                literal = []
+                for part in flt.split('/')[:-1]:
+                    if GLOB_MAGIC_RE.search(part):
+                        break
+                    literal.append(part)
+
+                root = '/'.join(literal)
+                if root != top_dir and not root.startswith(top_dir + os.sep):
+                    root = top_dir
+
+                while root != top_dir and not os.path.isdir(root):
+                    root = os.path.dirname(root)
+
+                roots.add(root)
+
+    result = []
+    for root in sorted(roots):
+        if os.path.isdir(root) and not any(root.startswith(parent + os.sep) for parent in result):
+            result.append(root)
+
+    return result
+
+
+class FileListJournal():
+    """Classification of the files the ship-to-shore filters can reach.
+
+    The files below the filter roots are walked and matched once; after
+    that change watchers (see :mod:`server.lib.fs_watch`) on the roots
+    supply the files created or modified since the previous run, and only
+    those are matched again.  When changes may have been missed the roots
+    are walked again.
+
+    Attributes:
+        key: Identifies the cruise and filters the journal was built for.
+        roots: Directories being watched.
+        entries: Dict mapping absolute file path to its priority, or to
+            ``None`` for files excluded for their non-ASCII name.
     """
 
-    def _process_filepath(filepath, filters):
+    def __init__(self, key, roots):
+        self.key = key
+        self.roots = roots
+        self.watchers = {}
+        self.entries = {}
+
+
+    def _classify(self, filepath, matcher):
+        try:
+            if os.path.islink(filepath) or is_default_ignore(filepath):
+                self.entries.pop(filepath, None)
+                return
+        except FileNotFoundError:
+            self.entries.pop(filepath, None)
+            return
+
+        if not is_ascii(filepath):
+            self.entries[filepath] = None
+            return
+
+        match = matcher.match(filepath) if matcher is not None else None
+        if match:
+            self.entries[filepath] = match.lastgroup[1:]
+        else:
+            self.entries.pop(filepath, None)
+
+
+    def refresh(self, matcher):
         """
-        Process a file path to determine if it should be included or excluded from
-        the data transfer
+        Bring the entries up to date, walking the roots on the first call
+        or when changes may have been missed
         """
 
-        try:
-            if os.path.islink(filepath):
-                return None
+        if self.watchers:
+            changed = set()
+            for root, watcher in self.watchers.items():
+                root_changes = watcher.changes()
+                if root_changes is None:
+                    changed = None
+                    break
+                changed.update(os.path.join(root, rel_path) for rel_path in root_changes)
+
+            if changed is not None:
+                logging.debug("%d changed file(s) since the last file list", len(changed))
+                for filepath in changed:
+                    self._classify(filepath, matcher)
+                return
+
+            logging.info("File changes may have been missed, rebuilding the file list")
+
+        self.close()
 
-            if is_default_ignore(filepath):
-                return None
+        # watch before walking so files created during the walk are not missed
+        for root in self.roots:
+            self.watchers[root] = create_watcher(root)
 
-            if not is_ascii(filepath):
-                return ("exclude", filepath)
+        for root in self.roots:
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    self._classify(os.path.join(dirpath, filename), matcher)
 
-            for priority, patterns in filters.items():
-                for pattern in patterns:
-                    if fnmatch.fnmatch(filepath, pattern):
-                        return ("include", filepath, priority)
 
+    def close(self):
+        """
+        Stop watching the roots and forget the entries
+        """
+
+        for watcher in self.watchers.values():
+            watcher.close()
+        self.watchers = {}
+        self.entries = {}
+
+
+class ShipToShoreQueue():
+    """Files waiting to be sent ashore and the bytes sent per priority this cycle.
+
+    Files are handed out in chunks of a single priority: the highest
+    priority (lowest number) with budget left first, newest files first
+    within a priority.  Each priority may have a byte budget per cycle of
+    ``cycle_seconds``; once a priority has used its budget its remaining
+    files wait for the next cycle.  When persistent, the queue and the
+    bytes sent so far this cycle survive worker restarts, so stopping and
+    restarting the transfer does not reset the budgets.
+
+    Files sent during the run are remembered with their size and mtime so
+    later updates only queue them again once they change.
+
+    Attributes:
+        name: Queue name (the transfer name).
+        budgets: Dict mapping priority (``'1'``-``'5'``) to its byte budget
+            per cycle; priorities without an entry are unlimited.
+        cycle_seconds: Length of a budget cycle.
+        persistent: Whether :meth:`load`/:meth:`save` use a state file.
+        pending: Dict mapping path to ``[priority, size, mtime]``.
+        cycle_start: Start time of the current cycle.
+        sent: Dict mapping priority to bytes sent in the current cycle.
+        sent_files: Dict mapping path to the ``[size, mtime]`` sent this run.
+    """
+
+    def __init__(self, name, budgets=None, cycle_seconds=DEFAULT_CYCLE_SECONDS, persistent=True):
+        self.name = name
+        self.budgets = {str(priority): int(float(mb) * 1024 * 1024) for priority, mb in (budgets or {}).items() if mb is not None}
+        self.cycle_seconds = cycle_seconds
+        self.persistent = persistent
+        self.pending = {}
+        self.cycle_start = time.time()
+        self.sent = {}
+        self.sent_files = {}
+
+
+    def _state_path(self):
+        return os.path.join(SSDW_QUEUE_DIR, f'{self.name}.json')
+
+
+    def load(self):
+        """
+        Restore the queue saved by a previous run, if any
+        """
+
+        if not self.persistent:
+            return
+
+        try:
+            with open(self._state_path(), 'r', encoding='utf-8') as f:
+                state = json.load(f)
         except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logging.warning("Unable to read ship-to-shore queue: %s", str(exc))
+            return
+
+        self.pending = state.get('pending', {})
+        self.cycle_start = state.get('cycleStart', self.cycle_start)
+        self.sent = state.get('sent', {})
+        self.start_cycle()
+
+
+    def save(self):
+        """
+        Save the queue for the next run
+        """
+
+        if not self.persistent:
+            return
+
+        state_path = self._state_path()
+        try:
+            os.makedirs(SSDW_QUEUE_DIR, mode=0o700, exist_ok=True)
+            tmp_path = f'{state_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'pending': self.pending, 'cycleStart': self.cycle_start, 'sent': self.sent}, f)
+            os.replace(tmp_path, state_path)
+        except OSError as exc:
+            logging.warning("Unable to save ship-to-shore queue: %s", str(exc))
+
+
+    def start_cycle(self):
+        """
+        Reset the budgets if the current cycle has ended
+        """
+
+        if time.time() - self.cycle_start >= self.cycle_seconds:
+            self.cycle_start = time.time()
+            self.sent = {}
+
+
+    def update(self, base_dir, paths, priorities, replace=False):
+        """
+        Queue the files (relative to base_dir) with their priorities,
+        refreshing the size and mtime of files already queued.  Files sent
+        this run are skipped unless they have changed since.  With replace,
+        files that are no longer listed are dropped and the files sent are
+        forgotten.  Returns the number of files added.
+        """
+
+        listed = set()
+        added = 0
+
+        if replace:
+            self.sent_files = {}
+
+        for path, priority in zip(paths, priorities):
+            try:
+                stat = os.stat(os.path.join(base_dir, path))
+            except OSError:
+                continue
+
+            if path not in self.pending:
+                if self.sent_files.get(path) == [stat.st_size, stat.st_mtime]:
+                    continue
+                added += 1
+            self.pending[path] = [str(priority), stat.st_size, stat.st_mtime]
+            listed.add(path)
+
+        if replace:
+            for path in [path for path in self.pending if path not in listed]:
+                del self.pending[path]
+
+        return added
+
+
+    def remaining_budget(self, priority):
+        """
+        Return the bytes priority may still send this cycle, None if
+        unlimited
+        """
+
+        if priority not in self.budgets:
             return None
 
-    results = []
+        return self.budgets[priority] - self.sent.get(priority, 0)
+
+
+    def next_chunk(self, max_bytes, max_files):
+        """
+        Return (priority, [paths]) for the next chunk to send, (None, [])
+        when nothing can be sent this cycle.  A chunk holds files of one
+        priority, newest first, up to max_bytes/max_files and the priority's
+        remaining budget.  A file larger than max_bytes is sent on its own;
+        a file larger than the whole budget is sent once per cycle, as the
+        first transfer of its priority.
+        """
+
+        ordered = sorted(self.pending.items(), key=lambda item: (int(item[1][0]), -item[1][2]))
+
+        priority = None
+        limit = max_bytes
+        blocked = set()
+        chunk = []
+        chunk_bytes = 0
 
-    for filepath in batch:
-        result = _process_filepath(filepath, filters)
-        if result:
-            results.append(result)
+        for path, (file_priority, size, _) in ordered:
+            if file_priority in blocked:
+                continue
 
-    return results
+            if priority is None:
+                remaining = self.remaining_budget(file_priority)
+                if remaining is not None:
+                    if size > remaining and (size <= self.budgets[file_priority] or self.sent.get(file_priority, 0) > 0):
+                        # wait for the next cycle's budget
+                        blocked.add(file_priority)
+                        continue
+                    limit = min(max_bytes, remaining)
+                priority = file_priority
+
+            elif file_priority != priority:
+                break
+
+            if chunk and (chunk_bytes + size > limit or len(chunk) >= max_files):
+                break
+
+            chunk.append(path)
+            chunk_bytes += size
+
+        return priority, chunk
+
+
+    def complete(self, priority, paths, sent_bytes):
+        """
+        Remove the sent files from the queue and charge their bytes to the
+        priority's budget
+        """
+
+        for path in paths:
+            if path in self.pending:
+                _, size, mtime = self.pending.pop(path)
+                self.sent_files[path] = [size, mtime]
+
+        self.sent[priority] = self.sent.get(priority, 0) + sent_bytes
+
+
+    def mark_sent(self, base_dir, paths):
+        """
+        Remember files (relative to base_dir) delivered outside the queue
+        so updates do not queue them again until they change
+        """
+
+        for path in paths:
+            try:
+                stat = os.stat(os.path.join(base_dir, path))
+            except OSError:
+                continue
+
+            self.sent_files[path] = [stat.st_size, stat.st_mtime]
+
+
+class DeliveryJournal():
+    """Files confirmed delivered to a ship-to-shore destination.
+
+    Files whose size and mtime match the journal are not sent, or compared
+    with the destination, again.  The journal is discarded when the
+    destination changes or once it is older than ``max_age`` seconds, so
+    the destination is compared in full from time to time and files removed
+    from it are sent again.
+
+    Attributes:
+        name: Journal name (the transfer name).
+        destination: Destination the files were delivered to.
+        max_age: Seconds after which the journal is discarded, or ``None``.
+        created: Time the journal was started.
+        entries: Dict mapping path to the ``[size, mtime_ns]`` delivered.
+        current: Dict mapping path to the ``[size, mtime_ns]`` seen by
+            :meth:`outstanding`, recorded by :meth:`record`.
+    """
+
+    def __init__(self, name, destination, max_age=DEFAULT_JOURNAL_MAX_AGE):
+        self.name = name
+        self.destination = destination
+        self.max_age = max_age
+        self.created = time.time()
+        self.entries = {}
+        self.current = {}
+
+
+    def _state_path(self):
+        return os.path.join(SSDW_DELIVERED_DIR, f'{self.name}.json')
+
+
+    def load(self):
+        """
+        Restore the journal of previous runs, unless it is for another
+        destination or too old
+        """
+
+        try:
+            with open(self._state_path(), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logging.warning("Unable to read ship-to-shore delivery journal: %s", str(exc))
+            return
+
+        if state.get('destination') != self.destination:
+            logging.info("Destination changed, discarding delivery journal")
+            return
+
+        if self.max_age and time.time() - state.get('created', 0) > self.max_age:
+            logging.info("Delivery journal older than %ss, comparing all files with the destination", self.max_age)
+            return
+
+        self.created = state['created']
+        self.entries = state.get('entries', {})
+
+
+    def save(self):
+        """
+        Save the journal for the next run
+        """
+
+        state_path = self._state_path()
+        try:
+            os.makedirs(SSDW_DELIVERED_DIR, mode=0o700, exist_ok=True)
+            tmp_path = f'{state_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'destination': self.destination, 'created': self.created, 'entries': self.entries}, f)
+            os.replace(tmp_path, state_path)
+        except OSError as exc:
+            logging.warning("Unable to save ship-to-shore delivery journal: %s", str(exc))
+
+
+    def outstanding(self, base_dir, paths, priorities):
+        """
+        Return the paths (relative to base_dir) and priorities of the files
+        not delivered in their current state
+        """
+
+        outstanding_paths, outstanding_priorities = [], []
+
+        for path, priority in zip(paths, priorities):
+            try:
+                stat = os.stat(os.path.join(base_dir, path))
+            except OSError:
+                continue
+
+            signature = [stat.st_size, stat.st_mtime_ns]
+            if self.entries.get(path) == signature:
+                continue
+
+            self.current[path] = signature
+            outstanding_paths.append(path)
+            outstanding_priorities.append(priority)
+
+        logging.info("%d file(s) outstanding, %d already delivered", len(outstanding_paths), len(paths) - len(outstanding_paths))
+
+        return outstanding_paths, outstanding_priorities
+
+
+    def record(self, paths):
+        """
+        Record the files as delivered in the state outstanding() saw
+        """
+
+        for path in paths:
+            if path in self.current:
+                self.entries[path] = self.current.pop(path)
 
 
 class OVDMGearmanWorker(python3_gearman.GearmanWorker):
@@ -118,13 +612,20 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
         self.shipboard_data_warehouse_config = None
 
         self.cruise_dir = None
+        self.filelist_journal = None
 
         super().__init__(host_list=[self.ovdm.get_gearman_server()])
 
 
-    def build_filelist(self, batch_size=10, max_workers=16):
+    def build_filelist(self, priorities=None):
         """
-        Build the list of files for the ship-to-shore transfer
+        Build the list of files for the ship-to-shore transfer, optionally
+        limited to the given priorities ('1'-'5').  'include' is sorted by
+        priority and 'priority' holds the priority of each included file.
+
+        Only the directories the filters can reach are walked, and only on
+        the first call for a cruise and set of filters; later calls match
+        just the files changed since (see FileListJournal).
         """
 
         def _keyword_replace_and_split(raw_filter):
@@ -188,41 +689,38 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
                     path_prefix = base_path
                     rare_filters.extend([f"{path_prefix}/{f}" for f in raw_filters])
 
-                for flt in rare_filters:
-                    if "{loweringID}" in flt:
-                        proc_filters[priority].extend(
-                            flt.replace("{loweringID}", lid) for lid in self.lowerings
-                        )
-                    else:
-                        proc_filters[priority].append(flt)
+                proc_filters[priority].extend(rare_filters)
 
         logging.debug("build_filelist, proc_filters: %s", json.dumps(proc_filters, indent=2))
 
-        filepaths = []
-        for root, _, filenames in os.walk(self.cruise_dir):
-            for filename in filenames:
-                filepaths.append(os.path.join(root, filename))
+        lowerings = self.lowerings or []
+        key = (self.cruise_dir, json.dumps(proc_filters), tuple(lowerings))
 
-        # Batch and process
-        total_files = len(filepaths)
-        batches = [filepaths[i:i + batch_size] for i in range(0, total_files, batch_size)]
+        if self.filelist_journal is None or self.filelist_journal.key != key:
+            if self.filelist_journal is not None:
+                self.filelist_journal.close()
+            self.filelist_journal = FileListJournal(key, filter_roots(proc_filters, lowerings, self.cruise_dir))
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(process_batch, batch, proc_filters)
-                       for batch in batches]
-            for future in as_completed(futures):
-                result = future.result()
-                if result:
-                    for item in result:
-                        if item[0] == 'include':
-                            return_files['include'].append((item[1], int(item[2])))
-                        elif item[0] == 'exclude':
-                            return_files['exclude'].append(item[1])
+        self.filelist_journal.refresh(compile_priority_filters(proc_filters, lowerings))
 
+        include = []
+        for filepath, priority in list(self.filelist_journal.entries.items()):
+            if priority is not None and priorities is not None and priority not in priorities:
+                continue
 
+            # the watchers report created and modified files, not deleted ones
+            if not os.path.isfile(filepath):
+                del self.filelist_journal.entries[filepath]
+                continue
 
-        return_files['include'].sort(key=lambda x: x[1])
-        return_files['include'] = [filepath for filepath, _ in return_files['include']]
+            if priority is None:
+                return_files['exclude'].append(filepath)
+            else:
+                include.append((int(priority), filepath))
+
+        include.sort()
+        return_files['priority'] = [str(priority) for priority, _ in include]
+        return_files['include'] = [filepath for _, filepath in include]
 
         base_len = len(self.cruise_dir.rstrip(os.sep)) + 1
         return_files['include'] = [f[base_len:] for f in return_files['include']]
@@ -252,30 +750,62 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
         return test_cdt_destination(self.cruise_data_transfer)
 
 
-    def run_transfer_command(self, current_job, command, file_count):
+    def run_transfer_command(self, current_job, command, file_count, progress_offset=0, progress_total=None, should_stop=None):
         """
-        Run the rsync command and return the list of new/updated files
+        Run the rsync or rclone command and return the lists of
+        new/updated/deleted files, the number of bytes sent (None if
+        unknown) and whether the command completed successfully.
+        progress_offset and progress_total place this command within a
+        larger transfer for progress reporting.  The command is also
+        stopped early when should_stop(), if given, returns True.
         """
 
         # if there are no files to transfer, then don't
         if file_count == 0:
             logging.debug("Skipping Transfer Command: nothing to transfer")
-            return [], [], []
+            return [], [], [], 0, True
+
+        progress_total = progress_total or file_count
+
+        def _report_percent(percent):
+            nonlocal last_percent_reported
+            percent = int((100 * progress_offset + percent * file_count) / progress_total)
+            logging.debug("percent: %s", percent)
+
+            if percent != last_percent_reported:
+                logging.info("Progress Update: %d%%", percent)
+                self.send_job_status(current_job, int(90 * percent/100) + 5, 100)
+                last_percent_reported = percent
 
         logging.debug('Transfer Command: %s', ' '.join(command))
 
-        # file_index = 0
-        new_files = []
-        updated_files = []
-        deleted_files = []
         last_percent_reported = -1
 
+        def _should_stop():
+            return self.stop or (should_stop is not None and should_stop())
+
+        if command[0] != 'rclone':
+            def _report(done, total):
+                if total > 0:
+                    _report_percent(int(100 * done / total))
+
+            result = run_rsync(command, progress_callback=_report, should_stop=_should_stop)
+
+            if result['returncode'] != 0 and not result['stopped']:
+                logging.error("Transfer failed: %s", subprocess.CalledProcessError(result['returncode'], command))
+
+            success = result['returncode'] == 0 and not result['stopped']
+            return result['files']['new'], result['files']['updated'], result['files']['deleted'], result['bytes'], success
+
+        success = False
         proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
         try:
+            stopped = False
             for line in proc.stdout:
-                if self.stop:
+                if _should_stop():
                     logging.debug("Stopping")
                     proc.terminate()
+                    stopped = True
                     break
 
                 line = line.strip()
@@ -284,50 +814,285 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
                 if not line:
                     continue
 
-                if command[0] == 'rsync':
-                    if line.startswith(('>f+', '<f+')):
-                        new_files.append(line.split(' ', 1)[1].rstrip('\n'))
-                    elif line.startswith(('>f.', '<f.')):
-                        updated_files.append(line.split(' ', 1)[1].rstrip('\n'))
-                    elif line.startswith('*deleting'):
-                        deleted_files.append(line.split(' ', 1)[1].rstrip('\n'))
-                    # Extract progress from `to-chk=` lines
-                    match = TO_CHK_RE.search(line)
-                    if match:
-                        remaining = int(match.group(1))
-                        total = int(match.group(2))
-                        if total > 0:
-                            percent = int(100 * (total - remaining) / total)
-                            logging.debug("percent: %s", percent)
-
-                            if percent != last_percent_reported:
-                                logging.info("Progress Update: %d%%", percent)
-                                self.send_job_status(current_job, int(90 * percent/100) + 5, 100)
-                                last_percent_reported = percent
-
-                if command[0] == 'rclone':
-                    # Try to extract progress percentage from rclone's output
-                    match = RCLONE_PROGRESS_RE.search(line)
-                    if match:
-                        percent = int(match.group(1))
-                        logging.debug("percent: %s", percent)
-                        if percent != last_percent_reported:
-                            logging.info("Progress Update: %d%%", percent)
-                            self.send_job_status(current_job, int(90 * percent/100) + 5, 100)
-                            last_percent_reported = percent
+                # Try to extract progress percentage from rclone's output
+                match = RCLONE_PROGRESS_RE.search(line)
+                if match:
+                    _report_percent(int(match.group(1)))
 
             proc.wait()
 
-            if proc.returncode != 0:
+            if proc.returncode != 0 and not stopped:
                 raise subprocess.CalledProcessError(proc.returncode, command)
 
+            success = not stopped
+
         except Exception as e:
             logging.error("Transfer failed: %s", e)
             proc.terminate()
 
+        return [], [], [], None, success
+
+
+    def send_queue(self, current_job, queue, tmpdir, build_command, shaping=None, queue_cfg=None, journal=None):
+        """
+        Send the queued files in chunks until the queue is empty, every
+        priority with files left has used its budget, or the run time is
+        up.  Newly arrived or changed priority-1 files are queued every
+        preemptCheck seconds, also while a lower-priority chunk is being
+        sent: that chunk is then interrupted so they go first, and its
+        unsent files stay queued to resume from rsync's partial files.
+        Sent files are removed from the queue, which is saved after every
+        chunk.  A chunk that fails stays queued and the run stops.
+
+        With shaping (adaptive bandwidth), chunks hold about chunkSeconds
+        worth of data at the current bandwidth limit, and the limit is
+        adjusted between chunks from the achieved throughput and the RTT to
+        the destination (measured halfway through each chunk).  The transfer
+        stops cleanly after maxRunTime seconds.
+
+        build_command(include_file, cfg) returns the transfer command for a
+        chunk (paths relative to the warehouse base directory).  Delivered
+        chunks are recorded in the journal, if given.
+        """
+
+        cdt_cfg = normalize_transfer_config(self.cruise_data_transfer)
+        base_dir = self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir']
+        queue_cfg = queue_cfg or {}
+
+        controller = None
+        rtt_host = None
+        deadline = None
+        chunk_seconds = None
+
+        if shaping:
+            controller = AdaptiveRateController(
+                min_rate=shaping.get('minRate', DEFAULT_MIN_RATE),
+                max_rate=shaping.get('maxRate') or cdt_cfg['bandwidthLimit'],
+                rtt_threshold=shaping.get('rttThreshold', 1.5)
+            )
+            controller.load(cdt_cfg['name'])
+
+            chunk_seconds = shaping.get('chunkSeconds', DEFAULT_CHUNK_SECONDS)
+            deadline = time.time() + shaping.get('maxRunTime', DEFAULT_MAX_RUN_TIME)
+
+            # rclone remotes have no single host to probe, shape on throughput alone
+            rtt_host = None if ':' in cdt_cfg['destDir'] else cdt_cfg.get('sshServer')
+            if rtt_host:
+                controller.base_rtt = measure_rtt(rtt_host)
+
+        max_files = queue_cfg.get('chunkFiles', DEFAULT_CHUNK_FILES)
+        preempt_check = queue_cfg.get('preemptCheck', DEFAULT_PREEMPT_CHECK)
+        last_preempt_check = time.time()
+
+        new_files, updated_files, deleted_files = [], [], []
+        include_file = os.path.join(tmpdir, 'rsyncFileList.txt')
+        total = len(queue.pending)
+        done = 0
+
+        def _queue_priority_one():
+            """
+            Queue the new and changed priority-1 files every preemptCheck
+            seconds, returning whether any were added
+            """
+
+            nonlocal last_preempt_check, total
+
+            if time.time() - last_preempt_check < preempt_check:
+                return False
+
+            added = 0
+            results = self.build_filelist(priorities=('1',))
+            if results['verdict']:
+                paths = [f'{self.cruise_id}/{filepath}' for filepath in results['files']['include']]
+                priorities = results['files']['priority']
+                if journal is not None:
+                    paths, priorities = journal.outstanding(base_dir, paths, priorities)
+                added = queue.update(base_dir, paths, priorities)
+                if added:
+                    logging.info("%d new priority 1 file(s) queued", added)
+                    total += added
+            last_preempt_check = time.time()
+
+            return added > 0
+
+        while not self.stop:
+            if deadline and time.time() >= deadline:
+                logging.info("Reached maximum run time, %d file(s) left for the next run", len(queue.pending))
+                break
+
+            _queue_priority_one()
+
+            if controller:
+                max_bytes = controller.rate * 1024 * chunk_seconds
+            else:
+                max_bytes = queue_cfg.get('chunkBytes', DEFAULT_CHUNK_BYTES) * 1024 * 1024
+
+            priority, chunk = queue.next_chunk(max_bytes, max_files)
+            if not chunk:
+                break
+
+            chunk_bytes = sum(queue.pending[path][1] for path in chunk)
+
+            with open(include_file, mode='w', encoding="utf-8") as f:
+                f.write('\n'.join(chunk))
+                f.write('\0')
+
+            chunk_cfg = self.cruise_data_transfer
+            if controller:
+                chunk_cfg = dict(chunk_cfg, bandwidthLimit=controller.rate)
+                logging.info("Sending %d priority %s file(s) (%d bytes) at %d KB/s", len(chunk), priority, chunk_bytes, controller.rate)
+            else:
+                logging.info("Sending %d priority %s file(s) (%d bytes)", len(chunk), priority, chunk_bytes)
+
+            cmd = build_command(include_file, chunk_cfg)
+
+            rtt_samples = []
+            timer = None
+            if rtt_host:
+                timer = threading.Timer(chunk_bytes / 2048 / controller.rate, lambda: rtt_samples.append(measure_rtt(rtt_host)))
+                timer.daemon = True
+                timer.start()
+
+            # new priority-1 files interrupt a lower-priority chunk, however
+            # large; rsync keeps the partial files so the chunk resumes later
+            preempted = False
+
+            def _preempt():
+                nonlocal preempted
+                preempted = _queue_priority_one()
+                return preempted
+
+            start = time.time()
+            chunk_new, chunk_updated, chunk_deleted, sent_bytes, success = self.run_transfer_command(
+                current_job, cmd, len(chunk), progress_offset=done, progress_total=max(total, done + len(chunk)),
+                should_stop=_preempt if priority != '1' else None)
+            elapsed = max(time.time() - start, 1e-3)
+
+            if timer:
+                timer.cancel()
+
+            new_files.extend(chunk_new)
+            updated_files.extend(chunk_updated)
+            deleted_files.extend(chunk_deleted)
+
+            if sent_bytes is None:
+                sent_bytes = chunk_bytes
+
+            if self.stop:
+                # the chunk may be incomplete, leave its files queued
+                break
+
+            if preempted:
+                # the files sent in full are delivered, the rest stay queued
+                delivered = set(chunk_new + chunk_updated)
+                chunk = [path for path in chunk if path in delivered]
+                logging.info("Interrupted priority %s chunk for new priority 1 file(s), %d of its file(s) sent", priority, len(chunk))
+                queue.complete(priority, chunk, sent_bytes)
+                queue.save()
+                done += len(chunk)
+
+                if journal is not None:
+                    journal.record(chunk)
+                    journal.save()
+                continue
+
+            if not success:
+                logging.warning("Failed to send %d priority %s file(s), %d file(s) left for the next run", len(chunk), priority, len(queue.pending))
+                break
+
+            queue.complete(priority, chunk, sent_bytes)
+            queue.save()
+            done += len(chunk)
+
+            if journal is not None:
+                journal.record(chunk)
+                journal.save()
+
+            if controller:
+                rtt = rtt_samples[0] if rtt_samples else None
+                controller.update(sent_bytes / 1024 / elapsed, rtt)
+
+        if controller:
+            controller.save(cdt_cfg['name'])
+
+        if queue.pending:
+            logging.info("%d file(s) left in the queue", len(queue.pending))
+
+        queue.save()
+
         return new_files, updated_files, deleted_files
 
 
+    def send_bundles(self, current_job, include_paths, priorities, tmpdir, build_command, bundle_cfg, journal=None):
+        """
+        Pack the small files and the growth of append-only files among
+        include_paths into compressed bundles (see server.lib.s2s_bundles)
+        and send them, highest priority first.  Each delivered bundle is
+        recorded so its files are not staged again until they change, and
+        in the journal, if given.
+
+        Returns the paths and priorities left to send as-is and a dict with
+        the 'new' and 'updated' files delivered in bundles.
+        """
+
+        base_dir = self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir']
+        bundled = {'new': [], 'updated': []}
+
+        stage = BundleStage(self.cruise_data_transfer['name'], base_dir,
+                            small_file_size=bundle_cfg.get('smallFileSize', DEFAULT_SMALL_FILE_SIZE // 1024) * 1024,
+                            bundle_size=bundle_cfg.get('bundleSize', DEFAULT_BUNDLE_SIZE // 1024 // 1024) * 1024 * 1024)
+        stage.load()
+
+        plan = stage.plan(include_paths, priorities)
+        stage_dir = os.path.join(tmpdir, 'bundles')
+        bundles = stage.build(plan, stage_dir, os.path.join(self.cruise_id, BUNDLE_DIR))
+
+        include_file = os.path.join(tmpdir, 'rsyncBundleList.txt')
+
+        for idx, (priority, bundle_files, updates) in enumerate(bundles):
+            if self.stop:
+                break
+
+            logging.info("Sending bundle of %d priority %s file(s)", len(updates), priority)
+
+            # the bundle, then its manifest: a manifest ashore means its bundle was sent
+            success = True
+            for file_idx, bundle_file in enumerate(bundle_files):
+                if self.stop:
+                    success = False
+                    break
+
+                with open(include_file, mode='w', encoding="utf-8") as f:
+                    f.write(bundle_file)
+                    f.write('\0')
+
+                cmd = build_command(include_file, self.cruise_data_transfer, source_dir=stage_dir)
+                success = self.run_transfer_command(current_job, cmd, 1, progress_offset=idx * len(bundle_files) + file_idx,
+                                                    progress_total=len(bundles) * len(bundle_files))[4]
+                if not success:
+                    break
+
+            if not success:
+                # later bundles may hold deltas on top of this one
+                logging.warning("Bundle not delivered, %d bundle(s) left for the next run", len(bundles) - idx)
+                break
+
+            for path in updates:
+                bundled['updated' if path in stage.state else 'new'].append(path)
+            stage.commit(updates)
+
+            if journal is not None:
+                journal.record(updates)
+                journal.save()
+
+        stage.save()
+
+        raw_paths = [path for path, _ in plan['raw']]
+        raw_priorities = [priority for _, priority in plan['raw']]
+
+        return raw_paths, raw_priorities, bundled
+
+
     def transfer_to_destination(self, current_job):
         """
         Transfer the files to a destination on a ssh server
@@ -387,28 +1152,82 @@ class OVDMGearmanWorker(python3_gearman.GearmanWorker):
 
             files = results['files']
 
-            if not _build_include_file([f'{self.cruise_id}/{filepath}' for filepath in files['include']], include_file):
-                return {'verdict': False, 'reason': 'Failed to write include file'}
+            include_paths = [f'{self.cruise_id}/{filepath}' for filepath in files['include']]
+            priorities = files.pop('priority')
 
+            if ':' not in self.cruise_data_transfer['destDir']:
+                is_darwin = check_darwin(cdt_cfg)
 
-            if ':' in self.cruise_data_transfer['destDir']:
+            def _build_command(include_file_path, cfg, source_dir=None):
+                source_dir = source_dir or self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir']
 
-                copy_sync, flags = build_rclone_options(cdt_cfg, mode='real')
+                if ':' in cfg['destDir']:
 
-                cmd = _build_rclone_command(copy_sync, flags, None, self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir'], self.cruise_data_transfer['destDir'], include_file)
+                    copy_sync, flags = build_rclone_options(cfg, mode='real')
 
-            else:
-                is_darwin = check_darwin(cdt_cfg)
-                dest_dir = f"{cdt_cfg['sshUser']}@{cdt_cfg['sshServer']}:{cdt_cfg['destDir']}"
+                    return _build_rclone_command(copy_sync, flags, None, source_dir, cfg['destDir'], include_file_path)
+
+                dest_dir = f"{cfg['sshUser']}@{cfg['sshServer']}:{cfg['destDir']}"
+
+                flags = build_rsync_options(cfg, mode='real', is_darwin=is_darwin) + [f'--partial-dir={RSYNC_PARTIAL_DIR}']
+                extra_args = build_rsync_ssh_args()
+                cmd = _build_rsync_command(flags, extra_args, source_dir, dest_dir, include_file_path)
+
+                if normalize_transfer_config(cfg).get('sshUseKey') == 0:
+                    cmd = ['sshpass', '-p', cfg.get('sshPass', '')] + cmd
+
+                return cmd
+
+            journal = None
+            journal_cfg = self.ovdm.get_ship_to_shore_journal()
+
+            if journal_cfg:
+                destination = cdt_cfg['destDir'] if ':' in cdt_cfg['destDir'] else f"{cdt_cfg['sshServer']}:{cdt_cfg['destDir']}"
+                journal = DeliveryJournal(cdt_cfg['name'], destination, max_age=journal_cfg.get('maxAge', DEFAULT_JOURNAL_MAX_AGE))
+                journal.load()
+                include_paths, priorities = journal.outstanding(self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir'], include_paths, priorities)
+
+            bundled = {'new': [], 'updated': []}
+            bundle_cfg = self.ovdm.get_ship_to_shore_bundles()
+
+            if bundle_cfg:
+                include_paths, priorities, bundled = self.send_bundles(current_job, include_paths, priorities, tmpdir, _build_command, bundle_cfg, journal)
+                if self.stop:
+                    files['new'], files['updated'], files['deleted'] = bundled['new'], bundled['updated'], []
+                    return {'verdict': True, 'files': files}
+
+            shaping = self.ovdm.get_ship_to_shore_bandwidth()
+            if not normalize_transfer_config(cdt_cfg).get('bandwidthLimit'):
+                shaping = {}
+
+            queue_cfg = self.ovdm.get_ship_to_shore_queue()
+
+            if shaping or queue_cfg:
+                queue = ShipToShoreQueue(cdt_cfg['name'], budgets=queue_cfg.get('budgets'),
+                                         cycle_seconds=queue_cfg.get('cycleSeconds', DEFAULT_CYCLE_SECONDS),
+                                         persistent=bool(queue_cfg))
+                queue.load()
+                queue.update(self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir'], include_paths, priorities, replace=True)
+                queue.mark_sent(self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir'], bundled['new'] + bundled['updated'])
+
+                files['new'], files['updated'], files['deleted'] = self.send_queue(current_job, queue, tmpdir, _build_command, shaping, queue_cfg, journal)
+                files['new'] += bundled['new']
+                files['updated'] += bundled['updated']
+                return {'verdict': True, 'files': files}
+
+            if not _build_include_file(include_paths, include_file):
+                return {'verdict': False, 'reason': 'Failed to write include file'}
 
-                flags = build_rsync_options(cdt_cfg, mode='real', is_darwin=is_darwin)
-                extra_args = ['-e', 'ssh']
-                cmd = _build_rsync_command(flags, extra_args, self.shipboard_data_warehouse_config['shipboardDataWarehouseBaseDir'], dest_dir, include_file)
+            cmd = _build_command(include_file, cdt_cfg)
 
-                if cdt_cfg.get('sshUseKey') == 0:
-                    cmd = ['sshpass', '-p', cdt_cfg.get('sshPass', '')] + cmd
+            files['new'], files['updated'], files['deleted'], _, success = self.run_transfer_command(current_job, cmd, len(include_paths))
 
-            files['new'], files['updated'], files['deleted'] = self.run_transfer_command(current_job, cmd, len(files['include']))
+            if journal is not None:
+                # when interrupted, only the files rsync reported sending are known to be there
+                journal.record(include_paths if success else files['new'] + files['updated'])
+                journal.save()
+            files['new'] += bundled['new']
+            files['updated'] += bundled['updated']
             return {'verdict': True, 'files': files}
 
 
@@ -1,58 +1,93 @@
 #!/usr/bin/env python3
-"""Periodic scheduler that submits OpenVDM transfer jobs to Gearman.
-
-Runs as a long-lived daemon (managed by Supervisor in production).  On each
-cycle it submits background Gearman jobs for every active and non-running
-collection system transfer and cruise data transfer, then evaluates the
-ship-to-shore (SSDW) transfer — restarting it if it has been running longer
-than one hour, and queuing a new run if it is enabled.  Old transfer log files
-are also purged based on the configured retention period.
+"""Event-driven scheduler that submits OpenVDM transfer jobs to Gearman.
+
+Runs as a long-lived daemon (managed by Supervisor in production).  Every
+collection system transfer and cruise data transfer has its own next-run time
+held in a priority queue; the scheduler sleeps until the earliest one is due,
+submits a background Gearman job for each due transfer that is not still
+running, and reschedules it one interval later (with a little jitter so
+transfers sharing an interval do not all fire together).  Per-transfer
+intervals are configured with ``transferIntervals`` in ``openvdm.yaml``;
+transfers without an entry use ``transferInterval``.
+
+The ship-to-shore (SSDW) transfer is evaluated every ``transferInterval`` —
+restarting it if it has been running longer than one hour (or, with
+``shipToShoreBandwidth`` set and a bandwidth limit in effect, well past its
+own ``maxRunTime``), and otherwise queuing a new run, if it is enabled and
+not already running.  Old transfer
+log files are purged on the same cadence.
 
 Usage::
 
     scheduler.py [--interval MINUTES] [-v ...]
 """
 
+import heapq
 import sys
 import time
 import json
 import logging
 import argparse
+import random
 from datetime import datetime, timedelta, timezone
 from os.path import dirname, realpath
 from python3_gearman import GearmanClient
 
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
 
+from server.lib.connection_utils import normalize_transfer_config
 from server.lib.file_utils import purge_old_files
 from server.lib.openvdm import OpenVDM
 from server.workers.run_collection_system_transfer import TASK_NAMES as CST_TASKS_NAMES
 from server.workers.run_cruise_data_transfer import TASK_NAMES as CDT_TASKS_NAMES
+from server.workers.run_ship_to_shore_transfer import DEFAULT_MAX_RUN_TIME as S2ST_MAX_RUN_TIME
 from server.workers.run_ship_to_shore_transfer import TASK_NAMES as S2ST_TASKS_NAMES
 
-def scheduler(interval: int = None) -> None:
-    """Submit Gearman transfer jobs on a recurring interval.
+# Fraction of a transfer's interval used as +/- jitter on each rescheduling
+JITTER_FRACTION = 0.05
+
+# Upper bound on the jitter, in seconds
+MAX_JITTER = 30
+
+# Seconds past its maxRunTime before a self-limiting SSDW transfer is stopped
+S2S_STOP_GRACE = 900
+
+# Seconds to wait before re-checking when the system is Off or the API is unreachable
+IDLE_RECHECK = 60
+
+
+def _jitter(interval_s: float) -> float:
+    spread = min(interval_s * JITTER_FRACTION, MAX_JITTER)
+    return random.uniform(-spread, spread)
 
-    Runs an infinite loop.  Each iteration:
 
-    1. Purges transfer log files older than the configured retention period.
-    2. Waits until the next full minute boundary.
-    3. Skips the rest of the cycle if the system status is ``'Off'``.
-    4. Submits a background ``runCollectionSystemTransfer`` job for each
-       active, non-running collection system transfer.
-    5. Submits a background ``runCruiseDataTransfer`` job for each
-       non-running cruise data transfer.
-    6. Manages the ship-to-shore (SSDW) transfer: stops it if it has been
-       running for more than one hour, and starts a new run if enabled.
-    7. Sleeps until the next interval boundary.
+def scheduler(interval: int = None) -> None:
+    """Submit Gearman transfer jobs as each transfer falls due.
+
+    Runs an infinite loop.  Each wake-up:
+
+    1. Retrieves the active collection system transfers and the cruise data
+       transfers (one API call each), adding newly activated transfers to
+       the queue at a random offset within their interval and dropping
+       deactivated ones.
+    2. Skips dispatching if the system status is ``'Off'``.
+    3. Submits a background ``runCollectionSystemTransfer`` /
+       ``runCruiseDataTransfer`` job for each due transfer that is not
+       currently running, then reschedules it one (jittered) interval later.
+    4. Every ``interval`` minutes, purges old transfer logs and manages the
+       ship-to-shore (SSDW) transfer: stops it if it has been running for
+       more than one hour, and starts a new run if enabled and not still
+       running.
+    5. Sleeps until the next transfer is due.
 
     Args:
-        interval: Scheduling interval in minutes.  When ``None`` the value is
-            retrieved from the OpenVDM API (``getTransferInterval``).
+        interval: Default scheduling interval in minutes.  When ``None`` the
+            value is retrieved from the OpenVDM API (``getTransferInterval``).
     """
 
     ovdm = OpenVDM()
     interval = interval or ovdm.get_transfer_interval()
+    transfer_intervals = ovdm.get_transfer_intervals()
 
     gm_client = GearmanClient([ovdm.get_gearman_server()])
     time.sleep(10)
@@ -63,97 +98,159 @@ def scheduler(interval: int = None) -> None:
     if logfile_purge_timedelta:
         logging.info("Logfile purge age set to: %s", logfile_purge_timedelta)
 
-    while True:
+    for name, minutes in transfer_intervals.items():
+        logging.info("Transfer interval for %s: %s minute(s)", name, minutes)
+
+    # (next_run, key) entries; key is ('cst', id), ('cdt', id) or ('housekeeping', None)
+    queue = [(time.time(), ('housekeeping', None))]
+    scheduled = set()
+
+    def interval_for(transfer):
+        return 60 * float(transfer_intervals.get(transfer['name'], interval))
+
+    def schedule(key, next_run):
+        heapq.heappush(queue, (next_run, key))
+        scheduled.add(key)
+
+    def housekeeping():
+        nonlocal last_s2s_xfer
 
         # purge old transfer logs:
         logging.info("Purging old transfer logs")
         transfer_log_dir = ovdm.get_transfer_log_dir()
         purge_old_files(transfer_log_dir, excludes="*Exclude.log", timedelta_str=logfile_purge_timedelta)
 
-        # Run on the minute
-        CURRENT_SEC = 0
-        while True:
-            t = time.gmtime()
-            if CURRENT_SEC < t.tm_sec:
-                CURRENT_SEC = t.tm_sec
-                time.sleep(60-t.tm_sec)
-            else:
-                break
-
         if ovdm.get_system_status() == 'Off':
             logging.debug("System current set to Off")
-            time.sleep(interval)
-            continue
+            return
 
-        # schedule collection_system_transfers
-        collection_system_transfers = ovdm.get_active_collection_system_transfers('longName')
-        for collection_system_transfer in collection_system_transfers:
+        # schedule ship-to-shore transfer
+        required_cruise_data_transfers = ovdm.get_required_cruise_data_transfers()
+        ssdw_transfer = next((transfer for transfer in required_cruise_data_transfers if transfer["name"] == "SSDW"), None)
+        if not ssdw_transfer:
+            logging.error("SSDW transfer does not exists???")
+            return
 
-            if collection_system_transfer['status'] == 1:
-                continue
+        ssdw_transfer = normalize_transfer_config(ssdw_transfer)
+
+        # adaptive transfers stop by themselves, only stop them if they overrun.
+        # Like the worker, only shape while a bandwidth limit is in effect.
+        s2s_bandwidth = ovdm.get_ship_to_shore_bandwidth()
+        bandwidth_limited = ovdm.get_ship_to_shore_bw_limit_status() and ssdw_transfer.get('bandwidthLimit')
+        if s2s_bandwidth and bandwidth_limited:
+            max_run_time = timedelta(seconds=s2s_bandwidth.get('maxRunTime', S2ST_MAX_RUN_TIME) + S2S_STOP_GRACE)
+        else:
+            max_run_time = timedelta(hours=1)
 
-            logging.info("Submitting collection system transfer job for: %s", collection_system_transfer['longName'])
+        # last_s2s_xfer is when the running transfer was submitted; it is not
+        # reset while that transfer runs, so an overrun is detected
+        now_utc = datetime.now(timezone.utc)
+        delta = now_utc - last_s2s_xfer
+        if ssdw_transfer['status'] == 1:
+            if delta <= max_run_time:
+                logging.debug("S2S transfer running for %s, not restarting", delta)
+                return
+
+            logging.info("S2S tranfer has run for %s, time to restart", max_run_time)
+            gmData = {'pid': ssdw_transfer['pid']}
+            gm_client.submit_job("stopJob", json.dumps(gmData))
+
+        if ssdw_transfer['enable'] == 1:
+            logging.info("Submitting cruise data transfer job for: %s", ssdw_transfer['longName'])
+            last_s2s_xfer = datetime.now(timezone.utc)
 
             gmData = {
-                'collectionSystemTransfer': {
-                    'collectionSystemTransferID': collection_system_transfer['collectionSystemTransferID']
-                }
             }
 
-            gm_client.submit_job(CST_TASKS_NAMES['RUN_COLLECTION_SYSTEM_TRANSFER'], json.dumps(gmData), background=True)
-            time.sleep(2)
+            gm_client.submit_job(S2ST_TASKS_NAMES['RUN_SHIP_TO_SHORE_TRANSFER'], json.dumps(gmData), background=True)
 
-        # schedule cruise_data_transfers
-        cruise_data_transfers = ovdm.get_cruise_data_transfers()
-        for cruise_data_transfer in cruise_data_transfers:
+    while True:
 
-            if cruise_data_transfer['status'] == 1:
-                continue
+        delay = queue[0][0] - time.time()
+        if delay > 0:
+            logging.debug("Waiting %.1f seconds until next transfer is due", delay)
+            time.sleep(delay)
 
-            logging.info("Submitting cruise data transfer job for: %s", cruise_data_transfer['longName'])
+        now = time.time()
 
-            gmData = {
-                'cruiseDataTransfer': {
-                    'cruiseDataTransferID': cruise_data_transfer['cruiseDataTransferID']
-                }
+        try:
+            collection_system_transfers = {
+                ('cst', transfer['collectionSystemTransferID']): transfer
+                for transfer in ovdm.get_active_collection_system_transfers('longName')
             }
+            cruise_data_transfers = {
+                ('cdt', transfer['cruiseDataTransferID']): transfer
+                for transfer in ovdm.get_cruise_data_transfers()
+            }
+            system_off = ovdm.get_system_status() == 'Off'
+        except Exception as err:
+            logging.error("Unable to retrieve data from OpenVDM API: %s", err)
+            time.sleep(IDLE_RECHECK)
+            continue
 
-            gm_client.submit_job(CDT_TASKS_NAMES['RUN_CRUISE_DATA_TRANSFER'], json.dumps(gmData), background=True)
-            time.sleep(2)
+        transfers = {**collection_system_transfers, **cruise_data_transfers}
 
-        # schedule ship-to-shore transfer
-        required_cruise_data_transfers = ovdm.get_required_cruise_data_transfers()
-        ssdw_transfer = next((transfer for transfer in required_cruise_data_transfers if transfer["name"] == "SSDW"), None)
-        if not ssdw_transfer:
-            logging.error("SSDW transfer does not exists???")
+        # newly active transfers start at a random point within their interval
+        for key, transfer in transfers.items():
+            if key not in scheduled:
+                schedule(key, now + random.uniform(0, interval_for(transfer)))
 
-        else:
-            now_utc = datetime.now(timezone.utc)
-            delta = now_utc - last_s2s_xfer
-            if ssdw_transfer['status'] == 1 and delta > timedelta(hours=1):
-                logging.info("S2S tranfer has run for an hour, time to restart")
-                gmData = {'pid': ssdw_transfer['pid']}
-                gm_client.submit_job("stopJob", json.dumps(gmData))
+        # dispatch everything that is due
+        while queue and queue[0][0] <= now:
+            _, key = heapq.heappop(queue)
+            scheduled.discard(key)
+
+            if key[0] == 'housekeeping':
+                try:
+                    housekeeping()
+                except Exception as err:
+                    logging.error("Housekeeping failed: %s", err)
+                schedule(key, now + interval * 60)
+                continue
+
+            transfer = transfers.get(key)
+            if transfer is None:
+                logging.debug("Transfer %s no longer active, dropping from schedule", key)
+                continue
+
+            transfer_interval = interval_for(transfer)
+            schedule(key, now + transfer_interval + _jitter(transfer_interval))
 
-            if ssdw_transfer['enable'] == 1:
-                logging.info("Submitting cruise data transfer job for: %s", ssdw_transfer['longName'])
-                last_s2s_xfer = datetime.now(timezone.utc)
+            if system_off:
+                logging.debug("System current set to Off")
+                continue
+
+            if transfer['status'] == 1:
+                logging.info("Skipping %s, previous run still in progress", transfer['longName'])
+                continue
+
+            if key[0] == 'cst':
+                logging.info("Submitting collection system transfer job for: %s", transfer['longName'])
 
                 gmData = {
+                    'collectionSystemTransfer': {
+                        'collectionSystemTransferID': transfer['collectionSystemTransferID']
+                    }
                 }
 
-                gm_client.submit_job(S2ST_TASKS_NAMES['RUN_SHIP_TO_SHORE_TRANSFER'], json.dumps(gmData), background=True)
-                time.sleep(2)
+                gm_client.submit_job(CST_TASKS_NAMES['RUN_COLLECTION_SYSTEM_TRANSFER'], json.dumps(gmData), background=True)
+
+            else:
+                logging.info("Submitting cruise data transfer job for: %s", transfer['longName'])
+
+                gmData = {
+                    'cruiseDataTransfer': {
+                        'cruiseDataTransferID': transfer['cruiseDataTransferID']
+                    }
+                }
 
-        delay = interval * 60 - len(collection_system_transfers) * 2 - len(cruise_data_transfers) * 2 - 2
-        logging.info("Waiting %s seconds until next round of tasks are queued", delay)
-        time.sleep(delay)
+                gm_client.submit_job(CDT_TASKS_NAMES['RUN_CRUISE_DATA_TRANSFER'], json.dumps(gmData), background=True)
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='OpenVDM Data Transfer Scheduler')
-    parser.add_argument('-i', '--interval', metavar='interval', type=int, help='interval in minutes')
+    parser.add_argument('-i', '--interval', metavar='interval', type=int, help='default interval in minutes')
     parser.add_argument('-v', '--verbosity', dest='verbosity',
                         default=0, action='count',
                         help='Increase output verbosity')
@@ -2,44 +2,249 @@
 """Continuously cache the on-disk sizes of the cruise and lowering directories.
 
 Runs as a long-lived daemon process (managed by Supervisor in production).
-At each interval it calls ``du -sb`` on the current cruise and, if active, the
-current lowering directory, then pushes the byte totals to the OpenVDM API so
-the web UI can display them without a blocking ``du`` call on every page load.
+The cruise directory is walked once to build a per-directory size index, and
+the byte totals for the cruise and (if active) lowering directory are pushed
+to the OpenVDM API so the web UI can display them without a blocking ``du``
+call on every page load.
+
+After the initial walk the index is kept current incrementally: collection
+system transfers publish their new/updated/deleted files to the
+``updateDirectorySizes`` Gearman task (via the ``runCollectionSystemTransfer``
+hook in ``openvdm.yaml``) and only the directories containing those files are
+rescanned.  A full walk is repeated at the much lower ``--reconcile`` rate to
+pick up changes made outside of transfers.
+
+Only collection system transfers publish their changes.  Files written by
+other tasks (data dashboard and MD5 summary updates, cruise and lowering
+setup and configuration files, cruise directory rebuilds) and by hand are
+only counted at the next full walk, so the sizes shown can lag by up to
+``--reconcile`` seconds.
 
 Usage::
 
-    size_cacher.py [--interval SECONDS] [-v ...]
+    size_cacher.py [--interval SECONDS] [--reconcile SECONDS] [-v ...]
 """
 
 import argparse
 from datetime import datetime, timezone
+import json
 import logging
-import subprocess
+import os
+import queue
 import sys
+import threading
 import time
 from os.path import dirname, realpath, join, isdir
+import python3_gearman
 
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
 
 from server.lib.openvdm import OpenVDM
 
-def size_cacher(interval: int) -> None:
-    """Poll cruise and lowering directory sizes and push them to the OpenVDM API.
+TASK_NAMES = {
+    'UPDATE_DIRECTORY_SIZES': 'updateDirectorySizes'
+}
 
-    Runs an infinite loop.  On each iteration the current cruise and (when
-    lowering components are enabled) lowering directory sizes are measured with
-    ``du -sb``, then written back to OpenVDM via
+class DirectorySizeIndex():
+    """Per-directory byte counts for a directory tree.
+
+    Each directory is stored with the apparent size of its own entry plus
+    that of its non-directory children (the same quantities ``du -sb``
+    sums), so a subtree total is the sum over the directories it contains
+    and a change to a file only requires its parent directory to be
+    rescanned.
+
+    Attributes:
+        root: Absolute path of the indexed tree.
+        dirs: Dict mapping directory path relative to *root* (``''`` for the
+            root itself) to its local byte count.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.dirs = {}
+
+
+    def _abs(self, rel_dir):
+        return join(self.root, rel_dir) if rel_dir else self.root
+
+
+    @staticmethod
+    def _join(rel_dir, name):
+        return f"{rel_dir}/{name}" if rel_dir else name
+
+
+    def _scan_dir(self, rel_dir):
+        """
+        Return (local_bytes, subdirectory names) for a single directory, or
+        (None, []) if it no longer exists.
+        """
+
+        path = self._abs(rel_dir)
+        try:
+            local_bytes = os.lstat(path).st_size
+            subdirs = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        else:
+                            local_bytes += entry.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        continue
+        except (FileNotFoundError, NotADirectoryError):
+            return None, []
+        except PermissionError as err:
+            logging.warning("Unable to scan directory: %s", err)
+            return 0, []
+
+        return local_bytes, subdirs
+
+
+    def _scan_tree(self, rel_dir):
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            local_bytes, subdirs = self._scan_dir(current)
+            if local_bytes is None:
+                continue
+            self.dirs[current] = local_bytes
+            pending.extend(self._join(current, name) for name in subdirs)
+
+
+    def _drop_tree(self, rel_dir):
+        prefix = f"{rel_dir}/"
+        for key in [key for key in self.dirs if key == rel_dir or key.startswith(prefix)]:
+            del self.dirs[key]
+
+
+    def rebuild(self):
+        """
+        Walk the whole tree and rebuild the index
+        """
+
+        self.dirs = {}
+        self._scan_tree('')
+
+
+    def refresh(self, rel_paths):
+        """Update the index for files/directories that were added, changed or removed.
+
+        The nearest indexed ancestor directory of each path is rescanned;
+        newly created subdirectories are scanned recursively and vanished
+        ones dropped from the index.
+
+        Args:
+            rel_paths: Iterable of paths relative to :attr:`root`.
+        """
+
+        stale = set()
+        for rel_path in rel_paths:
+            rel_dir = os.path.dirname(os.path.normpath(rel_path).strip('/'))
+            while rel_dir and rel_dir not in self.dirs:
+                rel_dir = os.path.dirname(rel_dir)
+            stale.add(rel_dir)
+
+        pending = sorted(stale)
+        while pending:
+            rel_dir = pending.pop(0)
+            if rel_dir not in self.dirs:
+                continue # dropped while refreshing a parent
+
+            local_bytes, subdirs = self._scan_dir(rel_dir)
+            if local_bytes is None:
+                # directory removed, its parent needs rescanning too
+                self._drop_tree(rel_dir)
+                if rel_dir:
+                    pending.append(os.path.dirname(rel_dir))
+                continue
+
+            self.dirs[rel_dir] = local_bytes
+
+            prefix = f"{rel_dir}/" if rel_dir else ''
+            known = {key[len(prefix):] for key in self.dirs if key.startswith(prefix) and key != rel_dir and '/' not in key[len(prefix):]}
+
+            for name in known - set(subdirs):
+                self._drop_tree(self._join(rel_dir, name))
+            for name in set(subdirs) - known:
+                self._scan_tree(self._join(rel_dir, name))
+
+
+    def total(self, rel_dir=''):
+        """
+        Return the total size in bytes of the subtree at rel_dir, or None if
+        it is not in the index.
+        """
+
+        if rel_dir not in self.dirs:
+            return None
+
+        if not rel_dir:
+            return sum(self.dirs.values())
+
+        prefix = f"{rel_dir}/"
+        return sum(size for key, size in self.dirs.items() if key == rel_dir or key.startswith(prefix))
+
+
+def start_change_listener(ovdm, changes: queue.Queue) -> None:
+    """Register the ``updateDirectorySizes`` Gearman task in a background thread.
+
+    Each job carries the ``cruiseID`` and the ``files`` (``new``, ``updated``,
+    ``deleted``) of a completed transfer, relative to the cruise directory.
+    The paths are queued for the main loop.
+
+    Args:
+        ovdm: :class:`~server.lib.openvdm.OpenVDM` instance.
+        changes: Queue receiving ``(cruise_id, [paths])`` tuples.
+    """
+
+    def task_update_directory_sizes(_worker, current_job):
+        try:
+            payload_obj = json.loads(current_job.data)
+            files = payload_obj.get('files', {})
+            paths = files.get('new', []) + files.get('updated', []) + files.get('deleted', [])
+            changes.put((payload_obj.get('cruiseID'), paths))
+        except Exception as err:
+            logging.warning("Unable to parse job data: %s", err)
+
+        return json.dumps({'parts': [{"partName": "Queue size update", "result": "Pass"}]})
+
+    def listen():
+        worker = python3_gearman.GearmanWorker([ovdm.get_gearman_server()])
+        worker.set_client_id(f"{__file__}:listener")
+        logging.info("\tTask: %s", TASK_NAMES['UPDATE_DIRECTORY_SIZES'])
+        worker.register_task(TASK_NAMES['UPDATE_DIRECTORY_SIZES'], task_update_directory_sizes)
+        worker.work()
+
+    threading.Thread(target=listen, name='size_update_listener', daemon=True).start()
+
+
+def size_cacher(interval: int, reconcile_interval: int) -> None:
+    """Keep cruise and lowering directory sizes current in the OpenVDM API.
+
+    Runs an infinite loop.  The cruise directory is indexed with a full walk
+    on start-up, whenever the cruise changes and every *reconcile_interval*
+    seconds; in between the index is updated from the file lists queued by
+    :func:`start_change_listener`.  Sizes are written back to OpenVDM via
     :py:meth:`~server.lib.openvdm.OpenVDM.set_cruise_size` and
-    :py:meth:`~server.lib.openvdm.OpenVDM.set_lowering_size`.  The loop then
-    sleeps until ``interval`` seconds have elapsed since the start of the
-    previous iteration.
+    :py:meth:`~server.lib.openvdm.OpenVDM.set_lowering_size` whenever they
+    change.  The loop then sleeps until ``interval`` seconds have elapsed
+    since the start of the previous iteration.
 
     Args:
-        interval: Minimum number of seconds between consecutive size
-            calculations.
+        interval: Minimum number of seconds between consecutive updates.
+        reconcile_interval: Number of seconds between full directory walks.
     """
 
     ovdm = OpenVDM()
+    changes = queue.Queue()
+    start_change_listener(ovdm, changes)
+
+    index = None
+    cruise_id = None
+    last_reconcile = 0
+    last_sizes = None
 
     def loop_delay(start_dt, interval_s):
         elapsed = (datetime.now(timezone.utc) - start_dt).total_seconds()
@@ -47,39 +252,17 @@ def size_cacher(interval: int) -> None:
         logging.debug("Elapsed Time: %.2f seconds", elapsed)
 
         if delay > 0:
-            logging.info("Sleeping for %.2f seconds", delay)
+            logging.debug("Sleeping for %.2f seconds", delay)
             time.sleep(delay)
 
 
-    def get_dir_size(path):
-        if not isdir(path):
-            logging.warning("Path is not a directory or does not exist: %s", path)
-            return None
-
-        logging.debug("Calculating size for: %s", path)
-
-        try:
-            proc = subprocess.run(
-                ['du', '-sb', path],
-                capture_output=True,
-                text=True
-            )
-
-            if proc.returncode == 0:
-                return proc.stdout.split()[0]
-            else:
-                logging.warning("du failed (some files may have disappeared): %s", proc.stderr.strip())
-                # attempt to parse partial output anyway
-                if proc.stdout:
-                    try:
-                        return proc.stdout.split()[0]
-                    except Exception:
-                        pass
-                return None
-
-        except Exception as e:
-            logging.exception("Exception while running du on %s: %s", path, e)
-            return None
+    def drain_changes():
+        pending = []
+        while True:
+            try:
+                pending.append(changes.get_nowait())
+            except queue.Empty:
+                return pending
 
 
     while True:
@@ -87,7 +270,7 @@ def size_cacher(interval: int) -> None:
 
         try:
             warehouse_config = ovdm.get_shipboard_data_warehouse_config()
-            cruise_id = ovdm.get_cruise_id()
+            current_cruise_id = ovdm.get_cruise_id()
             lowering_id = ovdm.get_lowering_id() if ovdm.get_show_lowering_components() else None
         except Exception as e:
             logging.error("Unable to retrieve data from OpenVDM API: %s", e)
@@ -95,22 +278,44 @@ def size_cacher(interval: int) -> None:
             loop_delay(start, interval)
             continue
 
-        cruise_dir = join(warehouse_config['shipboardDataWarehouseBaseDir'], cruise_id)
-        lowering_dir = join(cruise_dir, warehouse_config['loweringDataBaseDir'], lowering_id) if lowering_id else None
+        cruise_dir = join(warehouse_config['shipboardDataWarehouseBaseDir'], current_cruise_id)
+        lowering_rel_dir = join(warehouse_config['loweringDataBaseDir'], lowering_id) if lowering_id else None
 
         logging.debug("Cruise Directory: %s", cruise_dir)
-        logging.debug("Lowering Directory: %s", lowering_dir)
+        logging.debug("Lowering Directory: %s", lowering_rel_dir)
+
+        pending = drain_changes()
+
+        if not isdir(cruise_dir):
+            logging.warning("Path is not a directory or does not exist: %s", cruise_dir)
+            index = None
+
+        elif index is None or current_cruise_id != cruise_id or time.monotonic() - last_reconcile >= reconcile_interval:
+            logging.info("Calculating size for: %s", cruise_dir)
+            index = DirectorySizeIndex(cruise_dir)
+            index.rebuild()
+            last_reconcile = time.monotonic()
+
+        else:
+            paths = [path for job_cruise_id, job_paths in pending if job_cruise_id in (None, cruise_id) for path in job_paths]
+            if paths:
+                logging.debug("Refreshing size index for %d changed path(s)", len(paths))
+                index.refresh(paths)
+
+        cruise_id = current_cruise_id
 
-        cruise_size = get_dir_size(cruise_dir)
-        lowering_size = get_dir_size(lowering_dir) if lowering_dir else None
+        cruise_size = index.total() if index else None
+        lowering_size = index.total(lowering_rel_dir) if index and lowering_rel_dir else None
 
-        ovdm.set_cruise_size(cruise_size)
-        ovdm.set_lowering_size(lowering_size)
+        if (cruise_size, lowering_size) != last_sizes:
+            ovdm.set_cruise_size(cruise_size)
+            ovdm.set_lowering_size(lowering_size)
+            last_sizes = (cruise_size, lowering_size)
 
-        if cruise_size:
-            logging.info("Cruise Size: %s", cruise_size)
-        if lowering_size:
-            logging.info("Lowering Size: %s", lowering_size)
+            if cruise_size:
+                logging.info("Cruise Size: %s", cruise_size)
+            if lowering_size:
+                logging.info("Lowering Size: %s", lowering_size)
 
         loop_delay(start, interval)
 
@@ -119,6 +324,8 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='OpenVDM Directory Size Cacher')
     parser.add_argument('--interval', default=10, metavar='interval', type=int, help='Maximum update rate in seconds')
+    parser.add_argument('--reconcile', default=900, metavar='reconcile', type=int,
+                        help='Interval in seconds between full directory walks; changes not made by collection system transfers show up within this time')
     parser.add_argument('-v', '--verbosity', dest='verbosity',
                         default=0, action='count',
                         help='Increase output verbosity')
@@ -136,4 +343,4 @@ if __name__ == "__main__":
     parsed_args.verbosity = min(parsed_args.verbosity, max(LOG_LEVELS))
     logging.getLogger().setLevel(LOG_LEVELS[parsed_args.verbosity])
 
-    size_cacher(parsed_args.interval)
+    size_cacher(parsed_args.interval, parsed_args.reconcile)
@@ -287,7 +287,8 @@ def task_test_collection_system_transfer(worker, current_job):
     logging.info("Testing Source")
     worker.send_job_status(current_job, 33, 100)
 
-    job_results['parts'].extend(test_cst_source(cst_cfg, worker.source_dir))
+    # always run a fresh test (this also refreshes the cached result used by transfers)
+    job_results['parts'].extend(test_cst_source(cst_cfg, worker.source_dir, cache_ttl=0))
 
     if cst_cfg['enable'] == 1:
         logging.info("Testing Destination")
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""Trigger collection system transfers as soon as their source files change.
+
+Optional companion to the scheduler, managed by Supervisor.  Every active
+local-directory and SMB collection system transfer (optionally restricted to
+``watchedTransfers`` in ``openvdm.yaml``) gets a recursive watcher on its
+source directory: inotify for local directories, polling for SMB shares
+(which the daemon mounts read-only for the purpose) and other network
+filesystems where inotify does not see remote changes.
+
+Changes are debounced per transfer.  Once a transfer's source has been quiet
+for ``--debounce`` seconds (or changes have been pending for ``--max-delay``
+seconds) a ``runCollectionSystemTransfer`` job is submitted carrying the
+changed paths in ``changedFiles`` so the worker can skip walking the whole
+source directory.  Paths are relative to the transfer's source directory, or
+to its parent when the last component of the source directory is a wildcard.
+When changes may have been missed, or there are too many of them, the job is
+submitted without ``changedFiles`` and the worker builds the full file list.
+
+The scheduler's regular transfers keep running and reconcile anything the
+watcher misses.
+
+Usage::
+
+    transfer_watcher.py [--debounce SECONDS] [--max-delay SECONDS]
+                        [--poll-interval SECONDS] [-v ...]
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from os.path import dirname, realpath
+from python3_gearman import GearmanClient
+
+sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
+
+from server.lib.connection_utils import SMB_MOUNT_POOL, get_transfer_type, has_wildcard, normalize_transfer_config
+from server.lib.fs_watch import create_watcher, PollingWatcher
+from server.lib.openvdm import OpenVDM
+from server.workers.run_collection_system_transfer import TASK_NAMES as CST_TASKS_NAMES
+
+# Seconds between refreshes of the transfer list from the OpenVDM API
+REFRESH_INTERVAL = 60
+
+# Seconds between passes of the main loop
+TICK = 1
+
+# Above this many changed paths the job is submitted without changedFiles
+MAX_CHANGED_FILES = 10000
+
+# Seconds a transfer found running is assumed to still be running before the
+# API is asked again
+RUNNING_CHECK_INTERVAL = 30
+
+
+class WatchedTransfer:
+    """Watcher state for a single collection system transfer.
+
+    Attributes:
+        cst_id: Collection system transfer ID.
+        name: Transfer long name, for logging.
+        root: Local directory being watched.
+        watcher: :class:`~server.lib.fs_watch.InotifyWatcher` or
+            :class:`~server.lib.fs_watch.PollingWatcher` instance.
+        pending: Changed paths not yet submitted, or ``None`` when a full
+            listing is required.
+        first_change: Time the oldest pending change was seen.
+        last_change: Time the newest pending change was seen.
+        last_poll: Time the watcher was last polled.
+        busy_until: Time until which the transfer, last found running, is
+            assumed to still be running.
+        mntpoint: Pooled SMB mount holding the source, or ``None``.
+    """
+
+    def __init__(self, cst_id, name, root, watcher, mntpoint=None):
+        self.cst_id = cst_id
+        self.name = name
+        self.root = root
+        self.watcher = watcher
+        self.mntpoint = mntpoint
+        self.pending = set()
+        self.first_change = None
+        self.last_change = None
+        self.last_poll = time.time()
+        self.busy_until = 0
+
+
+    def collect(self, now):
+        """
+        Poll the watcher and merge its changes into the pending set
+        """
+
+        if now - self.last_poll < self.watcher.poll_interval:
+            return
+
+        self.last_poll = now
+        changed = self.watcher.changes()
+
+        if changed is not None and not changed:
+            return
+
+        if changed is None:
+            logging.info("%s: changes may have been missed, requesting a full listing", self.name)
+            self.pending = None
+        elif self.pending is not None:
+            self.pending.update(changed)
+            if len(self.pending) > MAX_CHANGED_FILES:
+                self.pending = None
+
+        self.first_change = self.first_change or now
+        self.last_change = now
+
+
+    def is_due(self, now, debounce, max_delay):
+        """
+        Return True if the pending changes should be submitted
+        """
+
+        if self.last_change is None:
+            return False
+
+        return now - self.last_change >= debounce or now - self.first_change >= max_delay
+
+
+    def reset(self):
+        """
+        Clear the pending changes after a successful submission
+        """
+
+        self.pending = set()
+        self.first_change = None
+        self.last_change = None
+
+
+    def close(self):
+        """
+        Stop watching and release any SMB mount
+        """
+
+        self.watcher.close()
+        if self.mntpoint is not None:
+            SMB_MOUNT_POOL.release(self.mntpoint)
+            self.mntpoint = None
+
+
+class TransferWatcher:
+    """Maintain watchers for the active local/SMB collection system transfers.
+
+    Attributes:
+        ovdm: OpenVDM API client.
+        debounce: Quiet period, in seconds, before changes are submitted.
+        max_delay: Maximum time, in seconds, changes may stay pending.
+        poll_interval: Polling interval, in seconds, for network filesystems.
+        watched: Dict of ``(cst_id, root_key)`` to :class:`WatchedTransfer`.
+    """
+
+    def __init__(self, debounce, max_delay, poll_interval):
+        self.stop = False
+        self.ovdm = OpenVDM()
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.watched = {}
+        self.gm_client = GearmanClient([self.ovdm.get_gearman_server()])
+
+
+    @staticmethod
+    def keyword_replace(s, cruise_id, lowering_id, lowering_base_dir):
+        """
+        Keyword replace matching the runCollectionSystemTransfer worker
+        """
+
+        if s == '/':
+            return s
+
+        return (s.replace('{cruiseID}', cruise_id)
+                .replace('{loweringDataBaseDir}', lowering_base_dir)
+                .replace('{loweringID}', lowering_id if lowering_id is not None else '{loweringID}')
+                .rstrip('/'))
+
+
+    @staticmethod
+    def watch_root(source_dir):
+        """
+        Return the directory to watch for source_dir: the source directory
+        itself, or its parent when the last component is a wildcard.
+        Returns None for unsupported wildcards.
+        """
+
+        if not has_wildcard(source_dir):
+            return source_dir
+
+        parent = os.path.dirname(source_dir)
+        if not parent or has_wildcard(parent):
+            return None
+
+        return parent
+
+
+    def _start_watch(self, cst, root):
+        """
+        Create the WatchedTransfer for cst watching root (relative to the
+        share for SMB transfers)
+        """
+
+        transfer_type = get_transfer_type(cst['transferType'])
+
+        if transfer_type == 'local':
+            if not os.path.isdir(root):
+                logging.debug("%s: source directory %s not found", cst['longName'], root)
+                return None
+
+            return WatchedTransfer(cst['collectionSystemTransferID'], cst['longName'], root,
+                                   create_watcher(root, self.poll_interval))
+
+        # SMB: mount the share read-only for the lifetime of the watch
+        cst_cfg = self.ovdm.get_collection_system_transfer(cst['collectionSystemTransferID'])
+        if not cst_cfg:
+            return None
+
+        cst_cfg = dict(normalize_transfer_config(cst_cfg), removeSourceFiles=0)
+
+        mntpoint, _, _ = SMB_MOUNT_POOL.acquire(cst_cfg)
+        if not mntpoint:
+            logging.warning("%s: unable to mount SMB share %s", cst['longName'], cst_cfg['smbServer'])
+            return None
+
+        local_root = os.path.join(mntpoint, root.lstrip('/'))
+
+        if not os.path.isdir(local_root):
+            logging.warning("%s: unable to watch SMB source directory %s", cst['longName'], root)
+            SMB_MOUNT_POOL.release(mntpoint)
+            return None
+
+        return WatchedTransfer(cst['collectionSystemTransferID'], cst['longName'], local_root,
+                               PollingWatcher(local_root, self.poll_interval), mntpoint)
+
+
+    def refresh(self):
+        """
+        Start watching newly active transfers and stop watching transfers that
+        are no longer active or whose source directory has changed
+        """
+
+        watched_names = self.ovdm.get_watched_transfers()
+        cruise_id = self.ovdm.get_cruise_id()
+        lowering_id = self.ovdm.get_lowering_id() or None
+        lowering_base_dir = self.ovdm.get_shipboard_data_warehouse_config()['loweringDataBaseDir']
+
+        wanted = {}
+        for cst in self.ovdm.get_active_collection_system_transfers('longName'):
+            cst = normalize_transfer_config(cst)
+
+            if get_transfer_type(cst['transferType']) not in ['local', 'smb']:
+                continue
+
+            if watched_names is not None and cst['name'] not in watched_names:
+                continue
+
+            source_dir = self.keyword_replace(cst['sourceDir'], cruise_id, lowering_id, lowering_base_dir)
+            if '{loweringID}' in source_dir:
+                continue
+
+            root = self.watch_root(source_dir)
+            if root is None:
+                logging.warning("%s: wildcards are only supported in the last path component: %s", cst['longName'], source_dir)
+                continue
+
+            wanted[(cst['collectionSystemTransferID'], root)] = cst
+
+        for key in list(self.watched):
+            if key not in wanted:
+                logging.info("Stopping watch: %s", self.watched[key].name)
+                self.watched.pop(key).close()
+
+        for key, cst in wanted.items():
+            if key in self.watched:
+                if os.path.isdir(self.watched[key].root):
+                    continue
+
+                # source directory removed (or share dropped), start over
+                self.watched.pop(key).close()
+
+            watched = self._start_watch(cst, key[1])
+            if watched is not None:
+                logging.info("Watching %s for %s (%s)", watched.root, watched.name, type(watched.watcher).__name__)
+                self.watched[key] = watched
+
+
+    def submit(self, watched):
+        """
+        Submit a runCollectionSystemTransfer job for the pending changes.
+        Returns False if the transfer is already running.  A running
+        transfer is only checked again every RUNNING_CHECK_INTERVAL seconds.
+        """
+
+        now = time.time()
+        if now < watched.busy_until:
+            return False
+
+        cst = self.ovdm.get_collection_system_transfer(watched.cst_id)
+        if cst and int(cst['status']) == 1:
+            watched.busy_until = now + RUNNING_CHECK_INTERVAL
+            logging.debug("%s: transfer in progress, holding %s change(s)", watched.name,
+                          'all' if watched.pending is None else len(watched.pending))
+            return False
+
+        gm_data = {
+            'collectionSystemTransfer': {
+                'collectionSystemTransferID': watched.cst_id
+            }
+        }
+
+        if watched.pending is not None:
+            gm_data['changedFiles'] = sorted(watched.pending)
+
+        logging.info("Submitting collection system transfer job for: %s (%s changed file(s))", watched.name,
+                     'all' if watched.pending is None else len(watched.pending))
+        self.gm_client.submit_job(CST_TASKS_NAMES['RUN_COLLECTION_SYSTEM_TRANSFER'], json.dumps(gm_data), background=True)
+        return True
+
+
+    def run(self):
+        """
+        Main loop
+        """
+
+        last_refresh = 0
+
+        while not self.stop:
+            now = time.time()
+
+            if now - last_refresh >= REFRESH_INTERVAL:
+                last_refresh = now
+                try:
+                    if self.ovdm.get_system_status() == 'Off':
+                        logging.debug("System current set to Off")
+                        self.close()
+                    else:
+                        self.refresh()
+                except Exception as err:
+                    logging.error("Unable to refresh transfers from OpenVDM API: %s", err)
+
+            # inotify events are queued by the kernel between ticks
+            time.sleep(TICK)
+
+            now = time.time()
+            for watched in self.watched.values():
+                watched.collect(now)
+
+                if not watched.is_due(now, self.debounce, self.max_delay):
+                    continue
+
+                try:
+                    if self.submit(watched):
+                        watched.reset()
+                except Exception as err:
+                    logging.error("Unable to submit job for %s: %s", watched.name, err)
+
+        self.close()
+
+
+    def close(self):
+        """
+        Stop all watches
+        """
+
+        for watched in self.watched.values():
+            watched.close()
+        self.watched = {}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='OpenVDM Collection System Transfer Watcher')
+    parser.add_argument('--debounce', type=float, default=10,
+                        help='seconds without changes before a transfer is triggered')
+    parser.add_argument('--max-delay', type=float, default=300,
+                        help='maximum seconds changes may be held back by --debounce')
+    parser.add_argument('--poll-interval', type=float, default=60,
+                        help='seconds between scans of SMB/network mounted sources')
+    parser.add_argument('-v', '--verbosity', dest='verbosity',
+                        default=0, action='count',
+                        help='Increase output verbosity')
+
+    parsed_args = parser.parse_args()
+
+    ############################
+    # Set up logging before we do any other argument parsing (so that we
+    # can log problems with argument parsing).
+
+    LOGGING_FORMAT = '%(asctime)-15s %(levelname)s - %(message)s'
+    logging.basicConfig(format=LOGGING_FORMAT)
+
+    LOG_LEVELS = {0: logging.WARNING, 1: logging.INFO, 2: logging.DEBUG}
+    parsed_args.verbosity = min(parsed_args.verbosity, max(LOG_LEVELS))
+    logging.getLogger().setLevel(LOG_LEVELS[parsed_args.verbosity])
+
+    transfer_watcher = TransferWatcher(parsed_args.debounce, parsed_args.max_delay, parsed_args.poll_interval)
+
+    def sigquit_handler(_signo, _stack_frame):
+        """
+        Signal Handler for QUIT
+        """
+
+        logging.warning("QUIT Signal Received")
+        transfer_watcher.stop = True
+
+    signal.signal(signal.SIGQUIT, sigquit_handler)
+    signal.signal(signal.SIGINT, sigquit_handler)
+    signal.signal(signal.SIGTERM, sigquit_handler)
+
+    transfer_watcher.run()
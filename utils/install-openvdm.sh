@@ -950,6 +950,16 @@ autostart=true
 autorestart=true
 stopsignal=INT
 
+[program:transfer_watcher]
+command=${VENV_BIN}/python server/workers/transfer_watcher.py
+directory=${INSTALL_ROOT}/openvdm
+redirect_stderr=true
+stdout_logfile=/var/log/openvdm/transfer_watcher.log
+user=root
+autostart=false
+autorestart=true
+stopsignal=INT
+
 [group:openvdm]
 programs=cruise,cruise_directory,data_dashboard,lowering,lowering_directory,md5_summary,post_hooks,reboot_reset,run_collection_system_transfer,run_cruise_data_transfer,run_ship_to_shore_transfer,scheduler,size_cacher,stop_job,test_collection_system_transfer,test_cruise_data_transfer
 